@@ -1,23 +1,75 @@
+import asyncio
 import logging
-from datetime import datetime
-from typing import Optional, List, Dict
-
-import pytz
-from fastapi import FastAPI, Query as fastapi_Query, Depends, HTTPException, status
+import math
+from typing import Any, AsyncIterator, Optional, List, Dict, Tuple
+
+from fastapi import (
+    BackgroundTasks,
+    FastAPI,
+    Query as fastapi_Query,
+    Depends,
+    Header,
+    HTTPException,
+    status,
+    Response,
+)
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from geoalchemy2 import func
-from geojson import FeatureCollection
 from icecream import ic
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Query, selectinload
 
 from .dependencies import (
+    Session as SessionFactory,
     get_db,
+    get_filters,
+    get_detail,
+    get_format,
+    get_stream,
+    get_encoding,
+    get_episode_page,
+    apply_filters,
+    within_radius,
+    centroid_distance_sql,
     make_site_geojson,
     miles_to_meters,
+    meters_to_miles,
+    batch_query_sql,
+    MAX_NEAREST,
+    MAX_BATCH,
+)
+from .cache import (
+    dump,
+    episode_cache,
+    feature_cache,
+    query_cache,
+    query_key,
+    tile_cache,
+)
+from .coalesce import query_flights, tile_flights
+from .dataset import dataset, episode_dataset
+from .episodes import make_page, page_sql
+from .formats import OutputFormat, encode_feature, add_properties, assemble
+from .models.schemas import QueryItemSchema
+from .planar import PLANAR_MODE, planar_point_sql
+from .podcast import episode_sync, PODCAST_SYNC_SECONDS
+from .models.tables import Site
+from .compression import compress_stream
+from .responses import (
+    DISTANCE_ORIGIN_HEADER,
+    FastJSONResponse,
+    cache_headers,
+    encoded_response,
+    etag_matches,
+    make_etag,
+    not_modified,
 )
-from .models.tables import Site, Episodes
+from .snapshot import snapshot, SNAPSHOT_MODE
+from .streaming import frame, MEDIA_TYPES as STREAM_MEDIA_TYPES, STREAM_BATCH_SIZE
+from .tiles import tile_sql, valid_tile, MEDIA_TYPE as TILE_MEDIA_TYPE
+from .views import SITE_VIEW, VIEW_NAME, ViewSite, radius_view_sql, site_features, view_columns
 
 app = FastAPI()
 
@@ -39,6 +91,36 @@ logging.basicConfig(
 )
 
 
+@app.on_event("startup")
+async def startup():
+    # learn which dataset versions we're serving, then watch for the loader or another worker writing new ones
+    try:
+        await dataset.refresh(SessionFactory)
+        await episode_dataset.refresh(SessionFactory)
+    except Exception as e:
+        logging.error(e)
+    app.state.dataset_poll = asyncio.create_task(dataset.poll(SessionFactory))
+    app.state.episode_dataset_poll = asyncio.create_task(episode_dataset.poll(SessionFactory))
+
+    # keep the episodes in step with Buzzsprout on a schedule, if one is set
+    app.state.episode_poll = None
+    if PODCAST_SYNC_SECONDS > 0:
+        app.state.episode_poll = asyncio.create_task(episode_sync.poll(SessionFactory))
+
+    # in snapshot mode, sites are served from memory- load them before taking traffic
+    if SNAPSHOT_MODE:
+        await snapshot.load(SessionFactory)
+        dataset.prepare(lambda version: snapshot.load(SessionFactory))
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.dataset_poll.cancel()
+    app.state.episode_dataset_poll.cancel()
+    if app.state.episode_poll is not None:
+        app.state.episode_poll.cancel()
+
+
 # THIS ENDPOINT IS USED IN TESTING TO ESTABLISH FUNCTIONALITY AND TRIGGER DB STARTUP/TEARDOWN PROCEDURE
 # PUBLIC ENDPOINT
 @app.get("/")
@@ -48,59 +130,122 @@ async def liveness_check():
 
 # THIS ENDPOINT IS USED TO QUERY PARKS NEAR THE USER
 # PUBLIC ENDPOINT
-@app.get("/query")
+@app.get("/query", response_class=FastJSONResponse)
 async def query(
     latitude: float,
     longitude: float,
     radius: float = Depends(miles_to_meters),
-    equipment: Optional[str] = fastapi_Query(None),
-    amenities: Optional[str] = fastapi_Query(None),
-    sports_facilities: Optional[str] = fastapi_Query(None),
-    Session: AsyncSession = Depends(get_db),
-) -> FeatureCollection:
+    filters: Dict[str, Dict[str, int]] = Depends(get_filters),
+    detail: str = Depends(get_detail),
+    fmt: OutputFormat = Depends(get_format),
+    stream: Optional[str] = Depends(get_stream),
+    encoding: Optional[str] = Depends(get_encoding),
+    if_none_match: Optional[str] = Header(None),
+) -> Response:
     logging.info("Query received")
     logging.info("\n\n***QUERY PARAMETERS***\n")
+    logging.info("Query point: POINT(%s %s)", longitude, latitude)
+    logging.info("Filters: %s", filters)
 
-    # prepare PostGIS geometry object
-    query_point = f"POINT({longitude} {latitude})"
-    logging.info("Query point: %s", query_point)
+    if stream is not None and fmt.name == "topojson":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="TopoJSON responses can't be streamed",
+        )
 
-    if equipment:
-        equipment = equipment.split(",")
-        if len(equipment) == 1:
-            equipment = list(equipment)
+    # nearby, equivalent queries share a cached response
+    # streams run with the request's own point and radius, so they aren't snapped
+    key = query_key(
+        latitude,
+        longitude,
+        radius,
+        filters,
+        detail,
+        fmt.key,
+        quantize=stream is None and query_cache.enabled,
+    )
 
-    if amenities:
-        amenities = amenities.split(",")
-        if len(amenities) == 1:
-            amenities = list(amenities)
+    # the etag names the exact answer we'd send, so a client that already has it is told before any work is done
+    etag = make_etag(key if stream is None else key + (stream,))
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    if stream is not None:
+        # streamed responses are written as they're read, so they skip the query cache
+        body = frame(stream_features(latitude, longitude, radius, filters, detail, fmt), stream)
+        headers = cache_headers(etag)
+        headers[DISTANCE_ORIGIN_HEADER] = distance_origin(key)
+        if encoding is not None:
+            body = compress_stream(body, encoding)
+            headers["Content-Encoding"] = encoding
+        return StreamingResponse(body, media_type=STREAM_MEDIA_TYPES[stream], headers=headers)
+
+    content = query_cache.get(key)
+    if content is not None:
+        logging.info("CACHE: Results returned -- endpoint service COMPLETE\n\n")
+        response = encoded_response(content, encoding, cache=query_cache, key=key, etag=etag)
+        response.headers[DISTANCE_ORIGIN_HEADER] = distance_origin(key)
+        return response
+
+    async def fetch() -> bytes:
+        # the query runs with the snapped point and radius, so the cached answer is right for the whole key
+        # the task gets its own session, since it may outlive the request that started it
+        version, snapped_latitude, snapped_longitude, snapped_radius = key[:4]
+        result = await find_features(
+            snapped_latitude,
+            snapped_longitude,
+            snapped_radius,
+            filters,
+            SessionFactory(),
+            detail,
+            fmt,
+            version,
+        )
+        query_cache.put(key, result)
+        return result
 
-    if sports_facilities:
-        sports_facilities = sports_facilities.split(",")
-        if len(sports_facilities) == 1:
-            sports_facilities = list(sports_facilities)
+    # identical requests arriving while this one is in flight share its result
+    content = await query_flights.run(key, fetch)
+    response = encoded_response(content, encoding, cache=query_cache, key=key, etag=etag)
+    response.headers[DISTANCE_ORIGIN_HEADER] = distance_origin(key)
+    return response
 
-    # build spatial query
-    # note: we're using PostGIS Geography objects, which are in EPSG 4326 with meters as the unit of measure.
-    query_sql = (
-        Query([Site])  # must be a list
-        .filter(  # refine sites by
-            Site.geom.ST_DWithin(  # PostGIS function
-                func.ST_GeogFromText(  # translate query point to postgis geography object
-                    query_point  # location searched
-                ),
-                radius,  # distance within which we're searching
-                True,  # since we're using Geography objects, this flag enables spheroid-based calculatitudeions
-            )
-        )
-        .options(  # this method chain allows us to specify eager loading behavior
-            selectinload(  # since we're using async/session interface, loading needs to happen in query context
-                Site.equipment
-            ),
-            selectinload(Site.amenities),
-            selectinload(Site.sports_facilities),
-        )
-    )
+
+def distance_origin(key: Tuple) -> str:
+    # the point centroid_distance is measured from, as "latitude,longitude"- for a cached /query response
+    # that's the snapped point of its query_key, not the one the client sent
+    _, latitude, longitude = key[:3]
+    return f"{latitude},{longitude}"
+
+
+async def find_features(
+    latitude: float,
+    longitude: float,
+    radius: float,
+    filters: Dict[str, Dict[str, int]],
+    Session: AsyncSession,
+    detail: str = "full",
+    fmt: OutputFormat = OutputFormat(),
+    version: Optional[int] = None,
+) -> bytes:
+    # runs a radius query and returns the serialized response in the requested format
+    # features are cached under the dataset version the request started on, see FeatureCache
+    version = dataset.version if version is None else version
+    if SNAPSHOT_MODE and snapshot.ready:
+        # answer from the in-memory index, no db round trip needed
+        features = [
+            with_centroid_distance(snapshot_feature(entry, detail, fmt, version), distance)
+            for entry, distance in snapshot.search(latitude, longitude, radius, filters)
+        ]
+        logging.info("SNAPSHOT: Results returned -- endpoint service COMPLETE\n\n")
+        return assemble(features, fmt)
+
+    # the query returns ids and distances; only sites missing from the feature cache are then read in full
+    # with the site view, both come from the view, without joins
+    if SITE_VIEW:
+        query_sql = radius_view_sql(latitude, longitude, radius, filters)
+    else:
+        query_sql = radius_query_sql(latitude, longitude, radius, filters).statement
 
     logging.debug("Query SQL: %s", str(query_sql))
     logging.info("\n\n**** TRANSACTION ****\n")
@@ -111,43 +256,14 @@ async def query(
             logging.info("Transaction: BEGIN")
             async with s.begin():
                 logging.info("SESSION: Checked out a connection")
-                res = await s.execute(query_sql.with_session(s).statement)
+                res = await s.execute(query_sql)
                 logging.info("QUERY: Submitted")
-                res = res.scalars().all()  # decode results
-
-                sites = []
-
-                # now that we have our sites, we need to remove sites that don't meet the user's filter criteria
-                # the pattern commented in the loop below is followed for the following 2 loops- ommitting comments there
-                for site in res:
-                    # this flag is triggered if a filter condition is not met
-                    skip_flag = False
-
-                    if equipment:  # if they have an equipment filter provided
-                        eq_dict = site.equipment[0].__dict__
-                        for eq in equipment:  # check the equipment in the filter
-                            if eq_dict[eq] == 0:  # if they don't have it
-                                skip_flag = True  # don't add this site to the response
-
-                    if amenities:  # as above for amenities filter
-                        amenities_dict = site.amenities[0].__dict__
-                        for amenity in amenities:
-                            if not amenities_dict[amenity]:
-                                skip_flag = True
-
-                    if sports_facilities:  # as above for sports facilities filter
-                        facilities_dict = site.sports_facilities[0].__dict__
-                        for facility in sports_facilities:
-                            if not facilities_dict[facility]:
-                                skip_flag = True
-
-                    # as long as the flag isn't triggered, add the site to the response
-
-                    if not skip_flag:
-                        site_geojson = await make_site_geojson(site)
-                        sites.append(
-                            site_geojson
-                        )  # all matching sites are added to the response object
+
+                # every site returned already meets the user's filter criteria
+                rows = res.all()
+                site_ids = [row.site_id for row in rows]
+                distances = {row.site_id: row.centroid_distance for row in rows}
+                features = await load_features(s, site_ids, detail, fmt, version)
 
                 logging.info("TRANSACTION: CLOSED")
 
@@ -157,13 +273,20 @@ async def query(
 
         logging.info("\n*** RESULT ***\n")
 
-        if len(sites) == 0:
+        if len(features) == 0:
             logging.info("QUERY: NO RESULTS -- Endpoint Service COMPLETE\n\n")
 
         logging.info("QUERY: Results returned -- endpoint service COMPLETE\n\n")
-        response_geojson = FeatureCollection(sites)
-        ic(len(response_geojson["features"]))
-        return response_geojson
+        ic(len(features))
+        # cached features are spliced into the response as they are- no re-serializing
+        return assemble(
+            [
+                with_centroid_distance(features[site_id], distances[site_id])
+                for site_id in site_ids
+                if site_id in features
+            ],
+            fmt,
+        )
 
     except Exception as e:
         logging.error(e)
@@ -173,65 +296,428 @@ async def query(
         )
 
 
-async def retrieve_episodes(session: AsyncSession) -> List[Dict]:
-    results = []
-    async with session.begin():
-        res = await session.execute(select(Episodes))
-        for r in res.scalars().all():
-            appended = r.__dict__
-            appended.pop("_sa_instance_state")
-            results.append(appended)
-    return results
+def radius_query_sql(
+    latitude: float, longitude: float, radius: float, filters: Dict[str, Dict[str, int]]
+) -> Query:
+    # build spatial query
+    # note: we're using PostGIS Geography objects, which are in EPSG 4326 with meters as the unit of measure.
+    # only the ids and centroid distances are selected here- full rows are only loaded for sites we haven't
+    # serialized yet
+    query_sql = Query(  # must be a list
+        [Site.site_id, centroid_distance_sql(latitude, longitude)]
+    ).filter(
+        within_radius(latitude, longitude, radius)  # indexed box prefilter, then the spheroid distance
+    )
 
+    # attribute filters are joined into the query, so the db only returns sites which match them
+    return apply_filters(query_sql, filters)
+
+
+async def stream_features(
+    latitude: float,
+    longitude: float,
+    radius: float,
+    filters: Dict[str, Dict[str, int]],
+    detail: str = "full",
+    fmt: OutputFormat = OutputFormat(),
+) -> AsyncIterator[List[Any]]:
+    # yields the radius query's features in batches, as they're read
+    version = dataset.version  # features are cached under the version the stream started on
+    if SNAPSHOT_MODE and snapshot.ready:
+        matches = snapshot.search(latitude, longitude, radius, filters)
+        for start in range(0, len(matches), STREAM_BATCH_SIZE):
+            batch = matches[start : start + STREAM_BATCH_SIZE]
+            yield [
+                with_centroid_distance(snapshot_feature(entry, detail, fmt, version), distance)
+                for entry, distance in batch
+            ]
+        return
+
+    # the site ids come off a server side cursor, and each batch's uncached features are loaded before the next fetch
+    # the session is our own, and its transaction ends as soon as the cursor is exhausted or the client goes away
+    try:
+        async with SessionFactory() as s:
+            async with s.begin():
+                if SITE_VIEW:
+                    query_sql = radius_view_sql(latitude, longitude, radius, filters)
+                else:
+                    query_sql = radius_query_sql(latitude, longitude, radius, filters).with_session(s).statement
+                res = await s.stream(query_sql)
+                async for rows in res.partitions(STREAM_BATCH_SIZE):
+                    site_ids = [row.site_id for row in rows]
+                    features = await load_features(s, site_ids, detail, fmt, version)
+                    yield [
+                        with_centroid_distance(features[row.site_id], row.centroid_distance)
+                        for row in rows
+                        if row.site_id in features
+                    ]
+    except Exception as e:
+        # the status line has already gone out, so the best we can do is cut the response short
+        logging.error(e)
+        raise
+
+
+async def load_features(
+    s: AsyncSession,
+    site_ids: List[str],
+    detail: str = "full",
+    fmt: OutputFormat = OutputFormat(),
+    version: Optional[int] = None,
+) -> Dict[str, Any]:
+    # serialized feature fragments for the given sites, from the feature cache where possible
+    # sites we haven't serialized for this dataset version yet are loaded in full, within the caller's transaction
+    # version is the dataset version the caller's request started on- pass it in if the caller has already
+    # read from the db, so a version change while it waited can't file these rows under the new version
+    # sites with no row at all are left out, so callers only send the features they get back
+    version = dataset.version if version is None else version
+    features = {site_id: feature_cache.get(site_id, detail, fmt.key, version) for site_id in site_ids}
+    missing = [site_id for site_id, feature in features.items() if feature is None]
+
+    if not missing:
+        return features
+
+    logging.info("CACHE: loading %s uncached sites", len(missing))
+    sites = []
+    if SITE_VIEW:
+        # one round trip for the whole site, attributes included
+        res = await s.execute(
+            select(*view_columns(detail)).where(site_features.c.site_id.in_(missing))
+        )
+        sites = [ViewSite(row) for row in res.all()]
+        # ids chosen from the tables (/nearest, /query/batch) can be ahead of a view that hasn't been refreshed
+        found = {site.site_id for site in sites}
+        missing = [site_id for site_id in missing if site_id not in found]
+        if missing:
+            logging.warning("VIEW: %s sites aren't in %s yet, reading the tables", len(missing), VIEW_NAME)
+
+    if missing:
+        res = await s.execute(
+            select(Site)
+            .where(Site.site_id.in_(missing))
+            .options(  # this method chain allows us to specify eager loading behavior
+                selectinload(  # since we're using async/session interface, loading needs to happen in query context
+                    Site.equipment
+                ),
+                selectinload(Site.amenities),
+                selectinload(Site.sports_facilities),
+            )
+        )
+        sites.extend(res.scalars().all())
+
+    for site in sites:
+        features[site.site_id] = await site_feature(site, detail, fmt, version)
+    return {site_id: feature for site_id, feature in features.items() if feature is not None}
+
+
+async def site_feature(
+    site, detail: str = "full", fmt: OutputFormat = OutputFormat(), version: Optional[int] = None
+) -> Any:
+    # serialized feature fragment for a loaded site, from the feature cache where possible
+    cached = feature_cache.get(site.site_id, detail, fmt.key, version)
+    if cached is not None:
+        return cached
+    feature = await make_site_geojson(site, detail)
+    return feature_cache.put(site.site_id, encode_feature(feature, fmt), detail, fmt.key, version)
 
-@app.get("/episodes")
-async def get_episodes(Session: AsyncSession = Depends(get_db)) -> ...:
-    async with Session as s:
-        results = retrieve_episodes(session=s)
-    return results
 
+def with_centroid_distance(feature: Any, distance: float) -> Any:
+    # a feature fragment with the query point's distance to the site centroid, in miles
+    # the cached fragment is left as it is- the property is spliced into a copy
+    return add_properties(feature, {"centroid_distance": meters_to_miles(distance)})
 
-@app.post("/update")
-async def update_episodes(Session: AsyncSession = Depends(get_db)) -> ...:
-    import os
-    import requests
 
-    headers = {"Content-Type": "application/json", "charset": "utf-8"}
-    podcast_id = 2009882
-    res = requests.get(
-        url=f'https://buzzsprout.com/api/{podcast_id}/episodes.json?api_token={os.environ.get("API_KEY")}',
-        headers=headers,
+def snapshot_feature(
+    entry, detail: str = "full", fmt: OutputFormat = OutputFormat(), version: Optional[int] = None
+) -> Any:
+    # serialized feature fragment for a snapshot entry, from the feature cache where possible
+    return feature_cache.get(entry.site_id, detail, fmt.key, version) or feature_cache.put(
+        entry.site_id, encode_feature(entry.features[detail], fmt), detail, fmt.key, version
     )
 
-    if res.ok:
-        episodes_data = res.json()
-        [
-            ep.update(
-                {
-                    "published_at": datetime.fromisoformat(ep.get("published_at"))
-                    .astimezone(pytz.UTC)
-                    .replace(tzinfo=None)
-                }
-            )
-            for ep in episodes_data
+
+# THIS ENDPOINT FINDS THE PARKS CLOSEST TO THE USER
+# PUBLIC ENDPOINT
+@app.get("/nearest", response_class=FastJSONResponse)
+async def nearest(
+    latitude: float,
+    longitude: float,
+    k: int = fastapi_Query(5, ge=1, le=MAX_NEAREST),
+    filters: Dict[str, Dict[str, int]] = Depends(get_filters),
+    detail: str = Depends(get_detail),
+    fmt: OutputFormat = Depends(get_format),
+    encoding: Optional[str] = Depends(get_encoding),
+    if_none_match: Optional[str] = Header(None),
+    Session: AsyncSession = Depends(get_db),
+) -> Response:
+    # returns the k closest sites meeting the filters, closest first, with their distance in miles
+    logging.info("Nearest query received: POINT(%s %s), k=%s", longitude, latitude, k)
+    logging.info("Filters: %s", filters)
+
+    key = query_key(latitude, longitude, 0, filters, detail, fmt.key, quantize=False)
+    version = key[0]
+    etag = make_etag(("nearest", k) + key)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    if SNAPSHOT_MODE and snapshot.ready:
+        matches = [
+            (snapshot_feature(entry, detail, fmt, version), distance)
+            for entry, distance in snapshot.nearest(latitude, longitude, k, filters)
         ]
+        content = assemble(
+            [
+                add_properties(feature, {"distance": meters_to_miles(distance)})
+                for feature, distance in matches
+            ],
+            fmt,
+        )
+        return encoded_response(content, encoding, etag=etag)
+
+    # the <-> operator orders by distance using the spatial index, so only the first k rows are ever visited
+    # the reported distance is then measured on the spheroid, like /query- or on the plane, in planar mode
+    if PLANAR_MODE:
+        query_point = planar_point_sql(longitude, latitude)
+        site_geom = Site.geom_planar
+        distance = func.ST_Distance(site_geom, query_point)
+    else:
+        query_point = func.ST_GeogFromText(f"POINT({longitude} {latitude})")
+        site_geom = func.geography(Site.geom)
+        distance = func.ST_Distance(site_geom, query_point, True)
+    query_sql = apply_filters(Query([Site.site_id, distance]), filters)
+    query_sql = query_sql.order_by(site_geom.op("<->")(query_point)).limit(k)
 
+    try:
         async with Session as s:
             async with s.begin():
-                episodes_in_db = retrieve_episodes(s)
-                existing_episode_ids = [ep.get("id") for ep in episodes_in_db]
-                eps_updates = [
-                    Episodes(**ep)
-                    for ep in episodes_data
-                    if ep not in existing_episode_ids
-                ]
-                if eps_updates:
-                    s.add_all(eps_updates)
-                    await s.commit()
-
-        return status.HTTP_200_OK
+                res = await s.execute(query_sql.with_session(s).statement)
+                distances = dict(res.all())
+                features = await load_features(s, list(distances), detail, fmt, version)
+    except Exception as e:
+        logging.error(e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Unable to retrieve nearest sites from database",
+        )
+
+    # the geography index orders on a sphere, so settle near-ties with the spheroid distance
+    ordered = sorted(distances, key=distances.get)
+    content = assemble(
+        [
+            add_properties(features[site_id], {"distance": meters_to_miles(distances[site_id])})
+            for site_id in ordered
+            if site_id in features
+        ],
+        fmt,
+    )
+    return encoded_response(content, encoding, etag=etag)
+
+
+# THIS ENDPOINT RUNS MANY RADIUS QUERIES AT ONCE, IE: FOR ROUTE PLANNING
+# PUBLIC ENDPOINT
+@app.post("/query/batch", response_class=FastJSONResponse)
+async def query_batch(
+    queries: List[QueryItemSchema],
+    fmt: OutputFormat = Depends(get_format),
+    encoding: Optional[str] = Depends(get_encoding),
+    Session: AsyncSession = Depends(get_db),
+) -> Response:
+    # returns {"features": {site_id: feature}, "results": [{"site_ids": [...]}, ...]}
+    # results line up with the queries; each site's feature is sent once however many queries return it
+    # topojson responses carry one Topology in place of the features map
+    if len(queries) > MAX_BATCH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"A batch may contain at most {MAX_BATCH} queries",
+        )
+
+    parsed = []
+    for item in queries:
+        if not all(map(math.isfinite, (item.latitude, item.longitude, item.radius))):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Query coordinates and radius must be finite numbers",
+            )
+        filters = get_filters(item.equipment, item.amenities, item.sports_facilities)
+        parsed.append((item.latitude, item.longitude, miles_to_meters(item.radius), filters))
+
+    results: List[List[str]] = [[] for _ in parsed]
+    logging.info("Batch query received: %s queries", len(parsed))
+    version = dataset.version  # features are cached under the version the request started on
+
+    if SNAPSHOT_MODE and snapshot.ready:
+        features = {}
+        for idx, (latitude, longitude, radius, filters) in enumerate(parsed):
+            for entry in snapshot.query(latitude, longitude, radius, filters):
+                results[idx].append(entry.site_id)
+                if entry.site_id not in features:
+                    features[entry.site_id] = snapshot_feature(entry, "full", fmt, version)
+
+    elif parsed:
+        try:
+            async with Session as s:
+                async with s.begin():
+                    res = await s.execute(batch_query_sql(parsed))
+                    for idx, site_id in res.all():
+                        results[idx].append(site_id)
+                    site_ids = list(dict.fromkeys(site_id for ids in results for site_id in ids))
+                    features = await load_features(s, site_ids, "full", fmt, version)
+            # only ids with a feature are listed, so every id in results is in the features map
+            results = [[site_id for site_id in ids if site_id in features] for ids in results]
+        except Exception as e:
+            logging.error(e)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Unable to retrieve batch query results from database",
+            )
+    else:
+        features = {}
+
+    if fmt.name == "topojson":
+        head = b'{"topology":' + assemble(features.values(), fmt)
     else:
-        # should raise error
-        return status.HTTP_500_INTERNAL_SERVER_ERROR(
-            "An error occurred while retrieving from buzzsprout!"
+        head = (
+            b'{"features":{'
+            + b",".join(dump(site_id) + b":" + feature for site_id, feature in features.items())
+            + b"}"
+        )
+    content = (
+        head
+        + b',"results":['
+        + b",".join(dump({"site_ids": site_ids}) for site_ids in results)
+        + b"]}"
+    )
+    return encoded_response(content, encoding)
+
+
+# THIS ENDPOINT SERVES MAP TILES OF THE SITE POLYGONS
+# PUBLIC ENDPOINT
+@app.get("/tiles/{z}/{x}/{y}.mvt")
+async def tile(
+    z: int,
+    x: int,
+    y: int,
+    encoding: Optional[str] = Depends(get_encoding),
+    if_none_match: Optional[str] = Header(None),
+) -> Response:
+    if not valid_tile(z, x, y):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Tile does not exist"
+        )
+
+    key = (dataset.version, z, x, y)
+    etag = make_etag(("tile",) + key)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    content = tile_cache.get(key)
+    if content is None:
+
+        async def fetch() -> bytes:
+            async with SessionFactory() as s:
+                async with s.begin():
+                    res = await s.execute(tile_sql, {"z": z, "x": x, "y": y})
+                    result = bytes(res.scalar() or b"")
+            tile_cache.put(key, result)
+            return result
+
+        try:
+            content = await tile_flights.run(key, fetch)
+        except Exception as e:
+            logging.error(e)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Unable to build tile from database",
+            )
+
+    return encoded_response(
+        content, encoding, TILE_MEDIA_TYPE, cache=tile_cache, key=key, etag=etag
+    )
+
+
+# THIS ENDPOINT REBUILDS THE IN-MEMORY SITE INDEX AFTER THE DATA CHANGES
+@app.post("/snapshot/rebuild")
+async def rebuild_snapshot() -> Dict:
+    # the caches are dropped once the new index is in place- anything cached while it loaded came from the old one
+    try:
+        count = await snapshot.load(SessionFactory)
+        feature_cache.invalidate()
+        query_cache.invalidate()
+        tile_cache.invalidate()
+    except Exception as e:
+        logging.error(e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Unable to rebuild site snapshot from database",
+        )
+    return {"sites": count, "loaded_at": snapshot.loaded_at}
+
+
+# THIS ENDPOINT REPORTS HOW WELL THE CACHES ARE DOING
+@app.get("/cache/stats")
+async def cache_stats() -> Dict:
+    return {
+        "dataset_version": dataset.version,
+        "episode_version": episode_dataset.version,
+        "features": len(feature_cache),
+        "queries": query_cache.stats(),
+        "tiles": tile_cache.stats(),
+        "episodes": episode_cache.stats(),
+        "coalescing": query_flights.stats(),
+        "tile_coalescing": tile_flights.stats(),
+        "episode_sync": {
+            "running": episode_sync.running,
+            "last_run": episode_sync.last_run,
+            "last_result": episode_sync.last_result,
+        },
+    }
+
+
+async def fetch_episode_page(
+    Session: AsyncSession, cursor: Optional[Tuple], limit: int, fields: List[str]
+) -> bytes:
+    # one keyset page, serialized- it reads at most limit + 1 rows off the (published_at, id) index
+    async with Session as s:
+        res = await s.execute(page_sql(cursor, limit, fields))
+        rows = [dict(row) for row in res.mappings().all()]
+    return dump(make_page(rows, limit))
+
+
+@app.get("/episodes", response_class=FastJSONResponse)
+async def get_episodes(
+    page: Tuple[Optional[Tuple], int, List[str]] = Depends(get_episode_page),
+    encoding: Optional[str] = Depends(get_encoding),
+    if_none_match: Optional[str] = Header(None),
+    Session: AsyncSession = Depends(get_db),
+) -> Response:
+    # newest episodes first, a page at a time- follow "next" for the page after
+    # episodes change through /update, which bumps the episode version, or the loader, which bumps the dataset
+    # version- either clears the page cache
+    cursor, limit, fields = page
+    key = (dataset.version, episode_dataset.version, cursor, limit, tuple(fields))
+    etag = make_etag(("episodes",) + key)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    content = episode_cache.get(key)
+    if content is None:
+        content = await fetch_episode_page(Session, cursor, limit, fields)
+        episode_cache.put(key, content)
+    return encoded_response(content, encoding, cache=episode_cache, key=key, etag=etag)
+
+
+@app.post("/update", status_code=status.HTTP_202_ACCEPTED)
+async def update_episodes(background_tasks: BackgroundTasks, response: Response, wait: bool = False) -> Dict:
+    # syncs the episodes from Buzzsprout, see api.podcast
+    # by default the sync runs after the response is sent; wait=true runs it first and returns what it wrote
+    if not wait:
+        background_tasks.add_task(episode_sync.run, SessionFactory)
+        return {"status": "scheduled"}
+
+    result = await episode_sync.run(SessionFactory)
+    if "error" in result:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="An error occurred while retrieving from buzzsprout!",
         )
+    response.status_code = status.HTTP_200_OK
+    return result
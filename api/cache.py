@@ -0,0 +1,233 @@
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+
+from .compression import compress
+from .dataset import dataset, episode_dataset
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# QUERY CACHE SETTINGS
+# most traffic comes from the same few neighbourhoods, so near-identical queries share one cached response
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", 1024))  # entries, 0 disables the cache
+QUERY_CACHE_MAX_BYTES = int(os.environ.get("QUERY_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", 300))  # seconds
+QUERY_CACHE_GRID = float(os.environ.get("QUERY_CACHE_GRID", 0.001))  # degrees, ~100m at our latitude
+QUERY_CACHE_RADIUS_STEP = float(os.environ.get("QUERY_CACHE_RADIUS_STEP", 100))  # meters
+
+# TILE CACHE SETTINGS
+# tiles only change with the data, so they can be kept much longer than query responses
+TILE_CACHE_SIZE = int(os.environ.get("TILE_CACHE_SIZE", 4096))
+TILE_CACHE_MAX_BYTES = int(os.environ.get("TILE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+TILE_CACHE_TTL = float(os.environ.get("TILE_CACHE_TTL", 24 * 60 * 60))
+
+# EPISODE CACHE SETTINGS
+# serialized /episodes pages- they only change when the podcast sync (or the loader) writes episodes
+EPISODE_CACHE_SIZE = int(os.environ.get("EPISODE_CACHE_SIZE", 256))
+EPISODE_CACHE_MAX_BYTES = int(os.environ.get("EPISODE_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+EPISODE_CACHE_TTL = float(os.environ.get("EPISODE_CACHE_TTL", 60 * 60))
+
+
+def dump(obj) -> bytes:
+    # compact utf-8 json, the same document FastAPI's JSONResponse would send
+    # orjson is several times faster on our features; the stdlib encoder is kept as a fallback
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(
+        obj, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def feature_collection(features: Iterable[bytes]) -> bytes:
+    # splices serialized features into a FeatureCollection without decoding them again
+    return b'{"type":"FeatureCollection","features":[' + b",".join(features) + b"]}"
+
+
+def with_properties(feature: bytes, properties: Dict) -> bytes:
+    # adds per-response properties, ie: distance, to a serialized feature without decoding it
+    # features are encoded with properties as the last key, so the object always ends with "}}"
+    extra = b",".join(dump(name) + b":" + dump(value) for name, value in properties.items())
+    if not feature.endswith(b"{}}"):
+        extra = b"," + extra
+    return feature[:-2] + extra + b"}}"
+
+
+class FeatureCache:
+    # ready-to-send feature fragments, keyed by site id, dataset version, level of detail and output format
+    # geojson features are stored as bytes; see api.formats for the other formats
+    # filled lazily by the query paths, and emptied when the dataset version changes
+    # callers pass the version their request started on, so a fragment built from rows read before a version
+    # change is never filed under the new version
+
+    def __init__(self):
+        self._features: Dict[Tuple[str, int, str, str], Any] = {}
+
+    def __len__(self):
+        return len(self._features)
+
+    def get(
+        self, site_id: str, detail: str = "full", fmt: str = "geojson", version: Optional[int] = None
+    ) -> Optional[Any]:
+        version = dataset.version if version is None else version
+        return self._features.get((site_id, version, detail, fmt))
+
+    def put(
+        self,
+        site_id: str,
+        fragment: Any,
+        detail: str = "full",
+        fmt: str = "geojson",
+        version: Optional[int] = None,
+    ) -> Any:
+        version = dataset.version if version is None else version
+        self._features[(site_id, version, detail, fmt)] = fragment
+        return fragment
+
+    def invalidate(self, version: Optional[int] = None):
+        # drops every feature not built for the given version, or everything
+        self._features = {
+            key: encoded
+            for key, encoded in self._features.items()
+            if version is not None and key[1] == version
+        }
+
+
+def query_key(
+    latitude: float,
+    longitude: float,
+    radius: float,
+    filters: Dict[str, Dict[str, int]],
+    detail: str = "full",
+    fmt: str = "geojson",
+    quantize: bool = True,
+) -> Tuple:
+    # normalizes query parameters so nearby, equivalent requests share a cache entry
+    # the point is snapped to the grid and the radius rounded up to the next step; the query is then run
+    # with those snapped values, so every request sharing a key gets exactly the same answer.
+    # that includes centroid_distance, which is measured from the snapped point- up to about half a grid step
+    # (~60m with the default grid) from what the client's own point would give.  the response's
+    # X-Distance-Origin header names the point used, so clients that need exact distances can correct them
+    def snap(value: float) -> float:
+        return round(round(value / QUERY_CACHE_GRID) * QUERY_CACHE_GRID, 7)
+
+    if quantize:
+        latitude, longitude = snap(latitude), snap(longitude)
+        radius = math.ceil(radius / QUERY_CACHE_RADIUS_STEP - 1e-9) * QUERY_CACHE_RADIUS_STEP
+    normalized = tuple(
+        (param, tuple(sorted(minimums.items())))
+        for param, minimums in sorted(filters.items())
+    )
+    return dataset.version, latitude, longitude, radius, normalized, detail, fmt
+
+
+class ResponseCache:
+    # bounded LRU of response bodies with a time to live, used for query responses, tiles and episode pages
+    # keys include the dataset version, and the whole cache is dropped when the version changes
+    # compressed copies of a body are kept in its entry, and count towards the byte bound
+
+    def __init__(
+        self,
+        max_entries: int = QUERY_CACHE_SIZE,
+        max_bytes: int = QUERY_CACHE_MAX_BYTES,
+        ttl: float = QUERY_CACHE_TTL,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, bytes, Dict[str, bytes]]]" = OrderedDict()
+        self.size = 0  # bytes currently held
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires, content, _ = entry
+        if expires < time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)  # most recently used
+        self.hits += 1
+        return content
+
+    def put(self, key: Hashable, content: bytes):
+        if not self.enabled or len(content) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (time.monotonic() + self.ttl, content, {})
+        self.size += len(content)
+        self._evict()
+
+    def encoded(self, key: Hashable, encoding: str, content: bytes) -> bytes:
+        # the body compressed with the given encoding, compressed at most once while the entry lives
+        # a body that isn't (or is no longer) cached under the key is just compressed
+        entry = self._entries.get(key)
+        if entry is None or entry[1] is not content:
+            return compress(content, encoding)
+
+        variants = entry[2]
+        compressed = variants.get(encoding)
+        if compressed is None:
+            compressed = variants[encoding] = compress(content, encoding)
+            self.size += len(compressed)
+            self._evict()
+        return compressed
+
+    def _evict(self):
+        # evict least recently used entries until we're back inside both bounds
+        while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        _, content, variants = self._entries.pop(key)
+        self.size -= len(content) + sum(map(len, variants.values()))
+
+    def invalidate(self, version: Optional[int] = None):
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+# instantiate- these objects are imported in main script
+feature_cache = FeatureCache()
+query_cache = ResponseCache()
+tile_cache = ResponseCache(TILE_CACHE_SIZE, TILE_CACHE_MAX_BYTES, TILE_CACHE_TTL)
+episode_cache = ResponseCache(EPISODE_CACHE_SIZE, EPISODE_CACHE_MAX_BYTES, EPISODE_CACHE_TTL)
+dataset.subscribe(feature_cache.invalidate)
+dataset.subscribe(query_cache.invalidate)
+dataset.subscribe(tile_cache.invalidate)
+dataset.subscribe(episode_cache.invalidate)  # the loader writes episodes too
+episode_dataset.subscribe(episode_cache.invalidate)
@@ -0,0 +1,44 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    # coalesces identical concurrent work: the first caller for a key starts a task,
+    # and everyone arriving while it's still running waits on that same task
+    # nothing is kept once the task finishes, so results are never stale
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.executed = 0  # tasks actually started
+        self.coalesced = 0  # callers who shared someone else's task
+
+    async def run(self, key: Hashable, work: Callable[[], Awaitable]):
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(work())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+            self.executed += 1
+        else:
+            self.coalesced += 1
+
+        # shielded, so one caller disconnecting doesn't cancel the work for everyone else
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every caller has gone away
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": len(self._in_flight),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+        }
+
+
+# instantiate- these objects are imported in main script
+query_flights = SingleFlight()
+tile_flights = SingleFlight()
@@ -0,0 +1,72 @@
+import gzip
+import os
+import zlib
+from typing import AsyncIterator, Optional
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# RESPONSE COMPRESSION
+# geojson compresses 5-10x, so feature and tile responses are sent gzip or brotli encoded when the client accepts it.
+# cached responses keep their compressed copies next to the raw bytes, see cache.ResponseCache.encoded
+
+# bodies smaller than this are sent as they are- the headers and cpu aren't worth it
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))  # bytes
+GZIP_LEVEL = int(os.environ.get("GZIP_LEVEL", 6))  # 1-9
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", 5))  # 0-11
+
+# most preferred first, used to break ties between encodings the client weights equally
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    # picks the encoding to send from an Accept-Encoding header, or None for identity
+    if not accept_encoding:
+        return None
+
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in ENCODINGS:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def worth_compressing(content: bytes) -> bool:
+    return len(content) >= COMPRESSION_MIN_SIZE
+
+
+def compress(content: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(content, quality=BROTLI_QUALITY)
+    # a fixed mtime keeps the output the same for the same payload
+    return gzip.compress(content, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+async def compress_stream(chunks: AsyncIterator[bytes], encoding: str) -> AsyncIterator[bytes]:
+    # compresses a streamed body chunk by chunk, flushing each so the client can decode as it arrives
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        async for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+        return
+
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    async for chunk in chunks:
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
@@ -0,0 +1,106 @@
+import asyncio
+import inspect
+import logging
+import os
+from typing import Callable, List, Optional
+
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert
+
+from .models.tables import DatasetVersion
+
+# how often the api checks whether the loader has written new data, in seconds
+DATASET_POLL_SECONDS = float(os.environ.get("DATASET_POLL_SECONDS", 30))
+
+# dataset_version rows: the site data, and the podcast episodes, which change on their own schedule
+SITES_VERSION_ID = 1
+EPISODES_VERSION_ID = 2
+
+
+def bump_version_statement(version_id: int = SITES_VERSION_ID):
+    # upsert for a dataset_version row- shared by the api and the loader
+    stmt = insert(DatasetVersion).values(id=version_id, version=1, updated_at=func.now())
+    return stmt.on_conflict_do_update(
+        index_elements=[DatasetVersion.id],
+        set_={
+            "version": DatasetVersion.version + 1,
+            "updated_at": func.now(),
+        },
+    ).returning(DatasetVersion.version)
+
+
+class Dataset:
+    # tracks the dataset version this process is serving
+    # caches subscribe to it, and are invalidated when the version changes
+
+    def __init__(self, version_id: int = SITES_VERSION_ID):
+        self.version_id = version_id  # the dataset_version row this follows
+        self.version = 0
+        self._preparers: List[Callable] = []
+        self._listeners: List[Callable] = []
+        self._lock: Optional[asyncio.Lock] = None  # made on first use, on the running event loop
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def prepare(self, callback: Callable):
+        # callback(version) is called, or awaited, before a new version is served, ie: to load the snapshot
+        # it describes.  requests keep being answered from the old version until every preparer is done
+        self._preparers.append(callback)
+
+    def subscribe(self, callback: Callable):
+        # callback(version) is called, or awaited, after every version change, ie: to drop cached responses
+        # cache invalidation should be synchronous, so no request sees the new version before it's done
+        self._listeners.append(callback)
+
+    async def set(self, version: int):
+        # one change at a time- a second call for the same version waits, then finds nothing to do
+        async with self.lock:
+            if version == self.version:
+                return
+            logging.info("DATASET: version %s -> %s", self.version, version)
+            for callback in self._preparers:
+                result = callback(version)
+                if inspect.isawaitable(result):
+                    await result
+            # synchronous listeners run before anything else does, so the switch and the cache invalidation
+            # happen between two requests
+            self.version = version
+            for callback in self._listeners:
+                result = callback(version)
+                if inspect.isawaitable(result):
+                    await result
+
+    async def refresh(self, Session) -> int:
+        # reads the stored version and invalidates caches if it moved
+        async with Session() as s:
+            async with s.begin():
+                res = await s.execute(
+                    select(DatasetVersion.version).where(DatasetVersion.id == self.version_id)
+                )
+                version = res.scalar() or 0
+        await self.set(version)
+        return version
+
+    async def bump(self, session) -> int:
+        # records a write in the db, within the caller's transaction
+        # the new version is applied to this process once the caller's transaction has committed
+        res = await session.execute(bump_version_statement(self.version_id))
+        return res.scalar()
+
+    async def poll(self, Session, interval: float = DATASET_POLL_SECONDS):
+        # picks up versions written by other processes, ie: the loader
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh(Session)
+            except Exception as e:
+                logging.error(e)
+
+
+# instantiate- this object is imported in main script
+dataset = Dataset()
+episode_dataset = Dataset(EPISODES_VERSION_ID)
@@ -1,16 +1,31 @@
 import os
+from typing import Optional, Dict, List, Tuple
 
-from geoalchemy2 import shape
-from geojson import Feature, Polygon
+from fastapi import Header, Query, HTTPException, status
+from sqlalchemy import Float, Integer, and_, column, func, or_, select, true, values
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, selectinload
 
+from .compression import negotiate
+from .episodes import EPISODE_PAGE_SIZE, MAX_EPISODE_PAGE, decode_cursor, page_fields
+from .formats import OutputFormat, FORMATS, DEFAULT_PRECISION
+from .geometry import (
+    geometry_to_geojson,
+    detail_element,
+    detail_for_zoom,
+    search_bounds,
+    CENTROID_MARGIN,
+    COORDINATE_PRECISION,
+    DETAIL_TOLERANCES,
+)
 from .models.schemas import (
     EquipmentSchema,
     AmenitiesSchema,
     SportsFacilitiesSchema,
 )
-from .models.tables import Site
+from .models.tables import Site, Equipment, Amenities, SportsFacilities
+from .planar import PLANAR_MODE, PLANAR_SRID, planar_point, planar_point_sql
+from .streaming import STREAM_MODES
 
 url = os.environ.get("SECRET_URL")
 engine = create_async_engine(url=url, echo=False, future=True)
@@ -38,6 +53,150 @@ def miles_to_meters(radius: float):
     return radius * 1609.34
 
 
+def meters_to_miles(distance: float):
+    # converts PostGIS distances back to the unit users search with
+    return distance / 1609.34
+
+
+# -- LIMITS --
+# most sites /nearest will return in one request
+MAX_NEAREST = int(os.environ.get("MAX_NEAREST", 50))
+# most queries /query/batch will run in one request
+MAX_BATCH = int(os.environ.get("MAX_BATCH", 500))
+
+
+# -- FILTERS --
+# attribute filters map the query parameter name to the table holding its columns
+FILTER_TABLES = {
+    "equipment": Equipment,
+    "amenities": Amenities,
+    "sports_facilities": SportsFacilities,
+}
+
+# attribute names each feature carries, in schema order
+ATTRIBUTE_FIELDS = {
+    "equipment": list(EquipmentSchema.__fields__),
+    "amenities": list(AmenitiesSchema.__fields__),
+    "sports_facilities": list(SportsFacilitiesSchema.__fields__),
+}
+
+
+def split_filter(param: str, values: Optional[List[str]]) -> Dict[str, int]:
+    # turns repeated and/or comma-separated filter params into {column name: minimum count}
+    # a bare name means "at least one"; name>=N asks for at least N, ie: slides>=2
+    # names are checked against the table columns so they can be used safely in SQL
+    if not values:
+        return {}
+
+    table = FILTER_TABLES[param]
+    columns = table.__table__.columns
+    minimums = {}
+    for value in values:
+        for term in value.split(","):
+            name, _, minimum = term.partition(">=")
+            name = name.strip()
+            if not name:
+                continue
+
+            if name not in columns or name == "site_id":
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Unknown {param} filter: {name}",
+                )
+            try:
+                minimum = int(minimum) if minimum.strip() else 1
+            except ValueError:
+                minimum = 0
+            if minimum < 1:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Invalid minimum for {param} filter: {term.strip()}",
+                )
+            # repeating a name keeps the strictest minimum
+            minimums[name] = max(minimum, minimums.get(name, 0))
+    return minimums
+
+
+def get_filters(
+    equipment: Optional[List[str]] = Query(None),
+    amenities: Optional[List[str]] = Query(None),
+    sports_facilities: Optional[List[str]] = Query(None),
+) -> Dict[str, Dict[str, int]]:
+    # collects the attribute filters for an endpoint, keyed by table name
+    # only the filters the user actually provided are returned
+    filters = {
+        "equipment": split_filter("equipment", equipment),
+        "amenities": split_filter("amenities", amenities),
+        "sports_facilities": split_filter("sports_facilities", sports_facilities),
+    }
+    return {param: minimums for param, minimums in filters.items() if minimums}
+
+
+def get_detail(
+    detail: Optional[str] = Query(None), zoom: Optional[int] = Query(None, ge=0, le=24),
+) -> str:
+    # picks the stored level of detail for the response geometry
+    # an explicit detail wins; otherwise the client's map zoom chooses one.  defaults to full detail
+    if detail is not None:
+        if detail not in DETAIL_TOLERANCES:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown detail level: {detail}",
+            )
+        return detail
+    if zoom is not None:
+        return detail_for_zoom(zoom)
+    return "full"
+
+
+def get_encoding(accept_encoding: Optional[str] = Header(None)) -> Optional[str]:
+    # response compression the client accepts, see api.compression
+    return negotiate(accept_encoding)
+
+
+def get_stream(stream: Optional[str] = Query(None)) -> Optional[str]:
+    # streaming mode for large results, see api.streaming; unset sends one cached document
+    if stream is not None and stream not in STREAM_MODES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown stream mode: {stream}",
+        )
+    return stream
+
+
+def get_format(
+    format: str = Query("geojson"), precision: Optional[int] = Query(None, ge=0, le=15),
+) -> OutputFormat:
+    # picks the response encoding for feature endpoints, see api.formats
+    if format not in FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown format: {format}",
+        )
+    if precision is None:
+        precision = DEFAULT_PRECISION[format]
+    # fragments are built from geometry already rounded to COORDINATE_PRECISION, so more digits can't be sent.
+    # geojson at that precision is just the default body, so it shares its cache entry
+    if precision is not None and COORDINATE_PRECISION is not None and precision >= COORDINATE_PRECISION:
+        precision = None if format == "geojson" else COORDINATE_PRECISION
+    return OutputFormat(format, precision)
+
+
+def get_episode_page(
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(EPISODE_PAGE_SIZE, ge=1, le=MAX_EPISODE_PAGE),
+    fields: Optional[List[str]] = Query(None),
+) -> Tuple[Optional[Tuple], int, List[str]]:
+    # (decoded cursor, page size, columns to select) for /episodes, see api.episodes
+    # fields can be repeated or comma separated, ie: fields=title,audio_url
+    if fields:
+        fields = [name for value in fields for name in value.split(",") if name]
+    try:
+        return (decode_cursor(cursor) if cursor else None), limit, page_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
 # FUNCTIONAL DEPENDENCIES
 # these are not injected
 def schema_to_row(schema, table):
@@ -45,6 +204,129 @@ def schema_to_row(schema, table):
     return table(**schema.dict())
 
 
+def apply_filters(query_sql, filters: Dict[str, Dict[str, int]]):
+    # joins each filtered attribute table onto the site query and requires every named column to meet its minimum
+    # a site "has" an attribute when its count is at least one
+    for param, minimums in filters.items():
+        table = FILTER_TABLES[param]
+        query_sql = query_sql.join(table, table.site_id == Site.site_id).filter(
+            *[getattr(table, name) >= minimum for name, minimum in minimums.items()]
+        )
+    return query_sql
+
+
+def within_radius(latitude: float, longitude: float, radius: float, columns=Site):
+    # radius predicate in meters; columns is Site, or the .c of a table with the same geometry columns
+    # in planar mode it's a plain ST_DWithin on the projected copy, see api.planar
+    if PLANAR_MODE:
+        return func.ST_DWithin(columns.geom_planar, planar_point_sql(longitude, latitude), radius)
+
+    # otherwise it's measured on the spheroid
+    # the lon/lat box prefilter can use the plain geometry index, and is never smaller than the radius
+    query_point = func.ST_GeogFromText(f"POINT({longitude} {latitude})")
+    return and_(
+        columns.geom.op("&&")(func.ST_MakeEnvelope(*search_bounds(longitude, latitude, radius), 4326)),
+        spheroid_within(columns, query_point, radius),
+    )
+
+
+def spheroid_within(columns, query_point, radius):
+    # ST_DWithin on the spheroid, settled from the centroid where it can be
+    # geog && _ST_Expand(point, radius) is the index condition ST_DWithin itself gives the planner, kept as a
+    # top level conjunct so the geography GiST index (sites_geog_idx, or the view's geog index) still answers it.
+    # of the sites it returns, the ones wholly inside (centroid distance + reach <= radius) skip the polygon;
+    # only the rest, or sites without a reach yet, are measured with ST_DWithin
+    geog = getattr(columns, "geog", None)
+    if geog is None:
+        geog = func.geography(columns.geom)  # written exactly like the functional index on sites
+    distance = func.ST_Distance(func.geography(columns.centroid), query_point, True)
+    reach = columns.max_radius + CENTROID_MARGIN
+    return and_(
+        geog.op("&&")(func._ST_Expand(query_point, radius)),
+        or_(distance + reach <= radius, func.ST_DWithin(geog, query_point, radius, True)),
+    )
+
+
+def centroid_distance_sql(latitude: float, longitude: float, columns=Site):
+    # meters from the query point to each site's centroid, for the centroid_distance property
+    # sites loaded before the centroid column existed fall back to the centroid of geom
+    query_point = func.ST_GeogFromText(f"POINT({longitude} {latitude})")
+    centroid = func.coalesce(columns.centroid, func.ST_Centroid(columns.geom))
+    return func.ST_Distance(func.geography(centroid), query_point, True).label("centroid_distance")
+
+
+def batch_query_sql(queries: List[Tuple[float, float, float, Dict[str, Dict[str, int]]]]):
+    # one set-based statement for many radius queries: (latitude, longitude, radius in meters, filters)
+    # the query points are a VALUES list joined to the sites with ST_DWithin, and returns (query index, site id)
+    # the numbers are rendered inline so postgres knows their types- callers must pass finite floats
+    # each point carries what within_radius would use: its projected position in planar mode, else its search box
+    if PLANAR_MODE:
+        point_columns = [column("x", Float), column("y", Float)]
+        point_values = lambda longitude, latitude, radius: planar_point(longitude, latitude)
+    else:
+        point_columns = [column(name, Float) for name in ("min_lon", "min_lat", "max_lon", "max_lat")]
+        point_values = search_bounds
+
+    points = values(
+        column("idx", Integer),
+        column("longitude", Float),
+        column("latitude", Float),
+        column("radius", Float),
+        *point_columns,
+        name="points",
+        literal_binds=True,
+    ).data(
+        [
+            (idx, longitude, latitude, radius, *point_values(longitude, latitude, radius))
+            for idx, (latitude, longitude, radius, _) in enumerate(queries)
+        ]
+    )
+
+    if PLANAR_MODE:
+        point_planar = func.ST_SetSRID(func.ST_MakePoint(points.c.x, points.c.y), PLANAR_SRID)
+        within = func.ST_DWithin(Site.geom_planar, point_planar, points.c.radius)
+    else:
+        point_geog = func.geography(
+            func.ST_SetSRID(func.ST_MakePoint(points.c.longitude, points.c.latitude), 4326)
+        )
+        search_box = func.ST_MakeEnvelope(
+            points.c.min_lon, points.c.min_lat, points.c.max_lon, points.c.max_lat, 4326
+        )
+        within = and_(
+            Site.geom.op("&&")(search_box),
+            spheroid_within(Site, point_geog, points.c.radius),
+        )
+    query_sql = select(points.c.idx, Site.site_id).join_from(points, Site, within)
+
+    # queries sharing a filter set share one predicate: (idx in (...) and all the filter minimums)
+    groups: Dict[Tuple, List[int]] = {}
+    for idx, (_, _, _, filters) in enumerate(queries):
+        key = tuple(
+            (param, tuple(sorted(minimums.items())))
+            for param, minimums in sorted(filters.items())
+        )
+        groups.setdefault(key, []).append(idx)
+
+    # outer joins, so a missing attribute row fails its predicate instead of dropping the site for every query
+    used = {param for filters in groups for param, _ in filters}
+    for param in used:
+        table = FILTER_TABLES[param]
+        query_sql = query_sql.outerjoin(table, table.site_id == Site.site_id)
+
+    if used:
+        predicates = []
+        for filters, indexes in groups.items():
+            conditions = [
+                getattr(FILTER_TABLES[param], name) >= minimum
+                for param, minimums in filters
+                for name, minimum in minimums
+            ]
+            predicates.append(and_(points.c.idx.in_(indexes), *conditions or [true()]))
+        query_sql = query_sql.where(or_(*predicates))
+
+    return query_sql
+
+
 async def submit_and_retrieve_site(Session, item_to_submit):
     async with Session as s:
         s.add(item_to_submit)
@@ -63,25 +345,10 @@ async def submit_and_retrieve_site(Session, item_to_submit):
     return site
 
 
-async def make_site_geojson(site):
-    equipment_schema = EquipmentSchema.from_orm(site.equipment[0])
-    amenities_schema = AmenitiesSchema.from_orm(site.amenities[0])
-    sports_facilities_schema = SportsFacilitiesSchema.from_orm(
-        site.sports_facilities[0]
-    )
-    # geometry objects are returned as a well-known binary- we need to convert to shapely objects
-    # in order to get the WKT which we can return in an http response
-    geom = shape.to_shape(site.geom)
-    wkt = geom.wkt
-    wkt = wkt.strip("POLYGON ((").strip("))").split(" ")
-    geom_tuples_list = []
-    for i, coord in enumerate(wkt):
-        if coord[-1] == ",":
-            lat = float(coord.strip(","))
-            lon = float(wkt[i - 1])
-            geom_tuples_list.append((lon, lat))
-
-    geojson_properties = {
+async def make_site_geojson(site, detail: str = "full") -> Dict:
+    # plain dict feature, ready for cache.dump
+    # attribute rows are read straight off the ORM objects, in the same key order the schemas used to give
+    properties = {
         "site_id": site.site_id,
         "site_name": site.site_name,
         "substrate_type": site.substrate_type,
@@ -89,11 +356,14 @@ async def make_site_geojson(site):
         "addr_city": site.addr_city,
         "addr_state": site.addr_state,
         "addr_zip": site.addr_zip,
-        "equipment": equipment_schema.dict(),
-        "amenities": amenities_schema.dict(),
-        "sports_facilities": sports_facilities_schema.dict(),
     }
+    for param, fields in ATTRIBUTE_FIELDS.items():
+        row = getattr(site, param)[0]
+        properties[param] = {name: getattr(row, name) for name in fields}
 
-    site_geojson_poly = Polygon(geom_tuples_list)
-    site_geojson = Feature(geometry=site_geojson_poly, properties=geojson_properties)
-    return site_geojson
+    # geometry objects are returned as a well-known binary- the rings are decoded straight into coordinates
+    return {
+        "type": "Feature",
+        "geometry": geometry_to_geojson(detail_element(site, detail)),
+        "properties": properties,
+    }
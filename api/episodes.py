@@ -0,0 +1,77 @@
+import base64
+import binascii
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, tuple_
+
+from .models.tables import Episodes
+
+# EPISODE PAGES
+# /episodes returns the newest episodes first, a page at a time.  pages are keyset paginated on (published_at, id):
+# the cursor is the last episode of the previous page, and the next page starts just after it on the
+# episodes_published_at_id index, so any page costs the same however many episodes there are.
+# clients can ask for just the fields they show, ie: leaving out the long description and summary in a list view
+EPISODE_PAGE_SIZE = int(os.environ.get("EPISODE_PAGE_SIZE", 20))
+MAX_EPISODE_PAGE = int(os.environ.get("MAX_EPISODE_PAGE", 100))
+
+EPISODE_FIELDS = [col.name for col in Episodes.__table__.columns]
+
+# every page carries these, since the cursor is made from them
+KEY_FIELDS = ["id", "published_at"]
+
+
+def encode_cursor(published_at: datetime, episode_id: int) -> str:
+    # opaque to clients- only ever handed back as it was given
+    raw = f"{published_at.isoformat()},{episode_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    # raises ValueError for anything encode_cursor didn't make
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        published_at, episode_id = raw.rsplit(",", 1)
+        return datetime.fromisoformat(published_at), int(episode_id)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def page_fields(fields: Optional[List[str]]) -> List[str]:
+    # the columns to select, in table order: everything, or the requested fields and the keys
+    if not fields:
+        return list(EPISODE_FIELDS)
+    unknown = set(fields) - set(EPISODE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown episode fields: {', '.join(sorted(unknown))}")
+    wanted = set(fields) | set(KEY_FIELDS)
+    return [name for name in EPISODE_FIELDS if name in wanted]
+
+
+def page_sql(cursor: Optional[Tuple[datetime, int]], limit: int, fields: List[str]):
+    # one more row than the page holds, to learn whether there's a next page
+    # episodes without a publish date aren't listed- they have no place in the order
+    columns = Episodes.__table__.c
+    query_sql = (
+        select(*[columns[name] for name in fields])
+        .where(columns.published_at.isnot(None))
+        .order_by(columns.published_at.desc(), columns.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor is not None:
+        query_sql = query_sql.where(tuple_(columns.published_at, columns.id) < tuple_(*cursor))
+    return query_sql
+
+
+def make_page(rows: List[Dict[str, Any]], limit: int) -> Dict[str, Any]:
+    # the page body: its episodes, and the cursor for the next page if there is one
+    episodes = [
+        {name: value.isoformat() if isinstance(value, datetime) else value for name, value in row.items()}
+        for row in rows[:limit]
+    ]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last["published_at"], last["id"])
+    return {"episodes": episodes, "next": next_cursor}
@@ -0,0 +1,68 @@
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .dependencies import FILTER_TABLES
+
+# every attribute column a filter can name, in a fixed order: (table param, column name)
+FILTER_COLUMNS = [
+    (param, col.name)
+    for param, table in FILTER_TABLES.items()
+    for col in table.__table__.columns
+    if col.name != "site_id"
+]
+
+
+class FeatureMatrix:
+    # column-oriented store of the attribute tables: one row per site, one column per attribute
+    # missing rows and NULL counts are stored as zero, which never meets a filter minimum (always >= 1),
+    # matching the inner joins of the sql filters
+
+    def __init__(self, site_ids: Sequence[str], values: np.ndarray):
+        self.site_ids = list(site_ids)
+        self.values = values
+        self.positions = {key: i for i, key in enumerate(FILTER_COLUMNS)}
+
+    def __len__(self):
+        return len(self.site_ids)
+
+    @classmethod
+    def from_attributes(
+        cls, site_ids: Sequence[str], attributes: Sequence[Dict[str, Dict[str, Optional[int]]]]
+    ) -> "FeatureMatrix":
+        # attributes holds one {param: {column: count}} dict per site, in the same order as site_ids
+        values = np.zeros((len(site_ids), len(FILTER_COLUMNS)), dtype=np.int32)
+        for row, site_attributes in enumerate(attributes):
+            for col, (param, name) in enumerate(FILTER_COLUMNS):
+                value = site_attributes.get(param, {}).get(name)
+                if value:
+                    values[row, col] = value
+        return cls(site_ids, values)
+
+    def mask(
+        self, filters: Dict[str, Dict[str, int]], rows: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        # boolean mask of the sites meeting every filter minimum
+        # when rows is given, only those rows are evaluated and the mask lines up with them
+        values = self.values if rows is None else self.values[rows]
+        if not filters:
+            return np.ones(len(values), dtype=bool)
+
+        columns = []
+        minimums = []
+        for param, names in filters.items():
+            for name, minimum in names.items():
+                columns.append(self.positions[(param, name)])
+                minimums.append(minimum)
+
+        return np.all(values[:, columns] >= np.array(minimums, dtype=values.dtype), axis=1)
+
+    def select(
+        self, filters: Dict[str, Dict[str, int]], rows: Optional[Sequence[int]] = None
+    ) -> List[int]:
+        # row positions meeting the filters, intersected with the candidate rows if given
+        if rows is None:
+            return np.flatnonzero(self.mask(filters)).tolist()
+
+        rows = np.asarray(rows, dtype=np.intp)
+        return rows[self.mask(filters, rows)].tolist()
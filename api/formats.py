@@ -0,0 +1,175 @@
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from .cache import dump, feature_collection, with_properties
+
+# OUTPUT FORMATS
+# GeoJSON with full precision floats is most of our mobile bandwidth, so feature endpoints can also send:
+#   geojson + precision: coordinates rounded to a number of decimal places
+#   polyline: geojson features whose rings are Google encoded polylines (lat/lng order, like the spec)
+#   topojson: a Topology with coordinates quantized on a fixed grid and delta encoded
+# every format is built from the feature's decoded geometry, one fragment per site, so fragments can be cached.
+
+FORMATS = ("geojson", "polyline", "topojson")
+
+# decimal places used when the client doesn't ask for a precision; None sends coordinates as they're decoded,
+# ie: rounded to api.geometry.COORDINATE_PRECISION.  requests are capped at that precision, see get_format
+DEFAULT_PRECISION = {"geojson": None, "polyline": 5, "topojson": 6}
+
+# topojson quantizes onto one fixed grid anchored at the corner of the world, so every site's arcs
+# can be encoded once and reused in any response
+TOPOJSON_TRANSLATE = (-180.0, -90.0)
+
+
+@dataclass(frozen=True)
+class OutputFormat:
+    name: str = "geojson"
+    precision: Optional[int] = None
+
+    @property
+    def key(self) -> str:
+        # identifies the fragments this format produces, for the feature cache
+        return self.name if self.precision is None else f"{self.name}:{self.precision}"
+
+
+class TopoFeature(NamedTuple):
+    # a site's topojson pieces- arcs are indexed per response, so they're spliced in at assembly
+    kind: str  # Polygon or MultiPolygon
+    ring_counts: Tuple[int, ...]  # rings in each polygon
+    arcs: Tuple[bytes, ...]  # one serialized arc per ring
+    site_id: str
+    properties: bytes
+
+
+def round_coordinates(value, precision: int):
+    # rounds every number in nested coordinate lists
+    if isinstance(value, (list, tuple)):
+        return [round_coordinates(v, precision) for v in value]
+    return round(value, precision)
+
+
+def encode_polyline(ring: Iterable, precision: int = 5) -> str:
+    # Google encoded polyline algorithm; geojson positions are (lng, lat), polylines are (lat, lng)
+    factor = 10 ** precision
+    encoded = []
+    prev_lat = prev_lng = 0
+    for position in ring:
+        lat = int(round(position[1] * factor))
+        lng = int(round(position[0] * factor))
+        for delta in (lat - prev_lat, lng - prev_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                encoded.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            encoded.append(chr(value + 63))
+        prev_lat, prev_lng = lat, lng
+    return "".join(encoded)
+
+
+def quantize_arc(ring: Iterable, precision: int) -> List[List[int]]:
+    # topojson arc: first position relative to the translate, then deltas from the previous position
+    scale = 10 ** precision
+    arc = []
+    prev_x = prev_y = 0
+    for position in ring:
+        x = int(round((position[0] - TOPOJSON_TRANSLATE[0]) * scale))
+        y = int(round((position[1] - TOPOJSON_TRANSLATE[1]) * scale))
+        arc.append([x - prev_x, y - prev_y])
+        prev_x, prev_y = x, y
+    return arc
+
+
+def polygons_of(geometry: Dict) -> List:
+    # polygon coordinate lists, whether the geometry is a Polygon or a MultiPolygon
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    return geometry["coordinates"]
+
+
+def encode_feature(feature: Dict, fmt: OutputFormat) -> Any:
+    # the cacheable fragment of one site's feature in the given format
+    geometry = feature["geometry"]
+    properties = feature["properties"]
+
+    if fmt.name == "topojson":
+        polygons = polygons_of(geometry)
+        return TopoFeature(
+            kind=geometry["type"],
+            ring_counts=tuple(len(rings) for rings in polygons),
+            arcs=tuple(
+                dump(quantize_arc(ring, fmt.precision)) for rings in polygons for ring in rings
+            ),
+            site_id=properties.get("site_id"),
+            properties=dump(properties),
+        )
+
+    if fmt.name == "polyline":
+        rings = [
+            [encode_polyline(ring, fmt.precision) for ring in polygon]
+            for polygon in polygons_of(geometry)
+        ]
+        geometry = {
+            "type": geometry["type"],
+            "encoding": f"polyline{fmt.precision}",
+            "coordinates": rings[0] if geometry["type"] == "Polygon" else rings,
+        }
+    elif fmt.precision is not None:
+        geometry = {
+            "type": geometry["type"],
+            "coordinates": round_coordinates(geometry["coordinates"], fmt.precision),
+        }
+
+    # properties go last, so per-response properties can be spliced in- see cache.with_properties
+    return dump({"type": "Feature", "geometry": geometry, "properties": properties})
+
+
+def add_properties(fragment: Any, properties: Dict) -> Any:
+    # per-response properties, ie: distance, for a fragment of any format
+    if isinstance(fragment, TopoFeature):
+        extra = b",".join(dump(name) + b":" + dump(value) for name, value in properties.items())
+        separator = b"" if fragment.properties == b"{}" else b","
+        return fragment._replace(properties=fragment.properties[:-1] + separator + extra + b"}")
+    return with_properties(fragment, properties)
+
+
+def topology(fragments: Iterable[TopoFeature], precision: int) -> bytes:
+    # assembles topojson fragments into a Topology, numbering their arcs as they're added
+    arcs = []
+    geometries = []
+    for fragment in fragments:
+        # each ring is one arc, so a polygon's rings are [[first], [first + 1], ...]
+        refs = []
+        offset = len(arcs)
+        for count in fragment.ring_counts:
+            refs.append([[offset + i] for i in range(count)])
+            offset += count
+        arcs.extend(fragment.arcs)
+        arc_refs = refs[0] if fragment.kind == "Polygon" else refs
+        geometries.append(
+            b'{"type":'
+            + dump(fragment.kind)
+            + b',"arcs":'
+            + dump(arc_refs)
+            + b',"id":'
+            + dump(fragment.site_id)
+            + b',"properties":'
+            + fragment.properties
+            + b"}"
+        )
+    transform = {"scale": [10 ** -precision] * 2, "translate": list(TOPOJSON_TRANSLATE)}
+    return (
+        b'{"type":"Topology","transform":'
+        + dump(transform)
+        + b',"objects":{"sites":{"type":"GeometryCollection","geometries":['
+        + b",".join(geometries)
+        + b']}},"arcs":['
+        + b",".join(arcs)
+        + b"]}"
+    )
+
+
+def assemble(fragments: Iterable[Any], fmt: OutputFormat) -> bytes:
+    # the whole response body for a list of fragments
+    if fmt.name == "topojson":
+        return topology(fragments, fmt.precision)
+    return feature_collection(fragments)
@@ -0,0 +1,225 @@
+import math
+import os
+import struct
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from geoalchemy2 import WKBElement, shape
+from pyproj import Geod
+from shapely.geometry import mapping
+
+# GEOMETRY ENCODING
+# site geometries come back from PostGIS as (E)WKB.  rather than going through shapely and WKT strings,
+# the polygon rings are read straight out of the binary into coordinate arrays.
+
+# digits kept after the decimal point in response coordinates; an empty value keeps full precision
+# 6 digits is ~10cm, which is more than enough to draw a playground, and is what geojson.Feature
+# rounded to when features were built with it
+precision_setting = os.environ.get("COORDINATE_PRECISION", "6")
+COORDINATE_PRECISION = int(precision_setting) if precision_setting else None
+
+# LEVELS OF DETAIL
+# simplified copies of each site polygon, built by the loader and stored next to the original
+# tolerances are in degrees: 0.00001 is ~1m, 0.0002 is ~20m at our latitude
+DETAIL_TOLERANCES = {
+    "full": None,
+    "high": 0.00001,
+    "medium": 0.00005,
+    "low": 0.0002,
+}
+
+# the Site column each level is stored in
+DETAIL_COLUMNS = {
+    "full": "geom",
+    "high": "geom_high",
+    "medium": "geom_medium",
+    "low": "geom_low",
+}
+
+# lowest map zoom each level is meant for, most detailed first
+DETAIL_ZOOMS = [(17, "full"), (15, "high"), (13, "medium"), (0, "low")]
+
+
+def detail_for_zoom(zoom: int) -> str:
+    for min_zoom, detail in DETAIL_ZOOMS:
+        if zoom >= min_zoom:
+            return detail
+    return "low"
+
+
+def simplify(geom, detail: str):
+    # topology preserving, so rings never cross and holes stay inside their polygon
+    tolerance = DETAIL_TOLERANCES[detail]
+    if tolerance is None:
+        return geom
+    return geom.simplify(tolerance, preserve_topology=True)
+
+
+def detail_element(site, detail: str):
+    # the stored geometry for a level of detail
+    # rows loaded before the levels existed fall back to simplifying the original, once, when the feature is cached
+    element = getattr(site, DETAIL_COLUMNS[detail], None)
+    if element is not None:
+        return element
+    return shape.from_shape(simplify(shape.to_shape(site.geom), detail), srid=4326)
+
+
+# SEARCH BOXES
+# shortest length of a degree of latitude/longitude at the equator, in meters
+# used to size the bounding box radius searches are prefiltered with- it only needs to be big enough, not exact
+METERS_PER_DEGREE = 110574.0
+
+
+def search_bounds(longitude: float, latitude: float, radius: float) -> Tuple[float, float, float, float]:
+    # (min lon, min lat, max lon, max lat) of a box guaranteed to contain every point within radius meters
+    # padded a little so rounding never excludes a site PostGIS would return
+    # a box that would reach past the antimeridian (or around a pole) spans every longitude instead, since
+    # lon/lat boxes don't wrap
+    padding = 1.01
+    dlat = radius * padding / METERS_PER_DEGREE
+    cos_lat = math.cos(math.radians(min(abs(latitude) + dlat, 90.0)))
+    dlon = 180.0 if cos_lat < 1e-6 else min(dlat / cos_lat, 180.0)
+    min_lat, max_lat = max(latitude - dlat, -90.0), min(latitude + dlat, 90.0)
+    if dlon >= 180.0 or longitude - dlon < -180.0 or longitude + dlon > 180.0:
+        return -180.0, min_lat, 180.0, max_lat
+    return longitude - dlon, min_lat, longitude + dlon, max_lat
+
+
+# CENTROIDS
+# each site's centroid and its reach, the furthest the polygon gets from it, in meters.  a radius test can then
+# settle most sites from one point distance: a site is wholly inside if centroid distance + reach <= radius,
+# and wholly outside if centroid distance - reach > radius.  only the sites in between need the polygon.
+GEOD = Geod(ellps="WGS84")  # PostGIS geography uses the WGS84 spheroid, so we measure on it too
+
+# meters of slack on both tests, covering the small differences between ways of measuring
+CENTROID_MARGIN = 1.0
+
+
+def centroid_reach(geom) -> Tuple[float, float, float]:
+    # (centroid longitude, centroid latitude, reach in meters) for a shapely polygon or multipolygon
+    # the furthest point of a small polygon from its centroid is one of its vertices
+    centroid = geom.centroid
+    coords = np.vstack([np.asarray(poly.exterior.coords)[:, :2] for poly in getattr(geom, "geoms", [geom])])
+    count = len(coords)
+    _, _, distance = GEOD.inv(
+        np.full(count, centroid.x), np.full(count, centroid.y), coords[:, 0], coords[:, 1]
+    )
+    return centroid.x, centroid.y, float(distance.max())
+
+
+def centroid_test(
+    centroid_distance: np.ndarray, reach: np.ndarray, radius: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    # (wholly inside, wholly outside) masks for sites at the given centroid distances
+    inside = centroid_distance + reach + CENTROID_MARGIN <= radius
+    outside = centroid_distance - reach - CENTROID_MARGIN > radius
+    return inside, outside
+
+
+# EWKB flags carried in the high bits of the geometry type
+EWKB_Z = 0x80000000
+EWKB_M = 0x40000000
+EWKB_SRID = 0x20000000
+
+POLYGON = 3
+MULTIPOLYGON = 6
+
+
+def wkb_bytes(element) -> bytes:
+    # geoalchemy hands us WKB as bytes/memoryview, or as a hex string depending on the driver
+    data = element.data if isinstance(element, WKBElement) else element
+    if isinstance(data, str):
+        return bytes.fromhex(data)
+    return bytes(data)
+
+
+def read_header(data: bytes, offset: int) -> Tuple[str, int, int, int]:
+    # returns (byte order, geometry type, dimensions, offset of the geometry body)
+    endian = "<" if data[offset] == 1 else ">"
+    (kind,) = struct.unpack_from(endian + "I", data, offset + 1)
+    offset += 5
+
+    dims = 2
+    if kind & EWKB_SRID:
+        offset += 4  # skip the srid, we only store 4326
+    dims += bool(kind & EWKB_Z) + bool(kind & EWKB_M)
+    kind &= 0x0FFFFFFF
+
+    # ISO WKB encodes Z/M as thousands, ie: 1003 is a polygon with z
+    dims += {1: 1, 2: 1, 3: 2}.get(kind // 1000, 0)
+    return endian, kind % 1000, dims, offset
+
+
+def ring_spans(data: bytes, offset: int, endian: str, dims: int) -> Tuple[List[Tuple[int, int]], int]:
+    # (byte offset of the first coordinate, point count) for each ring of a polygon body,
+    # and the offset just past the polygon
+    (ring_count,) = struct.unpack_from(endian + "I", data, offset)
+    offset += 4
+
+    spans = []
+    for _ in range(ring_count):
+        (point_count,) = struct.unpack_from(endian + "I", data, offset)
+        offset += 4
+        spans.append((offset, point_count))
+        offset += point_count * dims * 8
+    return spans, offset
+
+
+def polygon_spans(data: bytes) -> Tuple[int, List[Tuple[str, int, List[Tuple[int, int]]]]]:
+    # (geometry type, (byte order, dimensions, ring spans) of each polygon) for a polygon or multipolygon
+    # the coordinates are found without being read, so callers can read them however suits them
+    endian, kind, dims, offset = read_header(data, 0)
+
+    if kind == POLYGON:
+        spans, _ = ring_spans(data, offset, endian, dims)
+        return kind, [(endian, dims, spans)]
+
+    if kind == MULTIPOLYGON:
+        (count,) = struct.unpack_from(endian + "I", data, offset)
+        offset += 4
+        polygons = []
+        for _ in range(count):
+            endian, _, dims, offset = read_header(data, offset)
+            spans, offset = ring_spans(data, offset, endian, dims)
+            polygons.append((endian, dims, spans))
+        return kind, polygons
+
+    raise ValueError(f"Unsupported geometry type for a site: {kind}")
+
+
+def read_rings(
+    data: bytes, endian: str, dims: int, spans: List[Tuple[int, int]], precision: Optional[int]
+) -> List[np.ndarray]:
+    # each ring's x and y as an n x 2 array, straight off the buffer
+    rings = []
+    for offset, point_count in spans:
+        ring = np.frombuffer(
+            data, dtype=endian + "f8", count=point_count * dims, offset=offset
+        ).reshape(point_count, dims)[:, :2]
+        if precision is not None:
+            ring = ring.round(precision)
+        rings.append(ring)
+    return rings
+
+
+def decode_polygons(element, precision: Optional[int] = COORDINATE_PRECISION) -> List[List[np.ndarray]]:
+    # every polygon in the geometry as a list of rings (exterior first, then holes), as n x 2 arrays
+    data = wkb_bytes(element)
+    _, polygons = polygon_spans(data)
+    return [read_rings(data, endian, dims, spans, precision) for endian, dims, spans in polygons]
+
+
+def geometry_to_geojson(element, precision: Optional[int] = COORDINATE_PRECISION) -> Dict:
+    # geojson geometry dict for a site geometry, with closed rings and holes intact
+    data = wkb_bytes(element)
+    _, kind, _, _ = read_header(data, 0)
+    if kind not in (POLYGON, MULTIPOLYGON):
+        # not a polygon- let shapely handle the odd case
+        return mapping(shape.to_shape(element))
+
+    coordinates = [
+        [ring.tolist() for ring in rings] for rings in decode_polygons(data, precision)
+    ]
+    if kind == POLYGON:
+        return {"type": "Polygon", "coordinates": coordinates[0]}
+    return {"type": "MultiPolygon", "coordinates": coordinates}
@@ -1,4 +1,4 @@
-from typing import Optional, Any
+from typing import Optional, Any, List
 
 from pydantic import BaseModel
 
@@ -79,3 +79,13 @@ class SiteSchema(BaseModel):
     class Config:
         orm_mode = True
         arbitrary_types_allowed = True
+
+
+class QueryItemSchema(BaseModel):
+    # one radius query in a batch- same parameters as /query, radius in miles
+    latitude: float
+    longitude: float
+    radius: float
+    equipment: Optional[List[str]]
+    amenities: Optional[List[str]]
+    sports_facilities: Optional[List[str]]
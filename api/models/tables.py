@@ -7,9 +7,14 @@ from sqlalchemy import (
     Integer,
     DateTime,
     Boolean,
+    Float,
+    Index,
+    func,
 )
 from sqlalchemy.orm import declarative_base, relationship
 
+from ..planar import PLANAR_SRID
+
 # TABLES DEFINED HERE
 
 # configure table base
@@ -28,6 +33,21 @@ class Site(Base):
     addr_state = Column(String(2), nullable=False)
     addr_zip = Column(Integer, nullable=False)
     geom = Column(Geometry(geometry_type="POLYGON", srid=4326))
+    # simplified copies of geom for lower zoom levels, see api.geometry.DETAIL_TOLERANCES
+    geom_high = Column(Geometry(geometry_type="GEOMETRY", srid=4326), nullable=True)
+    geom_medium = Column(Geometry(geometry_type="GEOMETRY", srid=4326), nullable=True)
+    geom_low = Column(Geometry(geometry_type="GEOMETRY", srid=4326), nullable=True)
+    # geom projected for planar distance queries, see api.planar
+    geom_planar = Column(Geometry(geometry_type="POLYGON", srid=PLANAR_SRID), nullable=True)
+    # centroid, bounding box and reach (meters from the centroid to the furthest vertex) of geom,
+    # so radius queries can settle most sites without the polygon, see api.geometry.centroid_reach
+    centroid = Column(Geometry(geometry_type="POINT", srid=4326), nullable=True)
+    bbox = Column(Geometry(geometry_type="POLYGON", srid=4326), nullable=True)
+    max_radius = Column(Float, nullable=True)
+
+    # radius queries measure on the spheroid with geography(geom)- this index matches that expression exactly,
+    # alongside the plain geometry index geoalchemy makes for the bounding box prefilter
+    __table_args__ = (Index("sites_geog_idx", func.geography(geom), postgresql_using="gist"),)
 
 
 class Equipment(Base):
@@ -131,3 +151,27 @@ class Episodes(Base):
     total_plays = Column(Integer)
     magic_mastering = Column(Boolean)
     custom_url = Column(String, nullable=True)
+
+    # /episodes pages through episodes newest first, by (published_at, id), see api.episodes
+    __table_args__ = (Index("episodes_published_at_id", published_at, id),)
+
+
+class DatasetVersion(Base):
+    # a row per dataset (see api.dataset)- its version is bumped whenever that data is written,
+    # so the api knows when its in-memory caches are stale
+    __tablename__ = "dataset_version"
+    __mapper_args__ = {"eager_defaults": True}
+
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False)
+    updated_at = Column(DateTime, nullable=True)
+
+
+class LoadHash(Base):
+    # hash of every row the loader last wrote, by table and primary key
+    # incremental loads compare incoming rows against these, and only write the ones that changed
+    __tablename__ = "load_hashes"
+
+    table_name = Column(String, primary_key=True)
+    row_key = Column(String, primary_key=True)
+    row_hash = Column(String(40), nullable=False)
@@ -0,0 +1,41 @@
+import os
+from typing import Tuple
+
+from pyproj import Transformer
+from sqlalchemy import func
+
+# PLANAR MODE
+# radius and nearest queries measure on the WGS84 spheroid by default, which is the most expensive way to answer
+# "within 5 miles in Minnesota".  with PLANAR_MODE=true they use a copy of each site in a projected CRS instead,
+# stored in sites.geom_planar by the loader, so distances are plain euclidean math on a geometry GiST index.
+#
+# the default CRS is UTM zone 15N.  planar distances there are off by the projection's scale factor:
+# 0.9996 on the central meridian (-93, through the metro), rising to ~1.0003 at the zone edges (-96/-90).
+# so they run ~0.04% short in the metro (~6m over 10 miles), and stay within 0.1% anywhere in Minnesota,
+# including the western strip that's really zone 14.  a site that close to the edge of the radius may be
+# included or left out differently from the spheroid path.
+PLANAR_MODE = os.environ.get("PLANAR_MODE", "false").lower() in ("1", "true", "yes")
+PLANAR_SRID = int(os.environ.get("PLANAR_SRID", 32615))  # WGS 84 / UTM zone 15N
+
+# worst relative distance error across Minnesota, see above- checked in test_planar
+PLANAR_MAX_ERROR = 0.001
+
+_to_planar = Transformer.from_crs(4326, PLANAR_SRID, always_xy=True)
+
+
+def planar_point(longitude: float, latitude: float) -> Tuple[float, float]:
+    # (x, y) in meters in the planar CRS
+    return _to_planar.transform(longitude, latitude)
+
+
+def planar_point_sql(longitude: float, latitude: float):
+    # the query point, projected here rather than with ST_Transform on every query
+    x, y = planar_point(longitude, latitude)
+    return func.ST_SetSRID(func.ST_MakePoint(x, y), PLANAR_SRID)
+
+
+def to_planar(geom):
+    # a shapely geometry projected into the planar CRS
+    from shapely.ops import transform
+
+    return transform(_to_planar.transform, geom)
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+import pytz
+from sqlalchemy import or_
+from sqlalchemy.dialects.postgresql import insert
+
+from .dataset import episode_dataset
+from .models.tables import Episodes
+
+# PODCAST SYNC
+# episodes are copied from Buzzsprout into the episodes table.  the request is made with an async client, so other
+# requests keep being served while Buzzsprout responds, and the rows are written with one upsert.
+# a sync runs when /update is called, and every PODCAST_SYNC_SECONDS if that's set
+PODCAST_ID = os.environ.get("PODCAST_ID", "2009882")
+BUZZSPROUT_URL = os.environ.get("BUZZSPROUT_URL", "https://buzzsprout.com/api")
+
+# seconds to wait for Buzzsprout to connect and to respond
+PODCAST_TIMEOUT = float(os.environ.get("PODCAST_TIMEOUT", 10))
+
+# seconds between scheduled syncs- 0 means only sync when /update is called
+PODCAST_SYNC_SECONDS = float(os.environ.get("PODCAST_SYNC_SECONDS", 0))
+
+EPISODE_COLUMNS = [col.name for col in Episodes.__table__.columns]
+DATETIME_COLUMNS = ("published_at", "inactive_at")
+
+# postgres takes at most 32767 parameters per statement, so a very long catalogue is upserted in chunks
+UPSERT_CHUNK = 32767 // len(EPISODE_COLUMNS)
+
+
+def parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    # Buzzsprout timestamps carry their offset- the table holds naive utc
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        return parsed
+    return parsed.astimezone(pytz.UTC).replace(tzinfo=None)
+
+
+def episode_rows(episodes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # the fields the episodes table has, with its column types
+    # every row has every column, so they can go in one multi-row insert
+    rows = []
+    for episode in episodes:
+        row = {name: episode.get(name) for name in EPISODE_COLUMNS}
+        for name in DATETIME_COLUMNS:
+            row[name] = parse_datetime(row[name])
+        rows.append(row)
+    return rows
+
+
+def upsert_episodes_statement(rows: List[Dict[str, Any]]):
+    # one INSERT ... ON CONFLICT (id) DO UPDATE for every episode
+    # rows that haven't changed are skipped by the WHERE, so only new and changed episodes are written,
+    # and only their ids are returned
+    stmt = insert(Episodes).values(rows)
+    columns = [col for col in Episodes.__table__.columns if col.name != "id"]
+    return stmt.on_conflict_do_update(
+        index_elements=[Episodes.id],
+        set_={col.name: stmt.excluded[col.name] for col in columns},
+        where=or_(*[col.is_distinct_from(stmt.excluded[col.name]) for col in columns]),
+    ).returning(Episodes.id)
+
+
+async def fetch_episodes(client: httpx.AsyncClient) -> List[Dict[str, Any]]:
+    # the podcast's episodes, as Buzzsprout lists them
+    res = await client.get(
+        f"{BUZZSPROUT_URL}/{PODCAST_ID}/episodes.json",
+        params={"api_token": os.environ.get("API_KEY", "")},
+        headers={"Content-Type": "application/json", "charset": "utf-8"},
+    )
+    res.raise_for_status()
+    return res.json()
+
+
+class EpisodeSync:
+    # copies the episodes from Buzzsprout, one sync at a time
+
+    def __init__(self):
+        self._lock: Optional[asyncio.Lock] = None  # made on first use, on the running event loop
+        self.last_run: Optional[datetime] = None
+        self.last_result: Dict[str, Any] = {}
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    @property
+    def running(self) -> bool:
+        return self.lock.locked()
+
+    async def run(self, Session, client: Optional[httpx.AsyncClient] = None) -> Dict[str, Any]:
+        # fetches the episodes and upserts them, returning how many were received and written
+        # a sync that's asked for while one is running waits for it, then runs with fresh data
+        async with self.lock:
+            try:
+                if client is None:
+                    async with httpx.AsyncClient(timeout=PODCAST_TIMEOUT) as client:
+                        episodes = await fetch_episodes(client)
+                else:
+                    episodes = await fetch_episodes(client)
+                result = await self.write(Session, episode_rows(episodes))
+            except Exception as e:
+                # a failed sync leaves the stored episodes as they were
+                logging.error("PODCAST: sync failed: %r", e)
+                result = {"error": repr(e)}
+            self.last_run = datetime.utcnow()
+            self.last_result = result
+            return result
+
+    @staticmethod
+    async def write(Session, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # the upsert and the episode version bump commit together, then the episode pages are dropped
+        # the site data hasn't changed, so the site caches and snapshot are left alone
+        if not rows:
+            return {"received": 0, "written": 0}
+
+        written = 0
+        async with Session() as s:
+            async with s.begin():
+                for start in range(0, len(rows), UPSERT_CHUNK):
+                    res = await s.execute(upsert_episodes_statement(rows[start : start + UPSERT_CHUNK]))
+                    written += len(res.all())
+                version = await episode_dataset.bump(s) if written else None
+        if version is not None:
+            await episode_dataset.set(version)
+        logging.info("PODCAST: %s episodes received, %s written", len(rows), written)
+        return {"received": len(rows), "written": written}
+
+    async def poll(self, Session, interval: float = PODCAST_SYNC_SECONDS):
+        # syncs on a schedule, ie: to pick up new episodes without anyone calling /update
+        while True:
+            await asyncio.sleep(interval)
+            await self.run(Session)  # failures are logged, and the next sync tries again
+
+
+# instantiate- this object is imported in main script
+episode_sync = EpisodeSync()
@@ -0,0 +1,82 @@
+import hashlib
+import os
+from typing import Any, Dict, Hashable, Optional
+
+from fastapi import Response
+
+from .cache import ResponseCache, dump
+from .compression import compress, worth_compressing
+
+# HTTP CACHING
+# read endpoints send an ETag made from the dataset version and the normalized request, so a client revalidating
+# with If-None-Match gets a 304 before we touch the db or serialize anything
+CACHE_MAX_AGE = int(os.environ.get("CACHE_MAX_AGE", 300))  # seconds clients may reuse a response unchecked
+
+# /query responses name the point their centroid_distance values are measured from, see cache.query_key
+DISTANCE_ORIGIN_HEADER = "X-Distance-Origin"
+
+
+class FastJSONResponse(Response):
+    # json response for endpoints that build their own body
+    # bytes, ie: spliced cached features, are sent as they are; anything else is encoded once with cache.dump.
+    # return an instance from the endpoint, so FastAPI never runs the body through jsonable_encoder
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dump(content)
+
+
+def make_etag(key: Hashable) -> str:
+    # deterministic across processes, since keys are built from plain values
+    # weak, because the same representation is sent with different content encodings
+    return 'W/"' + hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:24] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # weak comparison, as If-None-Match requires
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    def opaque(tag: str) -> str:
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+
+    return any(opaque(tag) == opaque(etag) for tag in if_none_match.split(","))
+
+
+def cache_headers(etag: Optional[str]) -> Dict[str, str]:
+    headers = {"Vary": "Accept-Encoding"}
+    if etag is not None:
+        headers["ETag"] = etag
+        headers["Cache-Control"] = f"public, max-age={CACHE_MAX_AGE}"
+    return headers
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
+
+
+def encoded_response(
+    content: bytes,
+    encoding: Optional[str],
+    media_type: str = FastJSONResponse.media_type,
+    cache: Optional[ResponseCache] = None,
+    key: Optional[Hashable] = None,
+    etag: Optional[str] = None,
+) -> Response:
+    # sends a body compressed with the negotiated encoding, see api.compression
+    # bodies held in a response cache are compressed once, and the compressed copy is kept alongside them
+    headers = cache_headers(etag)
+    if encoding is None or not worth_compressing(content):
+        return FastJSONResponse(content, media_type=media_type, headers=headers)
+
+    if cache is not None:
+        body = cache.encoded(key, encoding, content)
+    else:
+        body = compress(content, encoding)
+    headers["Content-Encoding"] = encoding
+    return Response(body, media_type=media_type, headers=headers)
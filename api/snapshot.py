@@ -0,0 +1,227 @@
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from geoalchemy2 import shape
+from shapely.geometry import Point, Polygon, box
+from shapely.strtree import STRtree
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from .dependencies import make_site_geojson, FILTER_TABLES
+from .filters import FeatureMatrix
+from .geometry import GEOD, DETAIL_TOLERANCES, centroid_reach, centroid_test, search_bounds
+from .models.tables import Site
+
+# SNAPSHOT MODE
+# the sites table and its attribute tables are small and rarely change, so /query can be served from memory.
+# enable by setting SNAPSHOT_MODE=true; the snapshot is loaded at startup and rebuilt on demand.
+SNAPSHOT_MODE = os.environ.get("SNAPSHOT_MODE", "false").lower() in ("1", "true", "yes")
+
+# first search radius used by nearest(), in meters- it grows until enough sites are found
+NEAREST_START_RADIUS = 2000.0
+
+# no two points on earth are further apart than this along the surface, in meters
+MAX_SURFACE_DISTANCE = 20_040_000.0
+
+
+@dataclass
+class SnapshotEntry:
+    site_id: str
+    geom: Polygon
+    attributes: Dict[str, Dict[str, Optional[int]]]
+    features: Dict[str, Dict] = field(repr=False)  # feature dict per level of detail
+    centroid: Tuple[float, float, float] = (0.0, 0.0, 0.0)  # longitude, latitude, reach in meters
+
+
+def geodesic_distance(longitude: float, latitude: float, geom) -> float:
+    # distance in meters from a point to a polygon on the WGS84 spheroid
+    # every vertex is projected to an azimuthal equidistant plane centered on the point,
+    # so the planar distance to the origin is the geodesic distance.  the edges are straight in that plane,
+    # which differs from a geodesic edge by millimeters at playground scale.
+    def project(coords):
+        coords = np.asarray(coords)
+        count = len(coords)
+        azimuth, _, distance = GEOD.inv(
+            np.full(count, longitude), np.full(count, latitude), coords[:, 0], coords[:, 1]
+        )
+        azimuth = np.radians(azimuth)
+        return np.column_stack((distance * np.sin(azimuth), distance * np.cos(azimuth)))
+
+    polygons = getattr(geom, "geoms", [geom])  # handles multipolygons too
+    origin = Point(0, 0)
+    return min(
+        Polygon(
+            project(poly.exterior.coords),
+            [project(ring.coords) for ring in poly.interiors],
+        ).distance(origin)
+        for poly in polygons
+    )
+
+
+def search_box(longitude: float, latitude: float, radius: float):
+    return box(*search_bounds(longitude, latitude, radius))
+
+
+class SiteSnapshot:
+    # every site, its attributes and its prepared geojson feature, held in memory
+    # and indexed by an STRtree over the site polygons
+
+    def __init__(self):
+        # entries, tree, positions, attribute matrix and centroids are swapped together,
+        # so a rebuild never exposes a half built index
+        self._state: Tuple[
+            List[SnapshotEntry], Optional[STRtree], Dict[int, int], FeatureMatrix, np.ndarray
+        ] = ([], None, {}, FeatureMatrix.from_attributes([], []), np.empty((0, 3)))
+        self.loaded_at: Optional[datetime] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._state[1] is not None
+
+    def __len__(self):
+        return len(self._state[0])
+
+    async def load(self, Session) -> int:
+        # reads every site with its attribute rows and rebuilds the index
+        query_sql = (
+            select(Site)
+            .order_by(Site.site_id)
+            .options(
+                selectinload(Site.equipment),
+                selectinload(Site.amenities),
+                selectinload(Site.sports_facilities),
+            )
+        )
+
+        async with Session() as s:
+            async with s.begin():
+                res = await s.execute(query_sql)
+                sites = res.scalars().all()
+                entries = [await self.make_entry(site) for site in sites]
+
+        self.build(entries)
+        logging.info("SNAPSHOT: loaded %s sites", len(entries))
+        return len(entries)
+
+    @staticmethod
+    async def make_entry(site) -> SnapshotEntry:
+        attributes = {}
+        for param, table in FILTER_TABLES.items():
+            rows = getattr(site, param)
+            if rows:
+                attributes[param] = {
+                    col.name: getattr(rows[0], col.name)
+                    for col in table.__table__.columns
+                    if col.name != "site_id"
+                }
+
+        geom = shape.to_shape(site.geom)
+        return SnapshotEntry(
+            site_id=site.site_id,
+            geom=geom,
+            attributes=attributes,
+            features={detail: await make_site_geojson(site, detail) for detail in DETAIL_TOLERANCES},
+            centroid=centroid_reach(geom),
+        )
+
+    def build(self, entries: List[SnapshotEntry]):
+        tree = STRtree([entry.geom for entry in entries]) if entries else None
+        # shapely < 2 returns the geometries themselves from a tree query, so keep a way back to the entry
+        positions = {id(entry.geom): i for i, entry in enumerate(entries)}
+        matrix = FeatureMatrix.from_attributes(
+            [entry.site_id for entry in entries], [entry.attributes for entry in entries]
+        )
+        centroids = np.array([entry.centroid for entry in entries], dtype=float).reshape(-1, 3)
+        self._state = (entries, tree, positions, matrix, centroids)
+        self.loaded_at = datetime.utcnow()
+
+    def candidates(self, longitude: float, latitude: float, radius: float) -> List[int]:
+        # positions of the entries whose bounding boxes intersect the search box, in load order
+        _, tree, lookup, _, _ = self._state
+        if tree is None:
+            return []
+
+        hits = tree.query(search_box(longitude, latitude, radius))
+        positions = [
+            int(hit) if isinstance(hit, (int, np.integer)) else lookup[id(hit)]
+            for hit in hits
+        ]
+        return sorted(positions)
+
+    def query(
+        self,
+        latitude: float,
+        longitude: float,
+        radius: float,
+        filters: Dict[str, Dict[str, int]],
+    ) -> List[SnapshotEntry]:
+        # the in-memory equivalent of the ST_DWithin query in /query
+        return [entry for entry, _ in self.search(latitude, longitude, radius, filters)]
+
+    def search(
+        self,
+        latitude: float,
+        longitude: float,
+        radius: float,
+        filters: Dict[str, Dict[str, int]],
+    ) -> List[Tuple[SnapshotEntry, float]]:
+        # the radius query's entries, with their centroid distance in meters
+        # attribute filters are applied to the spatial candidates as one vectorized mask, then the centroid
+        # distances settle most sites at once- the polygon distance is only computed for the borderline ones
+        entries, _, _, matrix, centroids = self._state
+        positions = matrix.select(filters, self.candidates(longitude, latitude, radius))
+        if not positions:
+            return []
+
+        rows = centroids[positions]
+        count = len(rows)
+        _, _, distances = GEOD.inv(
+            np.full(count, longitude), np.full(count, latitude), rows[:, 0], rows[:, 1]
+        )
+        inside, outside = centroid_test(distances, rows[:, 2], radius)
+
+        matches = []
+        for position, distance, is_inside, is_outside in zip(positions, distances, inside, outside):
+            if is_outside:
+                continue
+            entry = entries[position]
+            if is_inside or geodesic_distance(longitude, latitude, entry.geom) <= radius:
+                matches.append((entry, float(distance)))
+        return matches
+
+    def nearest(
+        self,
+        latitude: float,
+        longitude: float,
+        k: int,
+        filters: Dict[str, Dict[str, int]],
+    ) -> List[Tuple[SnapshotEntry, float]]:
+        # the k closest entries meeting the filters, closest first, with their distance in meters
+        # the search radius grows until it holds k matches- everything within the radius is in the search box,
+        # so once there are k of them no site outside can be closer
+        entries, _, _, matrix, _ = self._state
+        k = min(k, len(matrix.select(filters)))
+        if k == 0:
+            return []
+
+        radius = NEAREST_START_RADIUS
+        while True:
+            found = []
+            for position in matrix.select(filters, self.candidates(longitude, latitude, radius)):
+                distance = geodesic_distance(longitude, latitude, entries[position].geom)
+                if distance <= radius:
+                    found.append((distance, position))
+            if len(found) >= k or radius >= MAX_SURFACE_DISTANCE:
+                break
+            radius *= 4
+
+        found.sort()
+        return [(entries[position], distance) for distance, position in found[:k]]
+
+
+# instantiate- this object is imported in main script
+snapshot = SiteSnapshot()
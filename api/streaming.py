@@ -0,0 +1,35 @@
+import os
+from typing import AsyncIterator, List
+
+# STREAMING RESPONSES
+# large radius queries can be streamed instead of built in memory- features are written as each batch of
+# sites comes off a server side cursor, so time to first byte and memory don't grow with the result.
+#   ndjson: one geojson feature per line
+#   collection: a FeatureCollection written incrementally, for clients that want one document
+
+STREAM_MODES = ("ndjson", "collection")
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "collection": "application/json",
+}
+
+# sites fetched from the cursor, and features written, per batch
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", 200))
+
+
+async def frame(batches: AsyncIterator[List[bytes]], mode: str) -> AsyncIterator[bytes]:
+    # turns batches of serialized features into the chunks of the response body
+    if mode == "ndjson":
+        async for batch in batches:
+            if batch:
+                yield b"\n".join(batch) + b"\n"
+        return
+
+    yield b'{"type":"FeatureCollection","features":['
+    first = True
+    async for batch in batches:
+        if batch:
+            yield (b"" if first else b",") + b",".join(batch)
+            first = False
+    yield b"]}"
@@ -0,0 +1,35 @@
+from sqlalchemy import text
+
+# VECTOR TILES
+# site polygons as Mapbox Vector Tiles, so the map draws only what's in the viewport
+
+TILE_EXTENT = 4096  # tile coordinate space
+TILE_BUFFER = 64  # pixels of geometry kept outside the tile edge, so outlines join up
+TILE_LAYER = "sites"
+MAX_ZOOM = 22
+MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+# only a few light properties go in the tile- the full site comes from /query when it's clicked
+tile_sql = text(
+    f"""
+    WITH bounds AS (
+        SELECT ST_TileEnvelope(:z, :x, :y) AS geom
+    ),
+    tile AS (
+        SELECT
+            ST_AsMVTGeom(
+                ST_Transform(sites.geom, 3857), bounds.geom, {TILE_EXTENT}, {TILE_BUFFER}, true
+            ) AS geom,
+            sites.site_id,
+            sites.site_name
+        FROM sites, bounds
+        WHERE sites.geom && ST_Transform(bounds.geom, 4326)
+    )
+    SELECT ST_AsMVT(tile.*, '{TILE_LAYER}', {TILE_EXTENT}, 'geom') FROM tile
+    """
+)
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    # tile addresses outside the web mercator pyramid don't exist
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
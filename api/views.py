@@ -0,0 +1,119 @@
+import os
+from typing import Dict, List
+
+from geoalchemy2 import Geography
+from sqlalchemy import Column, MetaData, Table, select, text
+
+from .dependencies import centroid_distance_sql, within_radius
+from .geometry import DETAIL_COLUMNS
+from .models.tables import Site, Equipment, Amenities, SportsFacilities
+
+# SITE VIEW
+# one wide row per site: the site columns, a geography column for radius searches and every attribute column.
+# features are read from it in one round trip, instead of the site query plus a selectinload per attribute table.
+# it's a materialized view, so it's rebuilt after the tables change- the loader does this, or run:
+#   python -m playground_planner.utils.site_view refresh
+# set SITE_VIEW=false to read the tables directly, ie: against a db the view hasn't been created in yet
+SITE_VIEW = os.environ.get("SITE_VIEW", "true").lower() in ("1", "true", "yes")
+
+VIEW_NAME = "site_features"
+
+ATTRIBUTE_TABLES = {
+    "equipment": Equipment,
+    "amenities": Amenities,
+    "sports_facilities": SportsFacilities,
+}
+
+# attribute columns keep their own names in the view, so they have to be unique across the tables
+ATTRIBUTE_COLUMNS = [
+    col
+    for table in ATTRIBUTE_TABLES.values()
+    for col in table.__table__.columns
+    if col.name != "site_id"
+]
+assert len({col.name for col in ATTRIBUTE_COLUMNS}) == len(ATTRIBUTE_COLUMNS)
+
+# the view as a table, for building queries- it's in its own metadata, so create_all never makes it a table
+site_features = Table(
+    VIEW_NAME,
+    MetaData(),
+    *[Column(col.name, col.type, primary_key=col.primary_key) for col in Site.__table__.columns],
+    Column("geog", Geography(geometry_type="POLYGON", srid=4326)),
+    *[Column(col.name, col.type) for col in ATTRIBUTE_COLUMNS],
+)
+
+
+def create_view_statements() -> List:
+    # the view and its indexes
+    # the unique index on site_id lets the view be refreshed concurrently, without blocking readers
+    site_columns = [f"sites.{col.name}" for col in Site.__table__.columns]
+    attribute_columns = [f"{col.table.name}.{col.name}" for col in ATTRIBUTE_COLUMNS]
+    joins = [
+        f"LEFT JOIN {table.__tablename__} ON {table.__tablename__}.site_id = sites.site_id"
+        for table in ATTRIBUTE_TABLES.values()
+    ]
+    columns = ",\n            ".join(site_columns + ["geography(sites.geom) AS geog"] + attribute_columns)
+    newline = "\n        "
+    return [
+        text(
+            f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {VIEW_NAME} AS
+        SELECT
+            {columns}
+        FROM sites
+        {newline.join(joins)}
+        """
+        ),
+        text(f"CREATE UNIQUE INDEX IF NOT EXISTS {VIEW_NAME}_site_id ON {VIEW_NAME} (site_id)"),
+        text(f"CREATE INDEX IF NOT EXISTS {VIEW_NAME}_geog ON {VIEW_NAME} USING GIST (geog)"),
+        text(f"CREATE INDEX IF NOT EXISTS {VIEW_NAME}_geom ON {VIEW_NAME} USING GIST (geom)"),
+        text(f"CREATE INDEX IF NOT EXISTS {VIEW_NAME}_geom_planar ON {VIEW_NAME} USING GIST (geom_planar)"),
+    ]
+
+
+refresh_view_statement = text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {VIEW_NAME}")
+
+# the view depends on the tables, so it has to go before they're dropped
+drop_view_statement = text(f"DROP MATERIALIZED VIEW IF EXISTS {VIEW_NAME}")
+
+
+def view_columns(detail: str = "full") -> List[Column]:
+    # everything a feature needs at one level of detail- the other geometry columns stay in the db
+    geometry = ["geom"] if detail == "full" else ["geom", DETAIL_COLUMNS[detail]]
+    skip = {"geom", "geog", "geom_planar", "centroid", "bbox", "max_radius", *DETAIL_COLUMNS.values()}
+    return [
+        col
+        for col in site_features.columns
+        if col.name in geometry or col.name not in skip
+    ]
+
+
+def radius_view_sql(latitude: float, longitude: float, radius: float, filters: Dict[str, Dict[str, int]]):
+    # the radius query against the view: the matching site ids and their centroid distances.
+    # attribute filters are plain column predicates here, no joins.  only sites missing from the feature cache
+    # are then read in full (view_columns), so a warm cache costs one narrow query
+    return (
+        select(site_features.c.site_id, centroid_distance_sql(latitude, longitude, site_features.c))
+        .where(within_radius(latitude, longitude, radius, site_features.c))
+        .where(*view_filters(filters))
+    )
+
+
+def view_filters(filters: Dict[str, Dict[str, int]]) -> List:
+    return [
+        site_features.c[name] >= minimum
+        for minimums in filters.values()
+        for name, minimum in minimums.items()
+    ]
+
+
+class ViewSite:
+    # a site_features row, shaped like a Site with its attribute rows for make_site_geojson
+
+    def __init__(self, row):
+        self._row = row
+
+    def __getattr__(self, name):
+        if name in ATTRIBUTE_TABLES:
+            return [self._row]  # every attribute column is on the row itself
+        return getattr(self._row, name)
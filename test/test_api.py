@@ -1,6 +1,10 @@
 from fastapi.testclient import TestClient
+from sqlalchemy import select
 
+from ..api.geometry import geometry_to_geojson
+from ..api.models.tables import Site
 from ..run import app
+from .test_db_schema import Session
 
 client = TestClient(app)
 import pytest
@@ -38,7 +42,7 @@ def test_single_equipment_query(params):
 
 
 def test_multiple_equipment_query(params):
-    params["equipment"] = ["diggers", "musical"]
+    params["equipment"] = ["diggers", "slides"]
 
     response = client.get("/query", params=params)
     geojson = response.json()
@@ -46,7 +50,7 @@ def test_multiple_equipment_query(params):
     assert response.status_code == 200
     for feature in geojson["features"]:
         assert feature["properties"]["equipment"]["diggers"] > 0
-        assert feature["properties"]["equipment"]["musical"] > 0
+        assert feature["properties"]["equipment"]["slides"] > 0
 
 
 def test_single_amenity_query(params):
@@ -111,7 +115,7 @@ def test_single_compound_query(params):
 
 
 def test_multiple_compound_query(params):
-    params["equipment"] = ["diggers", "musical"]
+    params["equipment"] = ["diggers", "slides"]
     params["amenities"] = ["splash_pad", "picnic_tables"]
     params["sports_facilities"] = ["baseball_diamond", "soccer_field"]
 
@@ -121,9 +125,126 @@ def test_multiple_compound_query(params):
     assert response.status_code == 200
     for feature in geojson["features"]:
         assert feature["properties"]["equipment"]["diggers"] > 0
-        assert feature["properties"]["equipment"]["musical"] > 0
+        assert feature["properties"]["equipment"]["slides"] > 0
         assert feature["properties"]["amenities"]["splash_pad"] > 0
         assert feature["properties"]["amenities"]["picnic_tables"] > 0
         assert feature["properties"]["sports_facilities"]["baseball_diamond"] > 0
         assert feature["properties"]["sports_facilities"]["soccer_field"] > 0
 
+
+def test_unknown_filter_query(params):
+    params["equipment"] = ["diggers", "musical"]
+
+    response = client.get("/query", params=params)
+    assert response.status_code == 400
+
+
+def test_comma_separated_filter_query(params):
+    params["equipment"] = "diggers,slides"
+
+    response = client.get("/query", params=params)
+    geojson = response.json()
+
+    assert response.status_code == 200
+    for feature in geojson["features"]:
+        assert feature["properties"]["equipment"]["diggers"] > 0
+        assert feature["properties"]["equipment"]["slides"] > 0
+
+
+def test_minimum_count_filter_query(params):
+    params["equipment"] = ["slides>=2"]
+
+    response = client.get("/query", params=params)
+    geojson = response.json()
+
+    assert response.status_code == 200
+    for feature in geojson["features"]:
+        assert feature["properties"]["equipment"]["slides"] >= 2
+
+
+def test_nearest_query():
+    params = {"latitude": 44.85, "longitude": -93.47, "k": 3, "equipment": ["slides"]}
+
+    response = client.get("/nearest", params=params)
+    geojson = response.json()
+
+    assert response.status_code == 200
+    assert len(geojson["features"]) == 3
+    distances = [feature["properties"]["distance"] for feature in geojson["features"]]
+    assert distances == sorted(distances)
+    for feature in geojson["features"]:
+        assert feature["properties"]["equipment"]["slides"] > 0
+
+
+def test_batch_query():
+    queries = [
+        {"latitude": 44.85, "longitude": -93.47, "radius": 10},
+        {"latitude": 44.85, "longitude": -93.47, "radius": 10, "equipment": ["slides>=2"]},
+        {"latitude": 0, "longitude": 0, "radius": 1},
+    ]
+
+    response = client.post("/query/batch", json=queries)
+    payload = response.json()
+
+    assert response.status_code == 200
+    assert len(payload["results"]) == 3
+    assert len(payload["results"][0]["site_ids"]) == 29
+    assert payload["results"][2]["site_ids"] == []
+    # shared sites are only sent once
+    assert len(payload["features"]) == 29
+    for site_id in payload["results"][1]["site_ids"]:
+        assert payload["features"][site_id]["properties"]["equipment"]["slides"] >= 2
+
+
+def test_tile():
+    # zoom 12 tile covering Eden Prairie
+    response = client.get("/tiles/12/984/1475.mvt")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/vnd.mapbox-vector-tile"
+    assert len(response.content) > 0
+
+
+def test_tile_out_of_range():
+    response = client.get("/tiles/2/4/0.mvt")
+    assert response.status_code == 404
+
+
+def test_low_detail_query(params):
+    full = client.get("/query", params=params).json()
+    params["zoom"] = 10
+    low = client.get("/query", params=params).json()
+
+    assert len(low["features"]) == len(full["features"])
+    full_vertices = {f["properties"]["site_id"]: len(f["geometry"]["coordinates"][0]) for f in full["features"]}
+    low_vertices = {f["properties"]["site_id"]: len(f["geometry"]["coordinates"][0]) for f in low["features"]}
+    assert all(low_vertices[site_id] <= full_vertices[site_id] for site_id in full_vertices)
+    assert any(low_vertices[site_id] < full_vertices[site_id] for site_id in full_vertices)
+
+    # the geometry is the stored geom_low column, not the full polygon or one simplified on the fly
+    with Session() as s:
+        stored = dict(s.execute(select(Site.site_id, Site.geom_low)).all())
+    for feature in low["features"]:
+        assert feature["geometry"] == geometry_to_geojson(stored[feature["properties"]["site_id"]])
+
+
+def test_streamed_query(params):
+    params["stream"] = "ndjson"
+    response = client.get("/query", params=params)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert len(response.text.splitlines()) == 29
+
+    params["stream"] = "collection"
+    response = client.get("/query", params=params)
+    assert len(response.json()["features"]) == 29
+
+
+def test_conditional_query(params):
+    response = client.get("/query", params=params)
+    etag = response.headers["etag"]
+    assert response.headers["cache-control"].startswith("public")
+
+    response = client.get("/query", params=params, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
@@ -0,0 +1,186 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from sqlalchemy.orm import configure_mappers
+
+from ..api.cache import (
+    FeatureCache,
+    ResponseCache,
+    dump,
+    feature_cache,
+    feature_collection,
+    query_key,
+    with_properties,
+)
+from ..api.dataset import Dataset, dataset
+
+
+def test_feature_collection_splices_features():
+    cache = FeatureCache()
+    first = cache.put("a", dump({"type": "Feature", "properties": {"site_id": "a"}}))
+    second = cache.put("b", dump({"type": "Feature", "properties": {"site_name": "Café"}}))
+
+    collection = json.loads(feature_collection([first, second]))
+    assert collection["type"] == "FeatureCollection"
+    assert [f["properties"] for f in collection["features"]] == [
+        {"site_id": "a"},
+        {"site_name": "Café"},
+    ]
+    assert json.loads(feature_collection([])) == {
+        "type": "FeatureCollection",
+        "features": [],
+    }
+
+
+def test_feature_cache_follows_dataset_version():
+    cache = FeatureCache()
+    version = dataset.version
+    cache.put("a", dump({"type": "Feature"}))
+    assert cache.get("a") is not None
+
+    dataset.version = version + 1
+    try:
+        assert cache.get("a") is None
+        cache.invalidate(version + 1)
+        assert len(cache) == 0
+    finally:
+        dataset.version = version
+
+
+def test_dataset_notifies_on_change():
+    seen = []
+
+    async def listener(version):
+        seen.append(version)
+
+    tracker = Dataset()
+    tracker.subscribe(seen.append)
+    tracker.subscribe(listener)
+
+    asyncio.run(tracker.set(0))
+    asyncio.run(tracker.set(3))
+    assert seen == [3, 3]
+
+
+def test_dataset_prepares_before_switching():
+    # the new version is only served once its preparers are done, and caches are dropped after that
+    events = []
+    tracker = Dataset()
+
+    async def prepare(version):
+        await asyncio.sleep(0)
+        events.append(("prepared", version, tracker.version))
+
+    tracker.prepare(prepare)
+    tracker.subscribe(lambda version: events.append(("invalidated", version, tracker.version)))
+
+    async def run():
+        # a second change to the same version waits for the first, then has nothing to do
+        await asyncio.gather(tracker.set(2), tracker.set(2))
+
+    asyncio.run(run())
+    assert events == [("prepared", 2, 0), ("invalidated", 2, 2)]
+
+
+def test_query_key_normalizes():
+    first = query_key(44.85012, -93.47004, 1600, {"equipment": {"slides": 1, "diggers": 2}})
+    second = query_key(
+        44.84996, -93.46998, 1550, {"equipment": {"diggers": 2, "slides": 1}}
+    )
+    assert first == second
+    _, latitude, longitude, radius = first[:4]
+    assert (latitude, longitude, radius) == (44.85, -93.47, 1600)
+
+
+def test_query_cache_lru_and_bounds():
+    cache = ResponseCache(max_entries=2, max_bytes=10, ttl=60)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    assert cache.get("a") == b"1234"  # a is now most recently used
+
+    cache.put("c", b"1234")  # over both bounds, b goes
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1234"
+    assert cache.size == 8
+
+    cache.put("d", b"12345678")  # too big to keep alongside anything else
+    assert len(cache) == 1
+    assert cache.stats()["evictions"] == 3
+    assert cache.stats()["hits"] == 2
+
+
+def test_query_cache_ttl():
+    cache = ResponseCache(max_entries=2, max_bytes=10, ttl=-1)
+    cache.put("a", b"1")
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_with_properties():
+    feature = dump({"type": "Feature", "properties": {"site_id": "a"}})
+    assert json.loads(with_properties(feature, {"distance": 1.5}))["properties"] == {
+        "site_id": "a",
+        "distance": 1.5,
+    }
+    empty = dump({"type": "Feature", "properties": {}})
+    assert json.loads(with_properties(empty, {"distance": 2}))["properties"] == {"distance": 2}
+
+
+def test_dump_matches_stdlib_encoding():
+    feature = {
+        "type": "Feature",
+        "geometry": {"type": "Polygon", "coordinates": [[[-93.4712345678901, 44.85], [0.1, 1e-7]]]},
+        "properties": {"site_name": "Café", "addr_zip": 55344, "beach": None},
+    }
+    stdlib = json.dumps(feature, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    assert json.loads(dump(feature)) == json.loads(stdlib)
+    assert "Café".encode("utf-8") in dump(feature)
+
+
+def test_site_feature_matches_schemas():
+    from ..api.dependencies import make_site_geojson
+    from ..api.models.schemas import AmenitiesSchema, EquipmentSchema, SportsFacilitiesSchema
+    from .test_snapshot import make_site
+
+    site = make_site("a", -93.47, 44.85, slides=2, splash_pad=1)
+    feature = asyncio.run(make_site_geojson(site))
+    properties = feature["properties"]
+
+    # same keys, in the same order, as the pydantic schemas produced
+    for param, schema in (
+        ("equipment", EquipmentSchema),
+        ("amenities", AmenitiesSchema),
+        ("sports_facilities", SportsFacilitiesSchema),
+    ):
+        expected = schema.from_orm(getattr(site, param)[0]).dict()
+        assert list(properties[param].items()) == list(expected.items())
+    assert properties["equipment"]["slides"] == 2
+
+
+def test_features_read_before_a_version_change_keep_their_version(monkeypatch):
+    # the poller moves the version while load_features waits on the db- the rows it read are still the old ones
+    from .. import api
+    from ..api.formats import OutputFormat
+    from .test_snapshot import make_site
+
+    configure_mappers()  # the attribute relationships are backrefs, made when the mappers are configured
+    version = dataset.version
+    monkeypatch.setattr(dataset, "version", version)
+    monkeypatch.setattr(api, "SITE_VIEW", False)
+
+    class FakeSession:
+        async def execute(self, statement):
+            dataset.version = version + 1
+            rows = [make_site("a", -93.47, 44.85, slides=2)]
+            return SimpleNamespace(scalars=lambda: SimpleNamespace(all=lambda: rows))
+
+    feature_cache.invalidate()
+    try:
+        features = asyncio.run(api.load_features(FakeSession(), ["a"], "full", OutputFormat(), version))
+        assert set(features) == {"a"}
+        assert feature_cache.get("a", version=version) == features["a"]
+        assert feature_cache.get("a", version=version + 1) is None
+    finally:
+        feature_cache.invalidate()
@@ -0,0 +1,43 @@
+import asyncio
+
+from ..api.coalesce import SingleFlight
+
+
+def test_concurrent_callers_share_one_task():
+    flights = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return b"result"
+
+    async def burst():
+        return await asyncio.gather(*[flights.run("key", work) for _ in range(10)])
+
+    assert asyncio.run(burst()) == [b"result"] * 10
+    assert len(calls) == 1
+    assert flights.stats() == {"in_flight": 0, "executed": 1, "coalesced": 9}
+
+
+def test_errors_reach_every_caller_and_are_not_kept():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("db went away")
+
+    async def burst():
+        return await asyncio.gather(
+            *[flights.run("key", fail) for _ in range(3)], return_exceptions=True
+        )
+
+    results = asyncio.run(burst())
+    assert all(isinstance(result, ValueError) for result in results)
+
+    async def succeed():
+        return 1
+
+    # the failed task is gone, so the next caller starts fresh
+    assert asyncio.run(flights.run("key", succeed)) == 1
+    assert flights.executed == 2
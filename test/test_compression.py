@@ -0,0 +1,55 @@
+import asyncio
+import gzip
+
+import brotli
+
+from ..api.cache import ResponseCache
+from ..api.compression import compress, compress_stream, negotiate
+
+
+def test_negotiate_prefers_brotli_and_honours_weights():
+    assert negotiate(None) is None
+    assert negotiate("identity") is None
+    assert negotiate("gzip, deflate") == "gzip"
+    assert negotiate("gzip, deflate, br") == "br"
+    assert negotiate("br;q=0.5, gzip") == "gzip"
+    assert negotiate("br;q=0, *") == "gzip"
+    assert negotiate("gzip;q=0") is None
+
+
+def test_compress_round_trips():
+    content = b'{"type":"FeatureCollection","features":[]}' * 100
+    assert gzip.decompress(compress(content, "gzip")) == content
+    assert brotli.decompress(compress(content, "br")) == content
+
+
+def test_compress_stream_round_trips():
+    chunks = [b'{"type":"Feature"}\n' * 50 for _ in range(3)]
+
+    async def source():
+        for chunk in chunks:
+            yield chunk
+
+    async def run(encoding):
+        return b"".join([part async for part in compress_stream(source(), encoding)])
+
+    assert gzip.decompress(asyncio.run(run("gzip"))) == b"".join(chunks)
+    assert brotli.decompress(asyncio.run(run("br"))) == b"".join(chunks)
+
+
+def test_response_cache_compresses_once():
+    cache = ResponseCache(max_entries=10, max_bytes=100_000, ttl=60)
+    content = b"x" * 5000
+    cache.put("key", content)
+
+    first = cache.encoded("key", "gzip", content)
+    assert cache.encoded("key", "gzip", content) is first
+    assert cache.size == len(content) + len(first)
+
+    # bodies that aren't cached are compressed but not stored
+    other = b"y" * 5000
+    assert gzip.decompress(cache.encoded("other", "gzip", other)) == other
+    assert len(cache) == 1
+
+    cache.invalidate()
+    assert cache.size == 0
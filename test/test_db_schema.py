@@ -67,3 +67,24 @@ def test_table_content(test_table_list):
                 # not just falsy
 
                 assert type(val) == int if val == 0 else val
+
+
+def test_site_view_content():
+    # the loader rebuilds the site view, one row per site
+    from sqlalchemy import select
+
+    from playground_planner.api.views import site_features
+
+    with Session() as s:
+        with s.begin():
+            rows = s.execute(select(site_features.c.site_id)).all()
+    assert len(rows) == DATA_LENGTH
+
+
+def test_radius_query_uses_spatial_index():
+    # EXPLAIN must show the radius predicate answered from the geography gist index, not a scan of every site
+    from playground_planner.utils.explain import radius_query_indexes
+
+    with engine.begin() as conn:
+        used = radius_query_indexes(conn)
+    assert "sites_geog_idx" in used
@@ -0,0 +1,77 @@
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.dialects import postgresql
+
+from ..api.dependencies import get_episode_page
+from ..api.episodes import (
+    EPISODE_FIELDS,
+    decode_cursor,
+    encode_cursor,
+    make_page,
+    page_fields,
+    page_sql,
+)
+
+
+def compiled(query) -> str:
+    return str(query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+def test_cursor_round_trip():
+    published_at = datetime(2021, 6, 1, 12, 30, 5)
+    cursor = encode_cursor(published_at, 42)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (published_at, 42)
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", "bm90IGEgY3Vyc29y", "!!!"])
+def test_bad_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_page_fields():
+    assert page_fields(None) == EPISODE_FIELDS
+    # the keys are always selected, and fields come back in table order
+    assert page_fields(["title"]) == [name for name in EPISODE_FIELDS if name in ("id", "title", "published_at")]
+    with pytest.raises(ValueError):
+        page_fields(["title", "password"])
+
+
+def test_first_page_sql():
+    sql = compiled(page_sql(None, 20, page_fields(["title"])))
+    assert "ORDER BY episodes.published_at DESC, episodes.id DESC" in sql
+    assert "LIMIT 21" in sql
+    assert "episodes.published_at IS NOT NULL" in sql
+    # list views don't pay for the long text columns
+    assert "description" not in sql and "summary" not in sql
+
+
+def test_next_page_sql_seeks_past_cursor():
+    cursor = (datetime(2021, 6, 1), 42)
+    query = page_sql(cursor, 10, EPISODE_FIELDS).compile(dialect=postgresql.dialect())
+    assert "(episodes.published_at, episodes.id) < (%(param_1)s, %(param_2)s)" in str(query)
+    assert "OFFSET" not in str(query)
+    assert query.params["param_1"] == cursor[0] and query.params["param_2"] == 42
+
+
+def test_make_page():
+    rows = [{"id": i, "published_at": datetime(2021, 1, 10 - i), "title": f"ep {i}"} for i in range(3)]
+    page = make_page(rows, 2)
+    assert [episode["id"] for episode in page["episodes"]] == [0, 1]
+    assert page["episodes"][0]["published_at"] == "2021-01-10T00:00:00"
+    assert decode_cursor(page["next"]) == (datetime(2021, 1, 9), 1)
+    # the last page has no next
+    assert make_page(rows, 3)["next"] is None
+
+
+def test_get_episode_page():
+    cursor = encode_cursor(datetime(2021, 6, 1), 42)
+    decoded, limit, fields = get_episode_page(cursor, 5, ["title,audio_url"])
+    assert decoded == (datetime(2021, 6, 1), 42) and limit == 5
+    assert set(fields) == {"id", "published_at", "title", "audio_url"}
+    with pytest.raises(HTTPException) as e:
+        get_episode_page("!!!", 5, None)
+    assert e.value.status_code == 400
@@ -0,0 +1,17 @@
+from ..utils.explain import index_scans
+
+
+def test_index_scans_walks_the_plan():
+    plan = {
+        "Node Type": "Nested Loop",
+        "Plans": [
+            {
+                "Node Type": "Bitmap Heap Scan",
+                "Relation Name": "sites",
+                "Plans": [{"Node Type": "Bitmap Index Scan", "Index Name": "sites_geog_idx"}],
+            },
+            {"Node Type": "Index Scan", "Index Name": "equipment_pkey"},
+        ],
+    }
+    assert index_scans(plan) == ["sites_geog_idx", "equipment_pkey"]
+    assert index_scans({"Node Type": "Seq Scan", "Relation Name": "sites"}) == []
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from ..api.dependencies import split_filter
+from ..api.filters import FeatureMatrix
+
+
+@pytest.fixture()
+def matrix():
+    attributes = [
+        {"equipment": {"slides": 2, "diggers": 1}, "amenities": {"splash_pad": 1}},
+        {"equipment": {"slides": 1, "diggers": None}, "amenities": {"splash_pad": 0}},
+        {"equipment": {"slides": 3}},  # no amenities row
+    ]
+    return FeatureMatrix.from_attributes(["a", "b", "c"], attributes)
+
+
+def test_split_filter_minimums():
+    assert split_filter("equipment", ["diggers,slides>=2", "slides"]) == {
+        "diggers": 1,
+        "slides": 2,
+    }
+
+
+@pytest.mark.parametrize("value", ["musical", "slides>=0", "slides>=two", "site_id"])
+def test_split_filter_rejects(value):
+    with pytest.raises(HTTPException) as e:
+        split_filter("equipment", [value])
+    assert e.value.status_code == 400
+
+
+def test_matrix_mask(matrix):
+    assert matrix.select({}) == [0, 1, 2]
+    assert matrix.select({"equipment": {"slides": 2}}) == [0, 2]
+    assert matrix.select({"equipment": {"diggers": 1}}) == [0]
+    assert matrix.select({"amenities": {"splash_pad": 1}}) == [0]
+    assert matrix.select({"equipment": {"slides": 2}}, rows=[2, 1]) == [2]
+    assert matrix.mask({"equipment": {"slides": 1}}, rows=np.array([1])).tolist() == [True]
@@ -0,0 +1,94 @@
+import json
+
+from ..api.dependencies import get_format
+from ..api.formats import (
+    OutputFormat,
+    TopoFeature,
+    add_properties,
+    assemble,
+    encode_feature,
+    encode_polyline,
+    quantize_arc,
+)
+from ..api.geometry import COORDINATE_PRECISION
+
+
+def make_feature(site_id, ring, **properties):
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Polygon", "coordinates": [ring]},
+        "properties": {"site_id": site_id, **properties},
+    }
+
+
+RING = [[-93.4712345678, 44.8512345678], [-93.47, 44.85], [-93.46, 44.851], [-93.4712345678, 44.8512345678]]
+
+
+def test_polyline_matches_reference_encoding():
+    # the example from Google's polyline documentation, as geojson (lng, lat) positions
+    points = [(-120.2, 38.5), (-120.95, 40.7), (-126.453, 43.252)]
+    assert encode_polyline(points, 5) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+
+def test_geojson_precision_rounds_coordinates():
+    fragment = encode_feature(make_feature("a", RING), OutputFormat("geojson", 6))
+    feature = json.loads(fragment)
+    assert feature["geometry"]["coordinates"][0][0] == [-93.471235, 44.851235]
+    assert list(feature)[-1] == "properties"
+
+
+def test_polyline_feature():
+    fragment = encode_feature(make_feature("a", RING), OutputFormat("polyline", 5))
+    geometry = json.loads(fragment)["geometry"]
+    assert geometry["encoding"] == "polyline5"
+    assert geometry["coordinates"] == [encode_polyline(RING, 5)]
+
+
+def test_topology_numbers_arcs_across_sites():
+    fmt = OutputFormat("topojson", 6)
+    multi = {
+        "type": "Feature",
+        "geometry": {"type": "MultiPolygon", "coordinates": [[RING, RING], [RING]]},
+        "properties": {"site_id": "b"},
+    }
+    fragments = [encode_feature(make_feature("a", RING), fmt), encode_feature(multi, fmt)]
+    topology = json.loads(assemble(fragments, fmt))
+
+    first, second = topology["objects"]["sites"]["geometries"]
+    assert first["arcs"] == [[0]]
+    assert second["arcs"] == [[[1], [2]], [[3]]]
+    assert second["id"] == "b"
+    assert len(topology["arcs"]) == 4
+
+    # decoding an arc recovers the ring to the quantization step
+    scale, translate = topology["transform"]["scale"], topology["transform"]["translate"]
+    x = y = 0
+    decoded = []
+    for dx, dy in topology["arcs"][0]:
+        x, y = x + dx, y + dy
+        decoded.append([x * scale[0] + translate[0], y * scale[1] + translate[1]])
+    for (lon, lat), (expected_lon, expected_lat) in zip(decoded, RING):
+        assert abs(lon - expected_lon) < 1e-6 and abs(lat - expected_lat) < 1e-6
+
+
+def test_add_properties_for_every_format():
+    for fmt in (OutputFormat(), OutputFormat("polyline", 5), OutputFormat("topojson", 6)):
+        fragment = add_properties(encode_feature(make_feature("a", RING), fmt), {"distance": 1.5})
+        if isinstance(fragment, TopoFeature):
+            properties = json.loads(fragment.properties)
+        else:
+            properties = json.loads(fragment)["properties"]
+        assert properties == {"site_id": "a", "distance": 1.5}
+
+
+def test_quantize_arc_is_delta_encoded():
+    arc = quantize_arc([[-180, -90], [-179.999999, -89.999998]], 6)
+    assert arc == [[0, 0], [1, 2]]
+
+
+def test_precision_is_capped_at_the_decoded_precision():
+    # fragments are built from coordinates already rounded to COORDINATE_PRECISION- more digits would be a lie
+    assert get_format("geojson", 15) == get_format("geojson", None) == OutputFormat("geojson", None)
+    assert get_format("geojson", COORDINATE_PRECISION - 1).precision == COORDINATE_PRECISION - 1
+    assert get_format("topojson", 15).precision == COORDINATE_PRECISION
+    assert get_format("polyline", None).precision == 5
@@ -0,0 +1,107 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import shapely.wkb
+from geoalchemy2 import WKBElement
+from shapely.geometry import MultiPolygon, Polygon, mapping
+
+from ..api.geometry import (
+    centroid_reach,
+    centroid_test,
+    detail_element,
+    detail_for_zoom,
+    geometry_to_geojson,
+    search_bounds,
+)
+
+EXTERIOR = [(-93.47, 44.85), (-93.46, 44.85), (-93.46, 44.86), (-93.47, 44.86), (-93.47, 44.85)]
+HOLE = [(-93.468, 44.852), (-93.462, 44.852), (-93.462, 44.858), (-93.468, 44.852)]
+
+
+def as_lists(geometry):
+    # shapely's mapping uses tuples, the decoder uses lists
+    return {
+        "type": geometry["type"],
+        "coordinates": _lists(geometry["coordinates"]),
+    }
+
+
+def _lists(value):
+    if isinstance(value, (list, tuple)) and value and isinstance(value[0], (list, tuple)):
+        return [_lists(v) for v in value]
+    return list(value)
+
+
+def test_polygon_with_hole_from_ewkb():
+    polygon = Polygon(EXTERIOR, [HOLE])
+    element = WKBElement(shapely.wkb.dumps(polygon, srid=4326), srid=4326, extended=True)
+
+    geometry = geometry_to_geojson(element, precision=None)
+    assert geometry == as_lists(mapping(polygon))
+    # rings are closed- the last coordinate is kept
+    assert geometry["coordinates"][0][-1] == geometry["coordinates"][0][0]
+
+
+def test_multipolygon_big_endian_hex():
+    multi = MultiPolygon([Polygon(EXTERIOR), Polygon([(x + 1, y) for x, y in EXTERIOR])])
+    element = WKBElement(shapely.wkb.dumps(multi, hex=True, big_endian=True), srid=4326)
+
+    assert geometry_to_geojson(element, precision=None) == as_lists(mapping(multi))
+
+
+def test_coordinate_precision():
+    polygon = Polygon([(-93.123456789, 44.987654321), (-93.1, 44.9), (-93.2, 44.9)])
+    element = WKBElement(shapely.wkb.dumps(polygon), srid=4326)
+
+    ring = geometry_to_geojson(element, precision=5)["coordinates"][0]
+    assert ring[0] == [-93.12346, 44.98765]
+
+
+def test_detail_levels():
+    # a wobbly ring: many vertices within a meter of a square
+    ring = [(-93.47 + 0.001 * i / 50, 44.85 + 0.000002 * (i % 2)) for i in range(50)]
+    ring += [(-93.469, 44.851), (-93.47, 44.851), ring[0]]
+    site = SimpleNamespace(
+        geom=WKBElement(shapely.wkb.dumps(Polygon(ring), srid=4326), srid=4326, extended=True)
+    )
+
+    full = geometry_to_geojson(detail_element(site, "full"))
+    low = geometry_to_geojson(detail_element(site, "low"))
+    assert len(full["coordinates"][0]) == len(ring)
+    assert len(low["coordinates"][0]) < 6
+    assert low["type"] == "Polygon"
+
+    assert detail_for_zoom(18) == "full"
+    assert detail_for_zoom(14) == "medium"
+    assert detail_for_zoom(3) == "low"
+
+
+def test_centroid_reach_is_furthest_vertex():
+    square = Polygon([(-93.47, 44.85), (-93.46, 44.85), (-93.46, 44.86), (-93.47, 44.86)])
+    lon, lat, reach = centroid_reach(square)
+    assert (lon, lat) == pytest.approx((-93.465, 44.855))
+    # half the diagonal of a ~790m x 1110m square
+    assert reach == pytest.approx(681, abs=2)
+
+    # a multipolygon reaches to its furthest part
+    far = Polygon([(-93.40, 44.85), (-93.39, 44.85), (-93.39, 44.86)])
+    assert centroid_reach(MultiPolygon([square, far]))[2] > reach
+
+
+def test_centroid_test_leaves_borderline_sites():
+    inside, outside = centroid_test(np.array([100.0, 500.0, 900.0]), np.array([50.0, 50.0, 50.0]), 500)
+    assert inside.tolist() == [True, False, False]
+    assert outside.tolist() == [False, False, True]
+
+
+def test_search_bounds_cover_the_radius():
+    min_lon, min_lat, max_lon, max_lat = search_bounds(-93.47, 44.85, 10_000)
+    assert min_lon < -93.47 < max_lon and min_lat < 44.85 < max_lat
+    assert max_lon - min_lon < 1
+
+    # boxes that would cross the antimeridian, or reach all the way round, span every longitude
+    for longitude, latitude, radius in [(179.99, 0.0, 10_000), (-179.99, 10.0, 10_000), (0.0, 0.0, 2.5e7)]:
+        min_lon, min_lat, max_lon, max_lat = search_bounds(longitude, latitude, radius)
+        assert (min_lon, max_lon) == (-180.0, 180.0)
+        assert -90.0 <= min_lat <= latitude <= max_lat <= 90.0
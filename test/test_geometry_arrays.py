@@ -0,0 +1,99 @@
+import os
+
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely.ops
+import shapely.wkb
+from shapely import affinity
+from shapely.geometry import MultiPolygon, Point, Polygon, box
+
+from ..api.geometry import centroid_reach, decode_polygons
+from ..utils.bulk_load import validate_sites
+from ..utils.geometry_arrays import GeometryArrays, box_ewkb, point_ewkb
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), "..", "data")
+
+
+@pytest.fixture(scope="module")
+def geometries():
+    sites = list(gpd.read_file(os.path.join(DATA_PATH, "json", "playgrounds.json")).geometry)
+    hole = Polygon(
+        [(-93.47, 44.85), (-93.46, 44.85), (-93.46, 44.86), (-93.47, 44.86)],
+        [[(-93.468, 44.852), (-93.468, 44.854), (-93.466, 44.854), (-93.466, 44.852)]],
+    )
+    multi = MultiPolygon([sites[0], affinity.translate(sites[1], 0.01, 0)])
+    return sites + [hole, multi]
+
+
+def test_ewkb_matches_shapely(geometries):
+    arrays = GeometryArrays([geom.wkb for geom in geometries])
+    assert arrays.ewkb(4326) == [shapely.wkb.dumps(geom, srid=4326) for geom in geometries]
+
+
+def test_bounds_centroids_and_reach(geometries):
+    arrays = GeometryArrays([geom.wkb for geom in geometries])
+    np.testing.assert_array_equal(arrays.bounds(), [geom.bounds for geom in geometries])
+
+    centroids = arrays.centroids()
+    expected = [(geom.centroid.x, geom.centroid.y) for geom in geometries]
+    np.testing.assert_allclose(centroids, expected, rtol=0, atol=1e-12)
+
+    reaches = [centroid_reach(geom)[2] for geom in geometries]
+    np.testing.assert_allclose(arrays.reaches(centroids), reaches, rtol=1e-9)
+
+
+def test_reprojected_ewkb(geometries):
+    arrays = GeometryArrays([geom.wkb for geom in geometries])
+    projected = arrays.ewkb(32615, arrays.reproject(4326, 32615))
+    expected = gpd.GeoSeries(geometries, crs=4326).to_crs(32615)
+    for wkb, geom in zip(projected, expected):
+        assert shapely.wkb.loads(wkb).equals_exact(geom, 1e-6)
+        assert int.from_bytes(wkb[5:9], "little") == 32615
+
+
+def test_fixed_shape_ewkb(geometries):
+    bounds = np.array([geom.bounds for geom in geometries])
+    assert box_ewkb(bounds, 4326) == [shapely.wkb.dumps(box(*row), srid=4326) for row in bounds]
+    points = np.array([[-93.47, 44.85], [-93.4, 44.9]])
+    assert point_ewkb(points, 4326) == [shapely.wkb.dumps(Point(*row), srid=4326) for row in points]
+
+
+def test_coords_match_site_decoder(geometries):
+    # the same walk of the WKB as api.geometry.decode_polygons
+    arrays = GeometryArrays([geom.wkb for geom in geometries])
+    expected = [ring for geom in geometries for rings in decode_polygons(geom.wkb, None) for ring in rings]
+    np.testing.assert_array_equal(arrays.coords, np.vstack(expected))
+
+
+def test_only_polygons_are_read():
+    with pytest.raises(ValueError):
+        GeometryArrays([Point(0, 0).wkb])
+
+
+def test_z_is_dropped(geometries):
+    # ie: the PolygonZ shapefile- the arrays and the EWKB are 2D, in the same places
+    flat = geometries[-2:]
+    raised = [shapely.ops.transform(lambda x, y: (x, y, 250.0), geom) for geom in flat]
+    assert all(geom.has_z for geom in raised)
+    arrays = GeometryArrays([geom.wkb for geom in raised])
+    np.testing.assert_array_equal(arrays.coords, GeometryArrays([geom.wkb for geom in flat]).coords)
+    assert arrays.ewkb(4326) == [shapely.wkb.dumps(geom, srid=4326) for geom in flat]
+
+
+def test_big_endian_is_read(geometries):
+    arrays = GeometryArrays([shapely.wkb.dumps(geom, big_endian=True) for geom in geometries])
+    np.testing.assert_array_equal(arrays.coords, GeometryArrays([geom.wkb for geom in geometries]).coords)
+    assert arrays.ewkb(4326) == [shapely.wkb.dumps(geom, srid=4326) for geom in geometries]
+
+
+def test_validate_sites_repairs_and_rejects():
+    bowtie = Polygon([(0, 0), (1, 1), (1, 0), (0, 1)])
+    square = box(0, 0, 1, 1)
+    data = gpd.GeoDataFrame({"name": ["a", "b"]}, geometry=[bowtie, square], index=["S1", "S2"])
+    repaired = validate_sites(data)
+    assert repaired.geometry.is_valid.all()
+
+    data = gpd.GeoDataFrame({"name": ["a"]}, geometry=[Point(0, 0)], index=["S3"])
+    with pytest.raises(ValueError, match="S3"):
+        validate_sites(data)
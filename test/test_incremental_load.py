@@ -0,0 +1,58 @@
+import pandas as pd
+
+from ..api.models.tables import Equipment, Episodes
+from ..utils.incremental_load import diff_table, frame_hashes, hash_frame, upsert_sql
+
+
+def equipment(slides):
+    return pd.DataFrame({"site_id": list(slides), "slides": list(slides.values())})
+
+
+def test_diff_table_finds_inserts_updates_and_deletes():
+    table = Equipment.__table__
+    _, _, keys, hashes = frame_hashes(table, equipment({"a": 1, "b": 2, "c": 3}))
+    stored = dict(zip(keys, hashes))
+
+    # b changes, c goes away, d is new
+    diff = diff_table(table, equipment({"a": 1, "b": 5, "d": 1}), ["a", "b", "c"], stored)
+    assert diff.counts == {"inserted": 1, "updated": 1, "deleted": 1}
+    assert [record[0] for record in diff.upserts] == ["b", "d"]
+    assert diff.deletes == ["c"]
+    assert set(diff.hashes) == {"b", "d"}
+
+
+def test_diff_table_without_changes_writes_nothing():
+    table = Equipment.__table__
+    frame = equipment({"a": 1, "b": 2})
+    _, _, keys, hashes = frame_hashes(table, frame)
+
+    diff = diff_table(table, frame, ["a", "b"], dict(zip(keys, hashes)))
+    assert diff.counts == {"inserted": 0, "updated": 0, "deleted": 0}
+    assert diff.upserts == []
+
+
+def test_rows_without_a_stored_hash_are_rewritten():
+    diff = diff_table(Equipment.__table__, equipment({"a": 1}), ["a"], {})
+    assert diff.counts == {"inserted": 0, "updated": 1, "deleted": 0}
+
+
+def test_numeric_keys_are_compared_as_stored():
+    frame = pd.DataFrame({"id": [1, 2], "title": ["one", "two"]})
+    diff = diff_table(Episodes.__table__, frame, [2, 3], {})
+    assert diff.deletes == [3]
+    assert diff.inserted == 1
+
+
+def test_hash_frame_covers_every_table():
+    hashes = hash_frame({"equipment": equipment({"a": 1, "b": 2})})
+    assert list(hashes.columns) == ["table_name", "row_key", "row_hash"]
+    assert hashes.row_key.tolist() == ["a", "b"]
+    assert (hashes.table_name == "equipment").all()
+
+
+def test_upsert_sql():
+    sql = upsert_sql("equipment", "stage_equipment", ["site_id", "slides"], ["site_id"])
+    assert sql == (
+        "INSERT INTO equipment (site_id, slides) SELECT site_id, slides FROM stage_equipment "
+        "ON CONFLICT (site_id) DO UPDATE SET slides = EXCLUDED.slides"
+    )
@@ -0,0 +1,46 @@
+import pytest
+from pyproj import Geod
+from shapely.geometry import Point
+from sqlalchemy.dialects import postgresql
+
+from ..api import dependencies
+from ..api.planar import PLANAR_MAX_ERROR, planar_point
+
+GEOD = Geod(ellps="WGS84")
+
+
+def planar_error(lon1, lat1, lon2, lat2):
+    # relative error of the planar distance against the spheroid
+    _, _, geodesic = GEOD.inv(lon1, lat1, lon2, lat2)
+    planar = Point(planar_point(lon1, lat1)).distance(Point(planar_point(lon2, lat2)))
+    return abs(planar - geodesic) / geodesic
+
+
+@pytest.mark.parametrize(
+    "lon, lat",
+    [
+        (-93.27, 44.98),  # minneapolis
+        (-93.47, 44.85),  # eden prairie
+        (-92.10, 46.79),  # duluth
+        (-96.77, 46.87),  # moorhead, in zone 14
+        (-91.50, 43.60),  # the southeast corner
+    ],
+)
+def test_planar_distance_error_is_bounded(lon, lat):
+    # a 5 mile hop east and north of each point
+    assert planar_error(lon, lat, lon + 0.1, lat + 0.03) < PLANAR_MAX_ERROR
+
+
+def test_planar_distance_error_in_the_metro():
+    # ~0.04% short near the central meridian, ie: a few meters over a 10 mile radius
+    error = planar_error(-93.27, 44.98, -93.47, 44.85)
+    assert 0.0003 < error < 0.0005
+
+
+def test_within_radius_planar_sql(monkeypatch):
+    monkeypatch.setattr(dependencies, "PLANAR_MODE", True)
+    sql = str(
+        dependencies.within_radius(44.85, -93.47, 1000).compile(dialect=postgresql.dialect())
+    )
+    assert "ST_DWithin(sites.geom_planar, ST_SetSRID(ST_MakePoint(" in sql
+    assert "geography" not in sql
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from ..api import podcast
+from ..api.podcast import EpisodeSync, episode_rows, fetch_episodes, upsert_episodes_statement
+
+EPISODES = [
+    {
+        "id": 1,
+        "title": "Pilot",
+        "published_at": "2021-07-01T10:00:00.000-05:00",
+        "inactive_at": None,
+        "duration": 1800,
+        "explicit": False,
+        "not_a_column": "dropped",
+    },
+    {"id": 2, "title": "Swings", "published_at": "2021-07-08T10:00:00Z"},
+]
+
+
+class StubBuzzsprout(BaseHTTPRequestHandler):
+    # answers like Buzzsprout's episodes endpoint; /slow/... takes a while to answer
+    delay = 0.5
+
+    def do_GET(self):
+        if self.path.startswith("/slow/"):
+            time.sleep(self.delay)
+        body = json.dumps(EPISODES).encode()
+        self.send_response(200 if "episodes.json" in self.path else 404)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def stub_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubBuzzsprout)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_fetch_episodes_from_stub(stub_url, monkeypatch):
+    monkeypatch.setattr(podcast, "BUZZSPROUT_URL", stub_url)
+
+    async def fetch():
+        async with httpx.AsyncClient(timeout=5) as client:
+            return await fetch_episodes(client)
+
+    assert asyncio.run(fetch()) == EPISODES
+
+
+def test_sync_times_out_without_writing(stub_url, monkeypatch):
+    monkeypatch.setattr(podcast, "BUZZSPROUT_URL", stub_url + "/slow")
+    sync = EpisodeSync()
+
+    async def run():
+        async with httpx.AsyncClient(timeout=0.1) as client:
+            # no session is needed, since nothing is written
+            return await sync.run(None, client)
+
+    result = asyncio.run(run())
+    assert "Timeout" in result["error"]
+    assert sync.last_result is result
+
+
+def test_event_loop_keeps_running_during_fetch(stub_url, monkeypatch):
+    # a ticker on the same loop measures how late it wakes up while Buzzsprout is slow to answer
+    monkeypatch.setattr(podcast, "BUZZSPROUT_URL", stub_url + "/slow")
+
+    async def measure():
+        lags = []
+
+        async def ticker():
+            while True:
+                started = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lags.append(time.perf_counter() - started - 0.01)
+
+        task = asyncio.ensure_future(ticker())
+        async with httpx.AsyncClient(timeout=5) as client:
+            episodes = await fetch_episodes(client)
+        task.cancel()
+        return episodes, lags
+
+    episodes, lags = asyncio.run(measure())
+    assert episodes == EPISODES
+    assert len(lags) > 20  # the ticker kept running for the whole request
+    assert max(lags) < 0.1
+
+
+def test_episode_rows_fit_the_table():
+    rows = episode_rows(EPISODES)
+    assert "not_a_column" not in rows[0]
+    assert rows[0]["published_at"] == datetime(2021, 7, 1, 15, 0)
+    assert rows[1]["published_at"] == datetime(2021, 7, 8, 10, 0)
+    assert rows[1]["duration"] is None
+    assert set(rows[0]) == set(rows[1])
+
+
+def test_upsert_is_one_statement_skipping_unchanged_rows():
+    sql = str(upsert_episodes_statement(episode_rows(EPISODES)).compile(dialect=postgresql.dialect()))
+    assert sql.count("INSERT INTO episodes") == 1
+    assert "ON CONFLICT (id) DO UPDATE SET" in sql
+    assert "IS DISTINCT FROM excluded.title" in sql
+    assert sql.endswith("RETURNING episodes.id")
+
+
+def test_write_bumps_only_the_episode_version(monkeypatch):
+    # a sync drops the episode pages, and leaves the site caches and dataset version alone
+    from ..api.cache import episode_cache, query_cache
+    from ..api.dataset import EPISODES_VERSION_ID, dataset, episode_dataset
+
+    statements = []
+
+    class FakeSession:
+        # just enough of an AsyncSession for EpisodeSync.write
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        def begin(self):
+            return self
+
+        async def execute(self, statement):
+            statements.append(statement)
+            return SimpleNamespace(all=lambda: [(1,), (2,)], scalar=lambda: episode_dataset.version + 1)
+
+    monkeypatch.setattr(episode_dataset, "version", episode_dataset.version)
+    monkeypatch.setattr(episode_dataset, "_lock", None)
+    site_version = dataset.version
+    episode_cache.put(("page",), b"[]")
+    query_cache.put(("query",), b"[]")
+    try:
+        result = asyncio.run(EpisodeSync.write(FakeSession, episode_rows(EPISODES)))
+        assert result == {"received": 2, "written": 2}
+        assert episode_cache.get(("page",)) is None
+        assert query_cache.get(("query",)) == b"[]"
+        assert dataset.version == site_version
+
+        bump = statements[-1].compile(dialect=postgresql.dialect())
+        assert "INSERT INTO dataset_version" in str(bump)
+        assert bump.params["id"] == EPISODES_VERSION_ID
+    finally:
+        query_cache.invalidate()
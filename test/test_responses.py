@@ -0,0 +1,26 @@
+from ..api.cache import query_key
+from ..api.responses import etag_matches, make_etag
+
+
+def test_etag_is_deterministic_and_follows_the_request():
+    key = query_key(44.85, -93.47, 16093.44, {"equipment": {"slides": 1}}, "full", "geojson")
+    assert make_etag(key) == make_etag(
+        query_key(44.85, -93.47, 16093.44, {"equipment": {"slides": 1}}, "full", "geojson")
+    )
+    assert make_etag(key) != make_etag(query_key(44.85, -93.47, 16093.44, {}, "full", "geojson"))
+    assert make_etag(key) != make_etag(query_key(44.85, -93.47, 16093.44, {}, "low", "geojson"))
+    assert make_etag(key).startswith('W/"')
+
+
+def test_etag_follows_the_dataset_version():
+    assert make_etag(("episodes", 1)) != make_etag(("episodes", 2))
+
+
+def test_etag_matches():
+    etag = make_etag(("episodes", 1))
+    assert etag_matches(etag, etag)
+    assert etag_matches(etag[2:], etag)  # weak comparison
+    assert etag_matches('"other", ' + etag, etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches(make_etag(("episodes", 2)), etag)
@@ -0,0 +1,182 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from geoalchemy2.shape import from_shape
+from pyproj import Geod
+from shapely.geometry import Polygon
+
+from ..api.dependencies import FILTER_TABLES
+from ..api.snapshot import SiteSnapshot, geodesic_distance
+
+
+def make_site(site_id, lon, lat, **attributes):
+    # fake site row shaped like the ORM objects the snapshot is loaded from
+    size = 0.0005
+    polygon = Polygon(
+        [(lon, lat), (lon + size, lat), (lon + size, lat + size), (lon, lat + size)]
+    )
+    site = SimpleNamespace(
+        site_id=site_id,
+        site_name=f"Site {site_id}",
+        substrate_type="wood chips",
+        addr_street1="1 Main St",
+        addr_city="Eden Prairie",
+        addr_state="MN",
+        addr_zip=55344,
+        geom=from_shape(polygon, srid=4326),
+    )
+    for param, table in FILTER_TABLES.items():
+        row = {
+            col.name: attributes.get(col.name, 0)
+            for col in table.__table__.columns
+            if col.name != "site_id"
+        }
+        setattr(site, param, [SimpleNamespace(**row)])
+    return site
+
+
+@pytest.fixture()
+def loaded_snapshot():
+    sites = [
+        make_site("a", -93.47, 44.85, slides=2, splash_pad=1),
+        make_site("b", -93.40, 44.85, slides=1),
+        make_site("c", -93.20, 44.95, diggers=1),
+    ]
+    snapshot = SiteSnapshot()
+    entries = [asyncio.run(snapshot.make_entry(site)) for site in sites]
+    snapshot.build(entries)
+    return snapshot
+
+
+def test_geodesic_distance_matches_spheroid():
+    polygon = Polygon([(-93.46, 44.85), (-93.459, 44.85), (-93.459, 44.851)])
+    _, _, expected = Geod(ellps="WGS84").inv(-93.47, 44.85, -93.46, 44.85)
+
+    assert geodesic_distance(-93.47, 44.85, polygon) == pytest.approx(expected, rel=1e-4)
+    assert geodesic_distance(-93.4595, 44.8502, polygon) == 0
+
+
+def test_snapshot_radius_query(loaded_snapshot):
+    entries = loaded_snapshot.query(44.85, -93.47, 1000, {})
+    assert [entry.site_id for entry in entries] == ["a"]
+
+    entries = loaded_snapshot.query(44.85, -93.47, 10000, {})
+    assert [entry.site_id for entry in entries] == ["a", "b"]
+
+
+def test_snapshot_filtered_query(loaded_snapshot):
+    entries = loaded_snapshot.query(44.85, -93.47, 10000, {"amenities": {"splash_pad": 1}})
+    assert [entry.site_id for entry in entries] == ["a"]
+
+    entries = loaded_snapshot.query(44.85, -93.47, 50000, {"equipment": {"diggers": 1}})
+    assert [entry.site_id for entry in entries] == ["c"]
+
+    entries = loaded_snapshot.query(44.85, -93.47, 10000, {"equipment": {"slides": 2}})
+    assert [entry.site_id for entry in entries] == ["a"]
+
+
+def test_snapshot_nearest(loaded_snapshot):
+    nearest = loaded_snapshot.nearest(44.85, -93.47, 2, {})
+    assert [entry.site_id for entry, _ in nearest] == ["a", "b"]
+    assert nearest[0][1] == 0
+    assert 5000 < nearest[1][1] < 6000
+
+    # c is ~25km away, beyond the first search radius
+    nearest = loaded_snapshot.nearest(44.85, -93.47, 5, {"equipment": {"diggers": 1}})
+    assert [entry.site_id for entry, _ in nearest] == ["c"]
+
+    assert loaded_snapshot.nearest(44.85, -93.47, 5, {"amenities": {"beach": 1}}) == []
+
+
+def test_snapshot_search_matches_exact_distance():
+    # the centroid tests must never change the answer, only how often the polygon is measured
+    sites = [
+        make_site(str(i), -93.47 + (i % 20) * 0.004, 44.85 + (i // 20) * 0.004)
+        for i in range(400)
+    ]
+    snapshot = SiteSnapshot()
+    snapshot.build([asyncio.run(snapshot.make_entry(site)) for site in sites])
+
+    for radius in (150, 500, 1234, 3000):
+        matches = snapshot.search(44.87, -93.43, radius, {})
+        expected = [
+            entry.site_id
+            for entry in snapshot._state[0]
+            if geodesic_distance(-93.43, 44.87, entry.geom) <= radius
+        ]
+        assert [entry.site_id for entry, _ in matches] == expected
+        for entry, distance in matches:
+            _, _, centroid_distance = Geod(ellps="WGS84").inv(
+                -93.43, 44.87, entry.geom.centroid.x, entry.geom.centroid.y
+            )
+            assert distance == pytest.approx(centroid_distance)
+
+
+def test_query_during_version_change_is_not_served_after_it(loaded_snapshot, monkeypatch):
+    # a /query answered while the next version's snapshot loads must not be served once that version is live
+    from .. import api
+    from ..api.cache import query_cache
+    from ..api.dataset import dataset
+    from ..api.formats import OutputFormat
+
+    serving = SiteSnapshot()
+    serving.build(loaded_snapshot._state[0][:1])  # only site a
+    monkeypatch.setattr(api, "SNAPSHOT_MODE", True)
+    monkeypatch.setattr(api, "snapshot", serving)
+    monkeypatch.setattr(dataset, "version", dataset.version)
+    monkeypatch.setattr(dataset, "_preparers", [])
+    monkeypatch.setattr(dataset, "_lock", None)
+    query_cache.invalidate()
+
+    async def site_ids():
+        response = await api.query(44.85, -93.47, 10_000.0, {}, "full", OutputFormat(), None, None, None)
+        return {feature["properties"]["site_id"] for feature in json.loads(response.body)["features"]}
+
+    async def run():
+        loaded = asyncio.Event()
+
+        async def reload(version):
+            await loaded.wait()
+            serving.build(loaded_snapshot._state[0])  # sites a, b and c
+
+        dataset.prepare(reload)
+        change = asyncio.create_task(dataset.set(dataset.version + 1))
+        await asyncio.sleep(0)  # the change is now waiting on the reload
+        during = await site_ids()
+        loaded.set()
+        await change
+        return during, await site_ids()
+
+    try:
+        during, after = asyncio.run(run())
+    finally:
+        query_cache.invalidate()
+    assert during == {"a"}
+    assert after == {"a", "b"}
+
+
+def test_cached_query_names_its_distance_origin(loaded_snapshot, monkeypatch):
+    # a cached /query answers for every point snapped to its key, so distances are from the snapped point
+    from .. import api
+    from ..api.cache import query_cache, query_key
+    from ..api.formats import OutputFormat
+    from ..api.responses import DISTANCE_ORIGIN_HEADER
+    from ..api.dependencies import meters_to_miles
+
+    monkeypatch.setattr(api, "SNAPSHOT_MODE", True)
+    monkeypatch.setattr(api, "snapshot", loaded_snapshot)
+    query_cache.invalidate()
+    try:
+        response = asyncio.run(api.query(44.85037, -93.47041, 10_000.0, {}, "full", OutputFormat(), None, None, None))
+    finally:
+        query_cache.invalidate()
+
+    _, latitude, longitude = query_key(44.85037, -93.47041, 10_000.0, {})[:3]
+    assert (latitude, longitude) != (44.85037, -93.47041)
+    assert response.headers[DISTANCE_ORIGIN_HEADER] == f"{latitude},{longitude}"
+    for feature in json.loads(response.body)["features"]:
+        centroid = Polygon(feature["geometry"]["coordinates"][0]).centroid
+        _, _, distance = Geod(ellps="WGS84").inv(longitude, latitude, centroid.x, centroid.y)
+        assert feature["properties"]["centroid_distance"] == pytest.approx(meters_to_miles(distance), rel=1e-4)
@@ -0,0 +1,35 @@
+import asyncio
+import json
+
+from ..api.streaming import frame
+
+
+async def batches(*groups):
+    for group in groups:
+        yield list(group)
+
+
+def collect(mode, *groups):
+    async def run():
+        return [chunk async for chunk in frame(batches(*groups), mode)]
+
+    return b"".join(asyncio.run(run()))
+
+
+FEATURES = [b'{"type":"Feature","properties":{"site_id":"%d"}}' % i for i in range(5)]
+
+
+def test_ndjson_frames_one_feature_per_line():
+    body = collect("ndjson", FEATURES[:2], [], FEATURES[2:])
+    lines = body.decode().splitlines()
+    assert [json.loads(line)["properties"]["site_id"] for line in lines] == ["0", "1", "2", "3", "4"]
+    assert body.endswith(b"\n")
+
+
+def test_collection_is_one_document():
+    body = collect("collection", [], FEATURES[:2], FEATURES[2:])
+    collection = json.loads(body)
+    assert collection["type"] == "FeatureCollection"
+    assert len(collection["features"]) == 5
+
+    assert json.loads(collect("collection")) == {"type": "FeatureCollection", "features": []}
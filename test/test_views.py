@@ -0,0 +1,95 @@
+import asyncio
+from types import SimpleNamespace
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import configure_mappers
+
+from ..api.dependencies import make_site_geojson
+from ..api.views import (
+    ATTRIBUTE_COLUMNS,
+    ViewSite,
+    create_view_statements,
+    radius_view_sql,
+    view_columns,
+)
+from .test_snapshot import make_site
+
+
+def test_view_has_every_attribute_column():
+    view_sql = create_view_statements()[0].text
+    for col in ATTRIBUTE_COLUMNS:
+        assert f"{col.table.name}.{col.name}" in view_sql
+    assert "geography(sites.geom) AS geog" in view_sql
+
+
+def test_view_columns_only_carry_the_requested_detail():
+    names = [col.name for col in view_columns("low")]
+    assert "geom" in names and "geom_low" in names
+    assert "geom_high" not in names and "geog" not in names
+    assert "geom_low" not in [col.name for col in view_columns("full")]
+
+
+def test_radius_view_sql_filters_without_joins():
+    sql = str(
+        radius_view_sql(44.85, -93.47, 1000, {"equipment": {"slides": 2}, "amenities": {"beach": 1}})
+        .compile(dialect=postgresql.dialect())
+    )
+    assert "JOIN" not in sql
+    assert "ST_DWithin(site_features.geog" in sql
+    # the geography index condition is a top level conjunct, not hidden in the centroid shortcut
+    assert ") AND (site_features.geog && _ST_Expand(" in sql
+    assert "CASE" not in sql
+    # only ids and distances- uncached features are read separately
+    selected = sql.split("FROM site_features")[0]
+    assert "site_features.site_id" in selected and "AS centroid_distance" in selected
+    assert "site_features.geom," not in selected and "site_features.slides" not in selected
+    assert "site_features.slides >=" in sql and "site_features.beach >=" in sql
+
+
+def view_row(site):
+    # a site_features row for a fake site
+    return SimpleNamespace(
+        **{name: getattr(site, name) for name in ("site_id", "site_name", "substrate_type", "geom")},
+        **{name: getattr(site, name) for name in ("addr_street1", "addr_city", "addr_state", "addr_zip")},
+        **vars(site.equipment[0]),
+        **vars(site.amenities[0]),
+        **vars(site.sports_facilities[0]),
+    )
+
+
+def test_view_row_builds_the_same_feature():
+    site = make_site("a", -93.47, 44.85, slides=2, splash_pad=1)
+    row = view_row(site)
+    assert asyncio.run(make_site_geojson(ViewSite(row))) == asyncio.run(make_site_geojson(site))
+
+
+def test_load_features_reads_sites_missing_from_the_view(monkeypatch):
+    # /nearest and /query/batch pick ids from sites- a site the view hasn't caught up with is read from the
+    # tables, and an id with no row anywhere is left out instead of failing the request
+    from .. import api
+    from ..api.cache import feature_cache
+    from ..api.formats import OutputFormat
+
+    configure_mappers()
+    monkeypatch.setattr(api, "SITE_VIEW", True)
+    in_view, in_tables = make_site("a", -93.47, 44.85), make_site("b", -93.40, 44.85)
+
+    class FakeSession:
+        def __init__(self):
+            self.statements = []
+
+        async def execute(self, statement):
+            self.statements.append(str(statement))
+            if len(self.statements) == 1:
+                return SimpleNamespace(all=lambda: [view_row(in_view)])
+            return SimpleNamespace(scalars=lambda: SimpleNamespace(all=lambda: [in_tables]))
+
+    session = FakeSession()
+    feature_cache.invalidate()
+    try:
+        features = asyncio.run(api.load_features(session, ["a", "b", "gone"], "full", OutputFormat()))
+    finally:
+        feature_cache.invalidate()
+    assert set(features) == {"a", "b"}
+    assert "FROM site_features" in session.statements[0]
+    assert "FROM sites" in session.statements[1]
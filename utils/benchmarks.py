@@ -0,0 +1,356 @@
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict
+
+import numpy as np
+import shapely.wkb
+from geoalchemy2 import WKBElement, shape
+from shapely.geometry import shape as to_shapely
+
+from ..api.filters import FeatureMatrix, FILTER_COLUMNS
+from ..api.formats import OutputFormat, assemble, encode_feature
+from ..api.geometry import geometry_to_geojson
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), "..", "data")
+
+# run from the directory above the package, ie:
+#   python -m playground_planner.utils.benchmarks filters
+# each benchmark prints one line per case so results can be pasted into a PR
+
+
+def timed(fn: Callable, repeat: int = 5) -> float:
+    # best of several runs, in seconds
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def report(name: str, size: int, results: Dict[str, float]):
+    columns = "  ".join(f"{label}={seconds * 1000:.3f}ms" for label, seconds in results.items())
+    print(f"{name:<10} n={size:<9} {columns}")
+
+
+# %% attribute filters
+def bench_filters(sizes=(29, 10_000, 1_000_000)):
+    # the old /query loop looked up every filter in each site's attribute dicts;
+    # the feature matrix evaluates the same filters as one vectorized mask
+    rng = np.random.default_rng(778)
+    filters = {
+        "equipment": {"diggers": 1, "slides": 2},
+        "amenities": {"splash_pad": 1},
+    }
+    keys = [(param, name) for param, names in filters.items() for name in names]
+
+    for size in sizes:
+        values = rng.integers(0, 4, size=(size, len(FILTER_COLUMNS)), dtype=np.int32)
+        matrix = FeatureMatrix([str(i) for i in range(size)], values)
+
+        # only the filtered columns are materialized as dicts, which flatters the loop
+        dicts = [
+            {
+                param: {
+                    name: int(values[row, matrix.positions[(param, name)]])
+                    for name in names
+                }
+                for param, names in filters.items()
+            }
+            for row in range(size)
+        ]
+
+        def loop():
+            matches = []
+            for row, site in enumerate(dicts):
+                skip_flag = False
+                for param, name in keys:
+                    if site[param][name] < filters[param][name]:
+                        skip_flag = True
+                if not skip_flag:
+                    matches.append(row)
+            return matches
+
+        def vectorized():
+            return matrix.select(filters)
+
+        assert loop() == vectorized()
+        report("filters", size, {"loop": timed(loop), "matrix": timed(vectorized)})
+
+
+def site_geometries():
+    # the surveyed playground polygons, as the EWKB elements the db hands back
+    with open(os.path.join(DATA_PATH, "json", "playgrounds.json")) as f:
+        features = json.load(f)["features"]
+    return [
+        WKBElement(
+            shapely.wkb.dumps(to_shapely(feature["geometry"]), srid=4326),
+            srid=4326,
+            extended=True,
+        )
+        for feature in features
+    ]
+
+
+# %% geometry encoding
+def bench_geometry(repeat_sites=100):
+    # the old make_site_geojson went WKB -> shapely -> WKT -> string parsing
+    def wkt_path(element):
+        wkt = shape.to_shape(element).wkt
+        wkt = wkt.strip("POLYGON ((").strip("))").split(" ")
+        geom_tuples_list = []
+        for i, coord in enumerate(wkt):
+            if coord[-1] == ",":
+                lat = float(coord.strip(","))
+                lon = float(wkt[i - 1])
+                geom_tuples_list.append((lon, lat))
+        return geom_tuples_list
+
+    elements = site_geometries() * repeat_sites
+    results = {
+        "wkt": timed(lambda: [wkt_path(element) for element in elements]),
+        "wkb": timed(lambda: [geometry_to_geojson(element, None) for element in elements]),
+        "wkb_6dp": timed(lambda: [geometry_to_geojson(element, 6) for element in elements]),
+    }
+    # per feature, in microseconds
+    print(
+        f"{'geometry':<10} n={len(elements):<9} "
+        + "  ".join(f"{label}={seconds / len(elements) * 1e6:.2f}us/feature" for label, seconds in results.items())
+    )
+
+
+# %% output formats
+def bench_formats(repeat_sites=10):
+    # response size and encode time for the same features in each output format
+    # properties are a stand-in the size of a real site's attribute dicts
+    properties = {"site_id": "0", "site_name": "Playground", "equipment": {f"col_{i}": 1 for i in range(40)}}
+    features = [
+        {"type": "Feature", "geometry": geometry_to_geojson(element, None), "properties": properties}
+        for element in site_geometries() * repeat_sites
+    ]
+    formats = {
+        "geojson": OutputFormat(),
+        "geojson_6dp": OutputFormat("geojson", 6),
+        "polyline5": OutputFormat("polyline", 5),
+        "topojson6": OutputFormat("topojson", 6),
+    }
+    for label, fmt in formats.items():
+        body = assemble([encode_feature(feature, fmt) for feature in features], fmt)
+        seconds = timed(lambda: assemble([encode_feature(feature, fmt) for feature in features], fmt))
+        # geometry bytes alone, since the properties are the same in every format
+        bare = assemble(
+            [encode_feature(dict(feature, properties={}), fmt) for feature in features], fmt
+        )
+        print(
+            f"{label:<12} n={len(features):<6} bytes={len(body):<9} geometry_bytes={len(bare):<9} "
+            f"encode={seconds * 1000:.3f}ms"
+        )
+
+
+# %% response serialization
+def bench_serialize(repeat_sites=10):
+    # the old path built each feature from three pydantic schemas and a geojson.Feature,
+    # then FastAPI ran the FeatureCollection through jsonable_encoder and json.dumps
+    import asyncio
+    from types import SimpleNamespace
+
+    from fastapi.encoders import jsonable_encoder
+    from geojson import Feature, FeatureCollection
+
+    from ..api.cache import dump, feature_collection
+    from ..api.dependencies import FILTER_TABLES, make_site_geojson
+    from ..api.models.schemas import AmenitiesSchema, EquipmentSchema, SportsFacilitiesSchema
+
+    def fake_site(i, element):
+        site = SimpleNamespace(
+            site_id=str(i), site_name=f"Site {i}", substrate_type="wood chips", addr_street1="1 Main St",
+            addr_city="Eden Prairie", addr_state="MN", addr_zip=55344, geom=element,
+        )
+        for param, table in FILTER_TABLES.items():
+            row = {col.name: 1 for col in table.__table__.columns if col.name != "site_id"}
+            setattr(site, param, [SimpleNamespace(**row)])
+        return site
+
+    sites = [fake_site(i, element) for i, element in enumerate(site_geometries() * repeat_sites)]
+
+    def old_path():
+        features = []
+        for site in sites:
+            properties = {
+                "site_id": site.site_id, "site_name": site.site_name, "substrate_type": site.substrate_type,
+                "addr_street1": site.addr_street1, "addr_city": site.addr_city, "addr_state": site.addr_state,
+                "addr_zip": site.addr_zip,
+                "equipment": EquipmentSchema.from_orm(site.equipment[0]).dict(),
+                "amenities": AmenitiesSchema.from_orm(site.amenities[0]).dict(),
+                "sports_facilities": SportsFacilitiesSchema.from_orm(site.sports_facilities[0]).dict(),
+            }
+            features.append(Feature(geometry=geometry_to_geojson(site.geom), properties=properties))
+        return json.dumps(
+            jsonable_encoder(FeatureCollection(features)), ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+
+    def new_path():
+        loop = asyncio.new_event_loop()
+        try:
+            features = [loop.run_until_complete(make_site_geojson(site)) for site in sites]
+        finally:
+            loop.close()
+        return feature_collection(dump(feature) for feature in features)
+
+    assert json.loads(old_path()) == json.loads(new_path())
+    report("serialize", len(sites), {"pydantic+encoder": timed(old_path), "dicts+dump": timed(new_path)})
+
+
+# %% planar distances
+def bench_planar(repeat_sites=100):
+    # point-to-site distances on the spheroid (what the snapshot and PostGIS geography do) against plain
+    # euclidean distances on the sites projected to UTM 15N, as planar mode stores them
+    from shapely.geometry import Point
+
+    from ..api.planar import planar_point, to_planar
+    from ..api.snapshot import geodesic_distance
+
+    longitude, latitude = -93.40, 44.90
+    polygons = [shape.to_shape(element) for element in site_geometries()] * repeat_sites
+    projected = [to_planar(polygon) for polygon in polygons]
+    origin = Point(planar_point(longitude, latitude))
+
+    spheroid = [geodesic_distance(longitude, latitude, polygon) for polygon in polygons]
+    planar = [polygon.distance(origin) for polygon in projected]
+    worst = max(abs(p - g) / g for p, g in zip(planar, spheroid) if g > 0)
+
+    report(
+        "planar",
+        len(polygons),
+        {
+            "spheroid": timed(lambda: [geodesic_distance(longitude, latitude, polygon) for polygon in polygons]),
+            "planar": timed(lambda: [polygon.distance(origin) for polygon in projected]),
+        },
+    )
+    print(f"{'planar':<10} max relative error={worst:.5%}")
+
+
+def bench_centroid(grid=60):
+    # snapshot radius queries settled by centroid distance and reach first, against measuring every candidate
+    # polygon.  the sites are copies of the sample polygons spread on a grid around the metro
+    from shapely import affinity
+
+    from ..api.geometry import centroid_reach
+    from ..api.snapshot import SiteSnapshot, SnapshotEntry, geodesic_distance
+
+    samples = [shape.to_shape(element) for element in site_geometries()]
+    entries = []
+    for i in range(grid * grid):
+        polygon = samples[i % len(samples)]
+        offset_x = -93.60 - polygon.centroid.x + (i % grid) * 0.005
+        offset_y = 44.80 - polygon.centroid.y + (i // grid) * 0.005
+        polygon = affinity.translate(polygon, offset_x, offset_y)
+        entries.append(SnapshotEntry(str(i), polygon, {}, {}, centroid_reach(polygon)))
+    snapshot = SiteSnapshot()
+    snapshot.build(entries)
+
+    longitude, latitude, radius = -93.45, 44.95, 8000.0
+
+    def exact():
+        return [
+            entries[position]
+            for position in snapshot.candidates(longitude, latitude, radius)
+            if geodesic_distance(longitude, latitude, entries[position].geom) <= radius
+        ]
+
+    assert snapshot.query(latitude, longitude, radius, {}) == exact()
+    report(
+        "centroid",
+        len(entries),
+        {
+            "exact": timed(exact),
+            "two-stage": timed(lambda: snapshot.search(latitude, longitude, radius, {})),
+        },
+    )
+
+
+def bench_bulk_load(sites=100_000):
+    # rows/second for the bulk loader: building the sites records from a geodataframe, then COPYing them into
+    # a temp copy of the sites table, against executemany INSERTs of the same records.
+    # the db half needs SECRET_URL to point at a PostGIS database with the tables created
+    import asyncio
+
+    import asyncpg
+    import geopandas as gpd
+    import pandas as pd
+    from shapely import affinity
+
+    from ..api.models.tables import Site
+    from .bulk_load import connection_url, copy_records, geometry_codec, site_frame, table_records
+
+    samples = [shape.to_shape(element) for element in site_geometries()]
+    grid = int(np.ceil(np.sqrt(sites)))
+    geometries = [
+        affinity.translate(samples[i % len(samples)], (i % grid) * 0.002, (i // grid) * 0.002)
+        for i in range(sites)
+    ]
+    data = gpd.GeoDataFrame(
+        {
+            "SITE_NAME": "Site",
+            "ADDR_STR_1": "1 Main St",
+            "ADDR_CITY": "Eden Prairie",
+            "ADDR_STATE": "MN",
+            "ADDR_ZIP": 55344,
+        },
+        geometry=geometries,
+        index=pd.Index([f"S{i:07d}" for i in range(sites)], name="USER_SITE_"),
+        crs="EPSG:4326",
+    )
+
+    started = time.perf_counter()
+    columns, records = table_records(Site.__table__, site_frame(data))
+    elapsed = time.perf_counter() - started
+    print(f"{'bulk load':<10} n={sites:<9} prepare={sites / elapsed:,.0f} rows/s")
+
+    async def copy_and_insert():
+        conn = await asyncpg.connect(connection_url(os.environ["SECRET_URL"]))
+        try:
+            await geometry_codec(conn)
+            await conn.execute("CREATE TEMP TABLE bench_sites (LIKE sites)")
+
+            started = time.perf_counter()
+            async with conn.transaction():
+                await copy_records(conn, "bench_sites", columns, records)
+            copy_rate = sites / (time.perf_counter() - started)
+
+            # inserts are far slower, so they get a slice of the records
+            sample = records[:10_000]
+            placeholders = ", ".join(f"${i + 1}" for i in range(len(columns)))
+            await conn.execute("TRUNCATE bench_sites")
+            started = time.perf_counter()
+            async with conn.transaction():
+                await conn.executemany(
+                    f"INSERT INTO bench_sites ({', '.join(columns)}) VALUES ({placeholders})", sample
+                )
+            insert_rate = len(sample) / (time.perf_counter() - started)
+        finally:
+            await conn.close()
+        print(f"{'bulk load':<10} n={sites:<9} copy={copy_rate:,.0f} rows/s  insert={insert_rate:,.0f} rows/s")
+
+    try:
+        asyncio.run(copy_and_insert())
+    except (OSError, KeyError, asyncpg.PostgresError) as e:
+        print(f"{'bulk load':<10} no database to copy into ({e!r})")
+
+
+BENCHMARKS = {
+    "filters": bench_filters,
+    "geometry": bench_geometry,
+    "formats": bench_formats,
+    "serialize": bench_serialize,
+    "planar": bench_planar,
+    "centroid": bench_centroid,
+    "bulk_load": bench_bulk_load,
+}
+
+if __name__ == "__main__":
+    # run the benchmarks named on the command line, or all of them
+    for name in sys.argv[1:] or list(BENCHMARKS):
+        BENCHMARKS[name]()
@@ -0,0 +1,165 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+import asyncpg
+import pandas as pd
+import geopandas as gpd
+from pandas import DataFrame
+from sqlalchemy import Boolean, DateTime, Integer, Table
+from sqlalchemy.engine import make_url
+
+from ..api.geometry import DETAIL_COLUMNS, DETAIL_TOLERANCES
+from ..api.models.tables import Base
+from ..api.planar import PLANAR_SRID
+from .geometry_arrays import GeometryArrays, box_ewkb, point_ewkb
+
+try:
+    import pyogrio
+except ImportError:  # pragma: no cover
+    pyogrio = None
+
+# BULK LOADING
+# tables are streamed into postgres with COPY (asyncpg's copy_records_to_table) instead of one ORM object
+# and INSERT per row.  the dataframes become column arrays, then records, and each table is copied in its own
+# transaction, in dependency order so the attribute tables always find their sites.
+# geometry is sent as EWKB- binary COPY hands it to PostGIS as is, with no text parsing on either side
+
+# rows per COPY round trip, so a region-wide load never holds one giant buffer
+COPY_BATCH_SIZE = 50_000
+
+
+def read_sites(path: str, columns: List[str]) -> gpd.GeoDataFrame:
+    # the site polygons and the given attribute columns from a shapefile or geojson
+    # pyogrio reads through GDAL's arrow/columnar path and is much faster than fiona's feature by feature reads.
+    # it's in requirements.txt; fiona is only the fallback for environments without it
+    if pyogrio is not None:
+        return pyogrio.read_dataframe(path, columns=columns)
+    return gpd.read_file(path)[columns + ["geometry"]]
+
+
+def validate_sites(data: DataFrame) -> DataFrame:
+    # checks every site geometry at once, and repairs the ones that can be
+    # validity is judged on x and y- z values are dropped when the EWKB is written, see utils.geometry_arrays.
+    # invalid polygons (ie: self intersecting rings) are rebuilt with a zero buffer; empty geometries and
+    # anything other than a single polygon can't be stored in sites.geom, so they stop the load
+    geometry = data.geometry
+    invalid = ~geometry.is_valid
+    if invalid.any():
+        print(f"VALIDATE: repairing {int(invalid.sum())} invalid geometries")
+        data = data.copy()
+        data.loc[invalid, data.geometry.name] = geometry[invalid].buffer(0)
+        geometry = data.geometry
+
+    bad = geometry.is_empty | (geometry.geom_type != "Polygon")
+    if bad.any():
+        raise ValueError(f"sites without a single polygon geometry: {list(data.index[bad])}")
+    return data
+
+
+def site_frame(data: DataFrame) -> DataFrame:
+    # a sites table row for each playground in the geodataframe, indexed by site id
+    # the geometry columns are built as whole arrays, see utils.geometry_arrays: the original, the planar copy,
+    # and the centroid, box and reach used to settle radius queries.  the levels of detail are simplified by
+    # GEOS, a column at a time, and written the same way.  every column comes out 2D, whatever the source
+    data = data[~data.index.duplicated()].set_crs(epsg=4326, allow_override=True)
+    data = validate_sites(data)
+    arrays = GeometryArrays([geom.wkb for geom in data.geometry])
+    centroids = arrays.centroids()
+
+    frame = DataFrame(
+        {
+            "site_id": data.index,
+            "site_name": data.SITE_NAME.values,
+            "addr_street1": data.ADDR_STR_1.values,
+            "addr_city": data.ADDR_CITY.values,
+            "addr_state": data.ADDR_STATE.values,
+            "addr_zip": data.ADDR_ZIP.astype(int).values,
+            "geom": arrays.ewkb(4326),
+            "geom_planar": arrays.ewkb(PLANAR_SRID, arrays.reproject(4326, PLANAR_SRID)),
+            "centroid": point_ewkb(centroids, 4326),
+            "bbox": box_ewkb(arrays.bounds(), 4326),
+            "max_radius": arrays.reaches(centroids),
+        }
+    )
+    for detail, tolerance in DETAIL_TOLERANCES.items():
+        if tolerance is not None:
+            simplified = data.geometry.simplify(tolerance, preserve_topology=True)
+            frame[DETAIL_COLUMNS[detail]] = GeometryArrays([geom.wkb for geom in simplified]).ewkb(4326)
+    return frame.set_index("site_id", drop=False)
+
+
+def table_records(table: Table, frame: DataFrame) -> Tuple[List[str], List[Tuple]]:
+    # the table's columns present in the frame, and the frame as records of plain python values
+    # numpy scalars, NaN and pandas timestamps are converted to what asyncpg's binary encoders expect
+    columns = [col.name for col in table.columns if col.name in frame.columns]
+    data = {}
+    for name in columns:
+        values = frame[name]
+        kind = table.columns[name].type
+        if isinstance(kind, DateTime):
+            # timestamp columns are naive utc
+            values = pd.to_datetime(values, utc=True).dt.tz_convert(None)
+            values = pd.Series(values.dt.to_pydatetime(), index=frame.index, dtype=object)
+        elif isinstance(kind, Integer):
+            # csv columns with blanks are read as floats
+            values = values.astype("Int64")
+        elif isinstance(kind, Boolean):
+            values = values.map(lambda value: None if pd.isna(value) else bool(value))
+        data[name] = values.astype(object).where(values.notna(), None)
+
+    records = list(zip(*(data[name].tolist() for name in columns))) if columns else []
+    return columns, records
+
+
+def connection_url(url: str) -> str:
+    # asyncpg takes a plain postgresql:// url, without sqlalchemy's driver suffix
+    return make_url(url).set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+async def copy_records(
+    conn, table_name: str, columns: List[str], records: List[Tuple], schema_name: Optional[str] = None
+) -> int:
+    # copies the records into the table in batches, within the caller's transaction
+    for start in range(0, len(records), COPY_BATCH_SIZE):
+        await conn.copy_records_to_table(
+            table_name,
+            records=records[start : start + COPY_BATCH_SIZE],
+            columns=columns,
+            schema_name=schema_name,
+        )
+    return len(records)
+
+
+async def geometry_codec(conn):
+    # asyncpg has no encoder for postgis types- geometry values are already EWKB bytes, so pass them through
+    await conn.set_type_codec(
+        "geometry", schema="public", encoder=bytes, decoder=bytes, format="binary"
+    )
+
+
+async def copy_tables(url: str, frames: Dict[str, DataFrame]) -> Dict[str, int]:
+    # copies each frame into the table of the same name, one transaction per table, parents first
+    # returns the rows copied per table
+    counts = {}
+    conn = await asyncpg.connect(connection_url(url))
+    try:
+        await geometry_codec(conn)
+        for table in Base.metadata.sorted_tables:
+            frame = frames.get(table.name)
+            if frame is None or frame.empty:
+                continue
+            columns, records = table_records(table, frame)
+            started = time.perf_counter()
+            async with conn.transaction():
+                counts[table.name] = await copy_records(conn, table.name, columns, records)
+            elapsed = time.perf_counter() - started
+            rate = len(records) / elapsed if elapsed else 0
+            print(f"COPY: {table.name} {len(records)} rows in {elapsed:.2f}s ({rate:,.0f} rows/s)")
+    finally:
+        await conn.close()
+    return counts
+
+
+def load(url: str, frames: Dict[str, DataFrame]) -> Dict[str, int]:
+    return asyncio.run(copy_tables(url, frames))
@@ -2,11 +2,14 @@ import asyncio
 import os
 
 from sqlalchemy import text, MetaData
+from sqlalchemy.schema import CreateIndex
 
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
-from playground_planner.api.models.tables import Base
+from playground_planner.api.dataset import bump_version_statement
+from playground_planner.api.models.tables import Base, DatasetVersion
+from playground_planner.api.views import create_view_statements, drop_view_statement
 
 
 class SpatialDB:
@@ -30,15 +33,31 @@ class SpatialDB:
     async def make_db():
         # use to create all tables defined in models.py
         # models must inherit from Base
+        # create_all only indexes the tables it creates, so declared indexes are added to existing tables too
         async with SpatialDB.engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    await conn.execute(CreateIndex(index, if_not_exists=True))
 
     @staticmethod
     async def reset_db():
         # use to drop all tables when resetting database
+        # this empties the tables while it runs- to update the data of a live api, use the loader's incremental mode
+        # the dataset version is kept and bumped, so running apis and client etags notice the data changed
+        tables = [
+            table
+            for table in Base.metadata.sorted_tables
+            if table is not DatasetVersion.__table__
+        ]
+        # the site view sits on the tables, so it's dropped first and rebuilt (empty) after
         async with SpatialDB.engine.begin() as conn:
-            await conn.run_sync(Base.metadata.drop_all)
+            await conn.execute(drop_view_statement)
+            await conn.run_sync(Base.metadata.drop_all, tables=tables)
             await conn.run_sync(Base.metadata.create_all)
+            for statement in create_view_statements():
+                await conn.execute(statement)
+            await conn.execute(bump_version_statement())
 
     @staticmethod
     async def enable_PostGIS(engine):
@@ -0,0 +1,50 @@
+import json
+import os
+from typing import Dict, List
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.engine import create_engine
+
+# CHECKS THAT RADIUS QUERIES USE THE SPATIAL INDEXES
+# run from the directory above the package, ie:
+#   python -m playground_planner.utils.explain
+# sequential scans are switched off for the check, since with a few dozen sites a scan is cheaper and the
+# planner would rightly pick it- what matters is that an index *can* answer the query as written
+
+INDEX_SCANS = ("Index Scan", "Index Only Scan", "Bitmap Index Scan")
+
+
+def index_scans(plan: Dict) -> List[str]:
+    # names of the indexes an EXPLAIN (FORMAT JSON) plan node, or any node under it, scans
+    found = []
+    if plan.get("Node Type") in INDEX_SCANS:
+        found.append(plan.get("Index Name"))
+    for child in plan.get("Plans", []):
+        found.extend(index_scans(child))
+    return found
+
+
+def explain(conn, statement) -> Dict:
+    # the top plan node for a statement, with sequential scans discouraged for this transaction only
+    sql = statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+    conn.execute(text("SET LOCAL enable_seqscan = off"))
+    res = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))
+    plan = res.scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+def radius_query_indexes(conn, latitude: float = 44.85, longitude: float = -93.47, radius: float = 16093.0):
+    from ..api import radius_query_sql
+
+    return index_scans(explain(conn, radius_query_sql(latitude, longitude, radius, {}).statement))
+
+
+if __name__ == "__main__":
+    engine = create_engine(url=os.environ.get("SECRET_URL"), echo=False)
+    with engine.begin() as conn:
+        used = radius_query_indexes(conn)
+    print(f"radius query index scans: {used}")
+    assert used, "radius query does not use a spatial index"
@@ -0,0 +1,174 @@
+import struct
+from typing import List, Optional
+
+import numpy as np
+from pyproj import Transformer
+
+from ..api.geometry import GEOD, EWKB_SRID, MULTIPOLYGON, POLYGON, polygon_spans
+
+# VECTORIZED GEOMETRY
+# shapely 1.8 costs tens of microseconds per call per geometry, which is most of a region-wide load.
+# instead, every site's WKB is walked once with api.geometry's decoder, finding each ring in the bytes, and every
+# point's x and y is gathered in one indexed read.  z and m values, ie: from the PolygonZ shapefile, are
+# dropped there, since sites are stored 2D.
+# from there, coordinates, bounds, centroids, reach and reprojected copies are whole-array numpy operations,
+# and EWKB is written back from the rings, little endian and 2D, with the srid in its header.
+# polygons and multipolygons are handled, in either byte order
+
+POINT_BYTES = 16  # two little endian doubles
+
+# byte offsets of a point's x and y, read as little endian doubles
+LITTLE_ENDIAN_XY = np.arange(POINT_BYTES)
+BIG_ENDIAN_XY = np.concatenate((np.arange(7, -1, -1), np.arange(15, 7, -1)))
+
+
+class GeometryArrays:
+    # polygon and multipolygon WKB for many geometries, with their coordinates as one (points, 2) array
+
+    def __init__(self, wkbs: List[bytes]):
+        self.kinds: List[int] = []  # POLYGON or MULTIPOLYGON, per geometry
+        self.polygon_rings: List[List[int]] = []  # rings in each polygon, per geometry
+
+        # every ring's place in the joined buffer: its first coordinate, points, dimensions and byte order
+        offsets, counts, dims, big, ring_geoms, exterior = [], [], [], [], [], []
+        base = 0
+        for index, wkb in enumerate(wkbs):
+            kind, polygons = polygon_spans(wkb)
+            self.kinds.append(kind)
+            self.polygon_rings.append([len(spans) for _, _, spans in polygons])
+            for endian, ring_dims, spans in polygons:
+                for ring, (offset, count) in enumerate(spans):
+                    offsets.append(base + offset)
+                    counts.append(count)
+                    dims.append(ring_dims)
+                    big.append(endian == ">")
+                    ring_geoms.append(index)
+                    exterior.append(ring == 0)
+            base += len(wkb)
+
+        self.ring_counts = np.asarray(counts, dtype=np.int64)
+        self.ring_geoms = np.asarray(ring_geoms, dtype=np.int64)
+        self.exterior = np.asarray(exterior, dtype=bool)
+        self.point_geoms = np.repeat(self.ring_geoms, self.ring_counts)
+
+        # first point of each ring, and of each geometry, in the coordinate array
+        self.ring_starts = np.concatenate(([0], np.cumsum(self.ring_counts)[:-1])).astype(np.int64)
+        geom_rings = np.searchsorted(self.ring_geoms, np.arange(len(wkbs)))
+        self.geom_starts = self.ring_starts[geom_rings] if len(self.ring_starts) else geom_rings
+
+        # each point's x and y bytes, gathered in one indexed read- the stride skips any z and m values,
+        # and big endian doubles have their bytes taken in reverse
+        point_rings = np.repeat(np.arange(len(counts)), self.ring_counts)
+        strides = np.asarray(dims, dtype=np.int64)[point_rings] * 8
+        within = np.arange(len(point_rings)) - self.ring_starts[point_rings] if len(counts) else point_rings
+        starts = np.asarray(offsets, dtype=np.int64)[point_rings] + within * strides
+        order = np.where(np.asarray(big, dtype=bool)[point_rings, None], BIG_ENDIAN_XY, LITTLE_ENDIAN_XY)
+        data = np.frombuffer(b"".join(wkbs), dtype=np.uint8)
+        self.coords = data[starts[:, None] + order].view("<f8") if len(counts) else np.empty((0, 2))
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def ewkb(self, srid: int, coords: Optional[np.ndarray] = None) -> List[bytes]:
+        # 2D EWKB for every geometry, optionally with its coordinates swapped for others, ie: reprojected
+        values = np.ascontiguousarray(self.coords if coords is None else coords, dtype="<f8").tobytes()
+        counts, starts = self.ring_counts.tolist(), self.ring_starts.tolist()
+        found, ring = [], 0
+        for kind, polygon_rings in zip(self.kinds, self.polygon_rings):
+            parts = [struct.pack("<BII", 1, kind | EWKB_SRID, srid)]
+            if kind == MULTIPOLYGON:
+                parts.append(struct.pack("<I", len(polygon_rings)))
+            for ring_count in polygon_rings:
+                if kind == MULTIPOLYGON:
+                    parts.append(struct.pack("<BII", 1, POLYGON, ring_count))
+                else:
+                    parts.append(struct.pack("<I", ring_count))
+                for _ in range(ring_count):
+                    start, count = starts[ring], counts[ring]
+                    parts.append(struct.pack("<I", count))
+                    parts.append(values[start * POINT_BYTES : (start + count) * POINT_BYTES])
+                    ring += 1
+            found.append(b"".join(parts))
+        return found
+
+    def reproject(self, from_epsg: int, to_epsg: int) -> np.ndarray:
+        # every coordinate transformed in one call
+        transformer = Transformer.from_crs(from_epsg, to_epsg, always_xy=True)
+        x, y = transformer.transform(self.coords[:, 0], self.coords[:, 1])
+        return np.column_stack((x, y))
+
+    def bounds(self) -> np.ndarray:
+        # (minx, miny, maxx, maxy) per geometry
+        x, y = self.coords[:, 0], self.coords[:, 1]
+        return np.column_stack(
+            (
+                np.minimum.reduceat(x, self.geom_starts),
+                np.minimum.reduceat(y, self.geom_starts),
+                np.maximum.reduceat(x, self.geom_starts),
+                np.maximum.reduceat(y, self.geom_starts),
+            )
+        )
+
+    def centroids(self) -> np.ndarray:
+        # area weighted (x, y) centroid per geometry, as GEOS computes it: shells add area, holes take it away
+        # each geometry is measured relative to its first point, to keep the products small
+        origin = self.coords[self.geom_starts][self.point_geoms]
+        local = self.coords - origin
+        x, y = local[:, 0], local[:, 1]
+        # each point with the next one in its ring- rings are closed, so the last point pairs with nothing
+        nx, ny = np.roll(x, -1), np.roll(y, -1)
+        last = np.zeros(len(x), dtype=bool)
+        last[self.ring_starts + self.ring_counts - 1] = True
+        cross = np.where(last, 0.0, x * ny - nx * y)
+
+        area = np.add.reduceat(cross, self.ring_starts) / 2
+        cx = np.add.reduceat((x + nx) * cross, self.ring_starts) / 6
+        cy = np.add.reduceat((y + ny) * cross, self.ring_starts) / 6
+        # orientation varies between sources, so the sign comes from whether the ring is a shell or a hole
+        sign = np.where(self.exterior, 1.0, -1.0) * np.sign(area)
+        weight = np.bincount(self.ring_geoms, sign * area, minlength=len(self))
+        sx = np.bincount(self.ring_geoms, sign * cx, minlength=len(self))
+        sy = np.bincount(self.ring_geoms, sign * cy, minlength=len(self))
+        first = self.coords[self.geom_starts]
+        return np.column_stack((first[:, 0] + sx / weight, first[:, 1] + sy / weight))
+
+    def reaches(self, centroids: np.ndarray) -> np.ndarray:
+        # meters from each centroid to the furthest vertex of its geometry, in one geodesic call
+        lon, lat = centroids[self.point_geoms, 0], centroids[self.point_geoms, 1]
+        _, _, distance = GEOD.inv(lon, lat, self.coords[:, 0], self.coords[:, 1])
+        return np.maximum.reduceat(distance, self.geom_starts)
+
+
+def box_ewkb(bounds: np.ndarray, srid: int) -> List[bytes]:
+    # EWKB polygons for (minx, miny, maxx, maxy) rows, written as one array
+    minx, miny, maxx, maxy = bounds.T
+    # counterclockwise from the bottom right, closed- the same ring as shapely's box()
+    ring = np.stack(
+        [
+            np.column_stack((maxx, miny)),
+            np.column_stack((maxx, maxy)),
+            np.column_stack((minx, maxy)),
+            np.column_stack((minx, miny)),
+            np.column_stack((maxx, miny)),
+        ],
+        axis=1,
+    )
+    header = np.frombuffer(
+        b"\x01" + struct.pack("<IIII", POLYGON | EWKB_SRID, srid, 1, 5), dtype=np.uint8
+    )
+    return fixed_ewkb(header, ring.reshape(len(bounds), -1))
+
+
+def point_ewkb(points: np.ndarray, srid: int) -> List[bytes]:
+    # EWKB points for (x, y) rows, written as one array
+    header = np.frombuffer(b"\x01" + struct.pack("<II", 1 | EWKB_SRID, srid), dtype=np.uint8)
+    return fixed_ewkb(header, points)
+
+
+def fixed_ewkb(header: np.ndarray, values: np.ndarray) -> List[bytes]:
+    # geometries that are all the same shape: a shared header, then each row of doubles
+    body = np.ascontiguousarray(values, dtype="<f8").view(np.uint8).reshape(len(values), -1)
+    rows = np.hstack((np.broadcast_to(header, (len(values), len(header))), body))
+    size = rows.shape[1]
+    data = rows.tobytes()
+    return [data[start : start + size] for start in range(0, len(data), size)]
@@ -0,0 +1,182 @@
+import asyncio
+import hashlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+import asyncpg
+from pandas import DataFrame
+from sqlalchemy import Table
+from sqlalchemy.dialects import postgresql
+
+from ..api.dataset import bump_version_statement
+from ..api.models.tables import Base, LoadHash
+from ..api.views import create_view_statements, refresh_view_statement
+from .bulk_load import connection_url, copy_records, geometry_codec, table_records
+
+# INCREMENTAL LOADING
+# instead of dropping and recreating every table, each incoming row is hashed and compared with the hash stored
+# when it was last written (load_hashes).  only new, changed and removed rows are written: changed and new rows
+# are COPYed into a temp table and upserted with INSERT ... ON CONFLICT, removed rows are deleted.
+# everything, including the site view refresh and the dataset version bump, happens in one transaction,
+# so the api keeps serving the old data until the new data is complete, and never sees empty tables
+
+HASH_TABLE = LoadHash.__table__
+
+
+@dataclass
+class TableDiff:
+    # what an incremental load changes in one table
+    table: Table
+    columns: List[str]
+    upserts: List[Tuple] = field(default_factory=list)  # records to insert or update
+    hashes: Dict[str, str] = field(default_factory=dict)  # row key -> hash, for the upserted rows
+    deletes: List = field(default_factory=list)  # primary key values of rows no longer in the data
+    inserted: int = 0
+    updated: int = 0
+
+    @property
+    def counts(self) -> Dict[str, int]:
+        return {"inserted": self.inserted, "updated": self.updated, "deleted": len(self.deletes)}
+
+
+def key_column(table: Table) -> str:
+    # the loaded tables are all keyed by a single column
+    (column,) = table.primary_key.columns
+    return column.name
+
+
+def row_hash(record: Tuple) -> str:
+    # records hold plain python values (and EWKB bytes for geometry), so their repr is stable between runs
+    return hashlib.sha1(repr(record).encode()).hexdigest()
+
+
+def frame_hashes(table: Table, frame: DataFrame) -> Tuple[List[str], List[Tuple], List[str], List[str]]:
+    # (columns, records, row keys, row hashes) for a table's frame
+    columns, records = table_records(table, frame)
+    position = columns.index(key_column(table))
+    keys = [str(record[position]) for record in records]
+    return columns, records, keys, [row_hash(record) for record in records]
+
+
+def hash_frame(frames: Dict[str, DataFrame]) -> DataFrame:
+    # the load_hashes rows for a full load, so the next load can be incremental
+    rows = []
+    for name, frame in frames.items():
+        table = Base.metadata.tables[name]
+        _, _, keys, hashes = frame_hashes(table, frame)
+        rows.extend((name, key, digest) for key, digest in zip(keys, hashes))
+    return DataFrame(rows, columns=["table_name", "row_key", "row_hash"])
+
+
+def diff_table(
+    table: Table, frame: DataFrame, stored_keys: List, stored_hashes: Dict[str, str]
+) -> TableDiff:
+    # compares a table's incoming frame with the keys in the table and the hashes they were written with
+    # rows written before hashes were kept have no stored hash, so they count as changed
+    columns, records, keys, hashes = frame_hashes(table, frame)
+    diff = TableDiff(table, columns)
+    existing = {str(key) for key in stored_keys}
+    for record, key, digest in zip(records, keys, hashes):
+        if key not in existing:
+            diff.inserted += 1
+        elif stored_hashes.get(key) != digest:
+            diff.updated += 1
+        else:
+            continue
+        diff.upserts.append(record)
+        diff.hashes[key] = digest
+
+    incoming = set(keys)
+    diff.deletes = [key for key in stored_keys if str(key) not in incoming]
+    return diff
+
+
+def upsert_sql(table_name: str, stage_name: str, columns: List[str], keys: List[str]) -> str:
+    # moves the staged rows into the table, overwriting the rows they share a key with
+    names = ", ".join(columns)
+    updates = ", ".join(f"{name} = EXCLUDED.{name}" for name in columns if name not in keys)
+    action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+    return (
+        f"INSERT INTO {table_name} ({names}) SELECT {names} FROM {stage_name} "
+        f"ON CONFLICT ({', '.join(keys)}) {action}"
+    )
+
+
+async def upsert(conn, table: Table, columns: List[str], records: List[Tuple]):
+    # COPY into a temp table shaped like the target, then one INSERT ... ON CONFLICT from it
+    stage_name = f"stage_{table.name}"
+    await conn.execute(
+        f"CREATE TEMP TABLE {stage_name} (LIKE {table.name} INCLUDING DEFAULTS) ON COMMIT DROP"
+    )
+    await copy_records(conn, stage_name, columns, records)
+    keys = [col.name for col in table.primary_key.columns]
+    await conn.execute(upsert_sql(table.name, stage_name, columns, keys))
+
+
+async def apply_diffs(conn, diffs: List[TableDiff]) -> int:
+    # writes every table's changes in one transaction and returns the new dataset version
+    # deletes go children first and upserts parents first, so foreign keys hold at every step
+    async with conn.transaction():
+        for diff in reversed(diffs):
+            if diff.deletes:
+                key = key_column(diff.table)
+                await conn.execute(f"DELETE FROM {diff.table.name} WHERE {key} = ANY($1)", diff.deletes)
+                await conn.execute(
+                    f"DELETE FROM {HASH_TABLE.name} WHERE table_name = $1 AND row_key = ANY($2)",
+                    diff.table.name,
+                    [str(key) for key in diff.deletes],
+                )
+
+        hashes = []
+        for diff in diffs:
+            if diff.upserts:
+                await upsert(conn, diff.table, diff.columns, diff.upserts)
+                hashes.extend((diff.table.name, key, digest) for key, digest in diff.hashes.items())
+        if hashes:
+            await upsert(conn, HASH_TABLE, [col.name for col in HASH_TABLE.columns], hashes)
+
+        # the site view is refreshed concurrently, so it stays readable, and in this transaction,
+        # so it changes when the tables do
+        for statement in create_view_statements():
+            await conn.execute(str(statement))
+        await conn.execute(str(refresh_view_statement))
+
+        bump = bump_version_statement().compile(
+            dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+        )
+        return await conn.fetchval(str(bump))
+
+
+async def load_incremental(url: str, frames: Dict[str, DataFrame]) -> Dict[str, Dict[str, int]]:
+    # diffs each frame against its table and writes only the changes
+    # returns the inserted, updated and deleted counts per table
+    conn = await asyncpg.connect(connection_url(url))
+    try:
+        await geometry_codec(conn)
+        diffs = []
+        for table in Base.metadata.sorted_tables:
+            frame = frames.get(table.name)
+            if frame is None:
+                continue
+            key = key_column(table)
+            stored_keys = [row[0] for row in await conn.fetch(f"SELECT {key} FROM {table.name}")]
+            rows = await conn.fetch(
+                f"SELECT row_key, row_hash FROM {HASH_TABLE.name} WHERE table_name = $1", table.name
+            )
+            diffs.append(diff_table(table, frame, stored_keys, dict(rows)))
+
+        counts = {diff.table.name: diff.counts for diff in diffs}
+        if any(diff.upserts or diff.deletes for diff in diffs):
+            version = await apply_diffs(conn, diffs)
+            print(f"INCREMENTAL: dataset version {version}")
+        else:
+            print("INCREMENTAL: no changes")
+        for name, change in counts.items():
+            print(f"INCREMENTAL: {name} {change}")
+    finally:
+        await conn.close()
+    return counts
+
+
+def load(url: str, frames: Dict[str, DataFrame]) -> Dict[str, Dict[str, int]]:
+    return asyncio.run(load_incremental(url, frames))
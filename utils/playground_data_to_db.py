@@ -1,8 +1,6 @@
 import os
-from typing import Callable, AnyStr
+from concurrent.futures import ThreadPoolExecutor
 
-import geopandas as gpd
-import numpy as np
 import pandas as pd
 import requests
 from icecream import ic
@@ -11,13 +9,19 @@ from passlib.context import CryptContext
 from sqlalchemy.engine import create_engine
 from sqlalchemy.orm import sessionmaker
 
-from ..api.models.tables import (
-    Site,
-    Equipment,
-    Amenities,
-    SportsFacilities,
-    Base,
-    Episodes,
+from ..api.models.tables import Base, DatasetVersion
+from ..api.dataset import bump_version_statement
+from . import bulk_load, incremental_load, site_view
+
+# LOAD MODES
+# incremental (the default) writes only the rows that changed since the last load, in one transaction,
+# so the api keeps serving while it runs.  set INCREMENTAL_LOAD=false to drop every table and reload it all,
+# ie: after the table definitions change
+INCREMENTAL_LOAD = os.environ.get("INCREMENTAL_LOAD", "true").lower() in ("1", "true", "yes")
+
+# where the site polygons are read from: a shapefile, or the same data as geojson (data/json/playgrounds.json)
+SITES_PATH = os.environ.get(
+    "SITES_PATH", "~/playground_planner/playground_planner/data/shp/playgrounds_geocoded.shp"
 )
 
 pd.set_option("display.max_rows", None)
@@ -38,14 +42,8 @@ class PlaygroundLoader:
     def __init__(self):
         self.data = None
         self.sites = None
-        self.inserts = {
-            "sites": [],
-            "equipment": [],
-            "amenities": [],
-            "sports_facilities": [],
-            "users": [],
-            "episodes": [],
-        }
+        # a dataframe per table, with the table's column names- see utils.bulk_load
+        self.frames = {}
 
     def set_data(self, data: DataFrame):
         # sets data object used in program
@@ -54,28 +52,8 @@ class PlaygroundLoader:
         data = data.set_index("USER_SITE_")  # sorry for the janky columns
         self.data = data
 
-    def class_from_row(
-        self, row: pd.Series, class_to_use: Callable, key: AnyStr, index_col: AnyStr
-    ):
-        #### EXTREMELY USEFUL
-        # create class object for model: Site, Equipment, Amenity, etc. using abstract factory pattern
-        table_row = class_to_use()
-
-        for col in row.index:  # grab the row columns
-            # give our model object these attributes
-            val = row[col]
-            if isinstance(val, np.int64):
-                val = int(val)
-            setattr(table_row, col.lower(), val)
-
-        setattr(table_row, index_col, row._name)  # set site id attribute
-
-        # no you can't use a ternary operator for this
-        self.inserts[key].append(table_row)
-
     def import_data(self, path: str):
-        # copies CSV schema from path and uses it to fill with random numbers 1-10
-        # uses this function to make a row in a dataframe into the corresponding model object
+        # reads an attribute CSV from path (or the podcast episodes, with no path) into its table's frame
 
         if path:
             table_schema = pd.read_csv(path, index_col="SITE_ID")  # its columns
@@ -85,51 +63,27 @@ class PlaygroundLoader:
         elif not path:
             sentinel = None
         if not sentinel:
-            class_to_use = Episodes
             table_schema = self.import_podcast_episodes()
             key = "episodes"
         elif sentinel and sentinel == "equipment.csv":
-            class_to_use = Equipment
             key = "equipment"
         elif sentinel and sentinel == "amenities.csv":
-            class_to_use = Amenities
             key = "amenities"
         elif sentinel and sentinel == "sports_facilities.csv":
-            class_to_use = SportsFacilities
             key = "sports_facilities"
 
         table_schema.columns = [col.lower() for col in table_schema.columns]
+        if sentinel:
+            # the csv index is the site id column
+            table_schema = table_schema.rename_axis("site_id").reset_index()
         ic(table_schema)
-        # remember our really useful function?  now we just apply it to the dataframe...zwoop, row objects!
-        table_schema.apply(
-            lambda row: self.class_from_row(
-                row=row,
-                class_to_use=class_to_use,
-                key=key,
-                index_col="site_id" if sentinel else "id",
-            ),
-            axis=1,
-        )
+        # columns the table doesn't have are left behind when it's copied
+        self.frames[key] = table_schema
 
     # %% site processing
     def data_to_sites(self):
-
-        sites = self.data.index.unique().tolist()  # keys
-        self.data.set_crs(epsg=4326, inplace=True)
-        # loop through the playgrounds and make objects out of them
-        for pg in sites:
-            df = self.data.loc[pg]
-            self.inserts["sites"].append(
-                Site(
-                    site_id=df.name,
-                    site_name=df.SITE_NAME,
-                    addr_street1=df.ADDR_STR_1,
-                    addr_city=df.ADDR_CITY,
-                    addr_state=df.ADDR_STATE,
-                    addr_zip=int(df.ADDR_ZIP),
-                    geom=f"SRID=4326;{df.geometry.wkt}",
-                )
-            )
+        # one sites row per playground, geometry and all, built a column at a time
+        self.frames["sites"] = bulk_load.site_frame(self.data)
 
     def import_podcast_episodes(self) -> pd.DataFrame:
         headers = {"Content-Type": "application/json", "charset": "utf-8"}
@@ -150,14 +104,10 @@ class PlaygroundLoader:
         path_base = "~/playground_planner/playground_planner/data"
         csv_path = path_base + "/csv/real"
 
-        json_path = path_base + "/json/playgrounds.json"
         equipment_path = csv_path + "/equipment.csv"
         amenities_path = csv_path + "/amenities.csv"
         sports_facilities_path = csv_path + "/sports_facilities.csv"
 
-        data = gpd.read_file(json_path)
-        ic(data)
-
         keep_these_columns = [
             "USER_SITE_",
             "SITE_NAME",
@@ -166,32 +116,67 @@ class PlaygroundLoader:
             "ADDR_CITY",
             "ADDR_STATE",
             "ADDR_ZIP",
-            "geometry",
         ]
 
-        self.set_data(data=data[keep_these_columns])  # set data
+        # every source is read at once- the files and the podcast api are all waiting on io
+        with ThreadPoolExecutor() as pool:
+            sites = pool.submit(bulk_load.read_sites, os.path.expanduser(SITES_PATH), keep_these_columns)
+            imports = [
+                pool.submit(self.import_data, path)
+                for path in (equipment_path, amenities_path, sports_facilities_path, None)
+            ]
+            data = sites.result()
+            for future in imports:
+                future.result()  # raises anything that went wrong in the thread
+        ic(data)
+
+        self.set_data(data=data)  # set data
         self.data_to_sites()  # generate sites
-        self.import_data(equipment_path)  # import random data
-        self.import_data(amenities_path)  # and one more time
-        self.import_data(sports_facilities_path)
-        self.import_data(None)
 
-        # these are the lists of row objects we are inserting
-        keys = list(self.inserts.keys())
+        if INCREMENTAL_LOAD:
+            self.load_incremental()
+        else:
+            self.load_full()
 
+    def load_incremental(self):
+        # creates any tables that don't exist yet, then writes only what changed
+        Base.metadata.create_all(self.engine)
+        changes = incremental_load.load(self.url, self.frames)
+        ic(changes)
+
+    def load_full(self):
         # scrub the db real quick here
-        Base.metadata.drop_all(self.engine)
+        # the dataset version survives, so running apis can tell their caches are stale
+        # the site view sits on the tables, so it goes first
+        with self.engine.begin() as conn:
+            site_view.drop(conn)
+        Base.metadata.drop_all(
+            self.engine,
+            tables=[
+                table
+                for table in Base.metadata.sorted_tables
+                if table is not DatasetVersion.__table__
+            ],
+        )
         Base.metadata.create_all(self.engine)
 
-        # yay for context managers
-        # let's put some objects in our database
+        # stream every table in with COPY, parents first, one transaction each
+        # the row hashes go in too, so the next load can be incremental
+        frames = {**self.frames, "load_hashes": incremental_load.hash_frame(self.frames)}
+        counts = bulk_load.load(self.url, frames)
+        ic(counts)
+
+        # rebuild the site view the api reads features from
+        with self.engine.begin() as conn:
+            site_view.create(conn)
 
-        for key in keys:  # loop through tables
-            with self.Session() as s:
-                with s.begin():
-                    s.add_all(self.inserts[key])  # autocommit the whole dang thing
+        # tell the api there's new data
+        with self.Session() as s:
+            with s.begin():
+                version = s.execute(bump_version_statement()).scalar()
+        ic(version)
 
-        # that's it, just a loop that loads everything in like 2 seconds, nothing to see here
+        # that's it, a few COPYs that load everything in well under a second, nothing to see here
 
 
 # stuff runs here
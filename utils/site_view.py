@@ -0,0 +1,35 @@
+import os
+import sys
+
+from sqlalchemy.engine import create_engine
+
+from ..api.views import create_view_statements, drop_view_statement, refresh_view_statement
+
+# MANAGES THE SITE VIEW, see api.views
+# run from the directory above the package, ie:
+#   python -m playground_planner.utils.site_view refresh
+#   create: builds the view and its indexes, if they don't exist yet
+#   refresh: rebuilds the view's rows from the tables, without blocking readers
+#   drop: removes the view, ie: before the tables under it are dropped
+
+
+def create(conn):
+    for statement in create_view_statements():
+        conn.execute(statement)
+
+
+def refresh(conn):
+    conn.execute(refresh_view_statement)
+
+
+def drop(conn):
+    conn.execute(drop_view_statement)
+
+
+COMMANDS = {"create": create, "refresh": refresh, "drop": drop}
+
+if __name__ == "__main__":
+    engine = create_engine(url=os.environ.get("SECRET_URL"), echo=False)
+    with engine.begin() as conn:
+        for name in sys.argv[1:] or ["refresh"]:
+            COMMANDS[name](conn)